@@ -0,0 +1,430 @@
+import io
+import json
+import platform
+import random
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, ExitStack
+from time import perf_counter_ns
+from typing import Dict, Any, List, Callable, Iterable
+from unittest import mock
+
+import django
+import ldap3
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection as db_connection
+from django.http import HttpResponse
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path
+from django.utils import timezone
+
+from windows_auth import middleware as middleware_module, sync as sync_module, models as models_module, \
+    decorators as decorators_module
+from windows_auth.decorators import domain_required, ldap_sync_required
+from windows_auth.ldap import LDAPManager, _ldap_connections
+from windows_auth.models import LDAPUser, GroupIndex
+from windows_auth.settings import LDAPSettings
+from windows_auth.testing import ADEmulator, CallCounter, set_emulator
+
+# version of the results file format
+RESULTS_VERSION = 1
+
+BENCHMARK_DOMAIN = "BENCH"
+SEARCH_BASE = "DC=bench,DC=local"
+DOMAIN_SID = "S-1-5-21-1000-2000-3000"
+
+
+class SyntheticDirectory:
+    """
+    Generated Active Directory like users and nested groups.
+
+    Groups are spread over the nesting levels, each group below the top level is a member of a random group
+    from the level above. Users are direct members of random groups.
+    """
+
+    def __init__(self, users: int = 1000, groups: int = 200, depth: int = 3, groups_per_user: int = 5,
+                 seed: int = 0):
+        self.params = {"users": users, "groups": groups, "depth": depth, "groups_per_user": groups_per_user,
+                       "seed": seed}
+        rng = random.Random(seed)
+        depth = max(depth, 1)
+
+        self.groups = [f"Group {index}" for index in range(groups)]
+        # group index to its nesting level, level 0 groups are not nested in other groups
+        levels = {index: index % depth for index in range(groups)}
+        by_level = {level: [index for index in levels if levels[index] == level] for level in range(depth)}
+        self.parents = {
+            index: [rng.choice(by_level[levels[index] - 1])] if levels[index] and by_level[levels[index] - 1] else []
+            for index in range(groups)
+        }
+
+        self.users = [f"user{index}" for index in range(users)]
+        self.member_of = {
+            username: rng.sample(range(groups), min(groups_per_user, groups))
+            for username in self.users
+        }
+
+    def group_dn(self, index: int) -> str:
+        return f"CN={self.groups[index]},OU=Groups,{SEARCH_BASE}"
+
+    def user_dn(self, username: str) -> str:
+        return f"CN={username},OU=Users,{SEARCH_BASE}"
+
+    def group_sid(self, index: int) -> str:
+        return f"{DOMAIN_SID}-{1000 + index}"
+
+    def closure(self, groups: Iterable[int]) -> List[int]:
+        """
+        Get the groups and all the groups they are nested in.
+        """
+        result = set()
+        stack = list(groups)
+        while stack:
+            index = stack.pop()
+            if index not in result:
+                result.add(index)
+                stack.extend(self.parents[index])
+        return sorted(result)
+
+    def populate(self, emulator: ADEmulator) -> None:
+        """
+        Add the directory entries to an Active Directory emulator.
+        memberOf and tokenGroups of the entries are maintained by the emulator.
+        """
+        for index, name in enumerate(self.groups):
+            emulator.add_group(name, dn=self.group_dn(index), rid=1000 + index, whenChanged="20260101000000.0Z")
+        for index, parents in self.parents.items():
+            for parent in parents:
+                emulator.add_member(self.group_dn(parent), self.group_dn(index))
+
+        for username in self.users:
+            emulator.add_user(
+                username,
+                groups=[self.group_dn(index) for index in self.member_of[username]],
+                dn=self.user_dn(username),
+                givenName=username.capitalize(),
+                sn="Benchmark",
+                mail=f"{username}@bench.local",
+            )
+
+    def create_emulator(self, **options) -> ADEmulator:
+        """
+        Create an Active Directory emulator of this directory.
+        :param options: ADEmulator parameters, e.g. latency
+        """
+        emulator = ADEmulator(search_base=SEARCH_BASE, domain_sid=DOMAIN_SID, seed=self.params["seed"], **options)
+        self.populate(emulator)
+        return emulator
+
+    def create_manager(self, group_strategy: str, **settings) -> LDAPManager:
+        """
+        Create an LDAP Manager for the benchmark domain, connected to the emulated directory of the domain.
+        """
+        return LDAPManager(BENCHMARK_DOMAIN, LDAPSettings(**{
+            "SERVER": "bench.local",
+            "SEARCH_BASE": SEARCH_BASE,
+            "USERNAME": f"{BENCHMARK_DOMAIN}\\bench",
+            "PASSWORD": "bench",
+            "USE_SSL": False,
+            "COLLECT_METRICS": True,
+            "GROUP_STRATEGY": group_strategy,
+            "GROUP_ATTRS": ("cn", "sAMAccountName"),
+            "SUPERUSER_GROUPS": self.groups[0],
+            "STAFF_GROUPS": self.groups[1:3],
+            "GROUP_MAP": {f"bench_{index}": self.groups[index] for index in range(0, len(self.groups), 10)},
+            "CONNECTION_FACTORY": "windows_auth.testing.emulator_connection",
+            **settings,
+        }))
+
+
+def count_ldap_operations(manager: LDAPManager) -> int:
+    # connection usage counters of all the manager connections
+    return sum(connection.usage.operations for connection in manager.get_connections() if connection.usage)
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+def measure(manager: LDAPManager, func: Callable[[Any], Any], items: Iterable[Any]) -> Dict[str, Any]:
+    """
+    Measure the latency, LDAP operations and DB queries of a function called for each item.
+    :param manager: LDAP Manager the function uses, for counting LDAP operations
+    :param func: Function to measure
+    :param items: Arguments of the function calls
+    :return: Benchmark result
+    """
+    durations = []
+    ldap_operations = 0
+    db_queries = 0
+    for item in items:
+        operations = count_ldap_operations(manager)
+        with CaptureQueriesContext(db_connection) as queries:
+            start = perf_counter_ns()
+            func(item)
+            durations.append((perf_counter_ns() - start) / 1e6)
+        ldap_operations += count_ldap_operations(manager) - operations
+        db_queries += len(queries)
+
+    iterations = len(durations)
+    return {
+        "iterations": iterations,
+        "mean_ms": statistics.mean(durations),
+        "p50_ms": percentile(durations, 0.5),
+        "p95_ms": percentile(durations, 0.95),
+        "max_ms": max(durations),
+        "ldap_operations": ldap_operations / iterations,
+        "db_queries": db_queries / iterations,
+    }
+
+
+def run_benchmarks(directory: SyntheticDirectory, strategies: Iterable[str] = ("in_chain", "token_groups", "graph"),
+                   iterations: int = 100, latency: float = 0, log: Callable[[str], None] = print) -> Dict[str, Any]:
+    """
+    Run the sync benchmarks for each group strategy against a synthetic directory.
+    Should run against a test database, users are created and deleted.
+    :param directory: Synthetic directory
+    :param strategies: GROUP_STRATEGY settings to benchmark
+    :param iterations: Number of users measured by each benchmark
+    :param latency: Emulated latency (seconds) of each LDAP operation
+    :param log: Progress output
+    :return: Benchmark results, by strategy and benchmark name
+    """
+    rng = random.Random(directory.params["seed"])
+    results = {}
+    emulator = directory.create_emulator(latency=latency)
+    set_emulator(BENCHMARK_DOMAIN, emulator)
+    for strategy in strategies:
+        manager = directory.create_manager(strategy)
+        try:
+            usernames = rng.sample(directory.users, min(iterations, len(directory.users)))
+            username_format = f"{BENCHMARK_DOMAIN}\\%s"
+            strategy_results = results[strategy] = {}
+
+            def benchmark(name: str, func: Callable[[Any], Any], items: Iterable[Any]):
+                strategy_results[name] = measure(manager, func, items)
+                log(f"{strategy} {name}: {format_result(strategy_results[name])}")
+
+            # first sync of new users, including the creation of local groups
+            benchmark("create_user", lambda username: LDAPUser.objects.create_user(username_format % username),
+                      usernames)
+            ldap_users = list(LDAPUser.objects.filter(domain=BENCHMARK_DOMAIN).select_related("user"))
+
+            benchmark("sync", lambda ldap_user: ldap_user.sync(), ldap_users)
+            benchmark("get_ldap_groups", lambda ldap_user: ldap_user.get_ldap_groups(), ldap_users)
+
+            flag_groups = [group for groups in manager.settings.get_flag_map().values() for group in groups]
+            readers = [ldap_user.get_ldap_groups() for ldap_user in ldap_users]
+            benchmark("match_groups", lambda reader: GroupIndex(reader, manager.settings.GROUP_ATTRS)
+                      .match(flag_groups), readers)
+
+            # bulk field synchronization of all the domain users
+            benchmark("syncldapusers", lambda _: call_command("syncldapusers", BENCHMARK_DOMAIN,
+                                                              stdout=io.StringIO()), [None])
+        finally:
+            manager.close()
+            _ldap_connections.pop(BENCHMARK_DOMAIN, None)
+            User.objects.filter(ldap__domain=BENCHMARK_DOMAIN).delete()
+    set_emulator(BENCHMARK_DOMAIN, None)
+
+    return {
+        "version": RESULTS_VERSION,
+        "timestamp": timezone.now().isoformat(),
+        "environment": get_environment(),
+        "directory": {**directory.params, "latency": latency},
+        "results": results,
+    }
+
+
+def _benchmark_view(request):
+    return HttpResponse("OK")
+
+
+# views of the request benchmarks, served using the ROOT_URLCONF of this module
+urlpatterns = [
+    path("middleware/", _benchmark_view),
+    path("domain_required/", domain_required(_benchmark_view)),
+    path("ldap_sync_required/", ldap_sync_required(_benchmark_view, timedelta=timezone.timedelta(minutes=10))),
+]
+
+# middleware stack of the request benchmarks, user authentication and re-sync only
+BENCHMARK_MIDDLEWARE = [
+    "windows_auth.middleware.SimulateWindowsAuthMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.auth.middleware.RemoteUserMiddleware",
+    "windows_auth.middleware.UserSyncMiddleware",
+]
+
+# module settings of each re-sync mode
+RESYNC_MODES = {
+    "db": {"WAUTH_USE_CACHE": False, "WAUTH_USE_SESSION": False},
+    "cache": {"WAUTH_USE_CACHE": True, "WAUTH_USE_SESSION": False},
+    "session": {"WAUTH_USE_CACHE": False, "WAUTH_USE_SESSION": True},
+}
+
+
+@contextmanager
+def resync_mode(mode: str, resync_delta: int):
+    """
+    Patch the windows_auth settings of a re-sync mode, which are read by the modules on import.
+    """
+    settings = {**RESYNC_MODES[mode], "WAUTH_RESYNC_DELTA": resync_delta}
+    with ExitStack() as stack:
+        for module in (middleware_module, sync_module, models_module, decorators_module):
+            for name, value in settings.items():
+                if hasattr(module, name):
+                    stack.enter_context(mock.patch.object(module, name, value))
+        yield
+
+
+def run_request_benchmarks(directory: SyntheticDirectory, modes: Iterable[str] = tuple(RESYNC_MODES),
+                           views: Iterable[str] = ("middleware", "domain_required", "ldap_sync_required"),
+                           users: int = 20, requests: int = 200, concurrency: int = 4, resync_delta: int = 600,
+                           latency: float = 0, log: Callable[[str], None] = print) -> Dict[str, Any]:
+    """
+    Run the per-request overhead benchmarks of the middleware, authentication backend and decorators,
+    requesting the views with the Django test client from concurrent threads.
+    Should run against a test database, users are created and deleted.
+    :param directory: Synthetic directory
+    :param modes: Re-sync modes to benchmark, keys of RESYNC_MODES
+    :param views: Benchmark views to request
+    :param users: Number of users making requests, each user makes its first request before measuring
+    :param requests: Number of measured requests of each view
+    :param concurrency: Number of threads making requests
+    :param resync_delta: WAUTH_RESYNC_DELTA (seconds) setting
+    :param latency: Emulated latency (seconds) of each LDAP operation
+    :param log: Progress output
+    :return: Benchmark results, by mode and view
+    """
+    usernames = directory.users[:users]
+    concurrency = max(1, min(concurrency, len(usernames)))
+    results = {}
+    set_emulator(BENCHMARK_DOMAIN, directory.create_emulator(latency=latency))
+    manager = directory.create_manager("token_groups")
+    try:
+        with override_settings(ROOT_URLCONF=__name__, MIDDLEWARE=BENCHMARK_MIDDLEWARE,
+                               AUTHENTICATION_BACKENDS=["windows_auth.backends.WindowsAuthBackend"]), \
+                ThreadPoolExecutor(concurrency, thread_name_prefix="benchmark") as executor:
+            for mode in modes:
+                mode_results = results[mode] = {}
+                with resync_mode(mode, resync_delta):
+                    clients = {username: Client(REMOTE_USER=f"{BENCHMARK_DOMAIN}\\{username}")
+                               for username in usernames}
+                    for view in views:
+                        # first requests create and sync the users and their sessions
+                        for username in usernames:
+                            clients[username].get(f"/{view}/")
+
+                        counter = CallCounter()
+
+                        def worker(index: int) -> List[Any]:
+                            # each thread requests as its own users, test clients are not thread safe
+                            worker_users = usernames[index::concurrency]
+                            samples = []
+                            try:
+                                with counter.count():
+                                    for number in range(index, requests, concurrency):
+                                        client = clients[worker_users[number // concurrency % len(worker_users)]]
+                                        start = perf_counter_ns()
+                                        response = client.get(f"/{view}/")
+                                        samples.append(((perf_counter_ns() - start) / 1e6, response.status_code))
+                            finally:
+                                db_connection.close()
+                            return samples
+
+                        start = perf_counter_ns()
+                        samples = [sample for samples in executor.map(worker, range(concurrency)) for sample in samples]
+                        elapsed = (perf_counter_ns() - start) / 1e9
+                        counter.close()
+
+                        durations = [duration for duration, _ in samples]
+                        mode_results[view] = {
+                            "iterations": len(samples),
+                            "requests_per_second": len(samples) / elapsed,
+                            "mean_ms": statistics.mean(durations),
+                            "p50_ms": percentile(durations, 0.5),
+                            "p95_ms": percentile(durations, 0.95),
+                            "max_ms": max(durations),
+                            "errors": sum(1 for _, status_code in samples if status_code >= 400),
+                            "db_queries": counter.db_queries / len(samples),
+                            "cache_calls": counter.cache_calls / len(samples),
+                            "ldap_operations": counter.ldap_operations / len(samples),
+                        }
+                        log(f"{mode} {view}: {format_request_result(mode_results[view])}")
+
+                    # users are created again by the first requests of the next mode
+                    User.objects.filter(ldap__domain=BENCHMARK_DOMAIN).delete()
+                    cache.clear()
+    finally:
+        manager.close()
+        _ldap_connections.pop(BENCHMARK_DOMAIN, None)
+        set_emulator(BENCHMARK_DOMAIN, None)
+        User.objects.filter(ldap__domain=BENCHMARK_DOMAIN).delete()
+
+    return {
+        "version": RESULTS_VERSION,
+        "timestamp": timezone.now().isoformat(),
+        "environment": get_environment(),
+        "directory": {**directory.params, "latency": latency},
+        "requests": {"users": len(usernames), "concurrency": concurrency, "resync_delta": resync_delta},
+        "results": results,
+    }
+
+
+def get_environment() -> Dict[str, Any]:
+    return {
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "ldap3": ldap3.__version__,
+        "database": db_connection.vendor,
+    }
+
+
+def format_result(result: Dict[str, Any]) -> str:
+    return (f"{result['iterations']} iterations, mean {result['mean_ms']:.3f} ms, p95 {result['p95_ms']:.3f} ms, "
+            f"{result['ldap_operations']:.2f} LDAP operations, {result['db_queries']:.2f} DB queries")
+
+
+def format_request_result(result: Dict[str, Any]) -> str:
+    return (f"{result['iterations']} requests, {result['requests_per_second']:.1f} req/s, "
+            f"mean {result['mean_ms']:.3f} ms, p95 {result['p95_ms']:.3f} ms, {result['errors']} errors, "
+            f"{result['db_queries']:.2f} DB queries, {result['cache_calls']:.2f} cache calls, "
+            f"{result['ldap_operations']:.2f} LDAP operations")
+
+
+def save_results(results: Dict[str, Any], path: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare_results(baseline: Dict[str, Any], results: Dict[str, Any]) -> List[str]:
+    """
+    Compare the results of two runs.
+    :return: Lines describing the change of each benchmark found in both runs
+    """
+    lines = []
+    for strategy, benchmarks in results["results"].items():
+        for name, result in benchmarks.items():
+            base = baseline.get("results", {}).get(strategy, {}).get(name)
+            if base is None:
+                continue
+            changes = []
+            for key in ("requests_per_second", "mean_ms", "p95_ms", "ldap_operations", "db_queries", "cache_calls"):
+                if key not in base or key not in result:
+                    continue
+                if base[key]:
+                    changes.append(f"{key} {(result[key] - base[key]) / base[key]:+.1%}")
+                elif result[key]:
+                    changes.append(f"{key} {base[key]} -> {result[key]}")
+            lines.append(f"{strategy} {name}: {', '.join(changes) or 'no change'}")
+    return lines
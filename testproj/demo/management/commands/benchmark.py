@@ -0,0 +1,51 @@
+import logging
+
+from django.core.management import BaseCommand, CommandParser
+from django.db import connection
+
+from demo.benchmarks import SyntheticDirectory, run_benchmarks, save_results, load_results, compare_results
+
+
+class Command(BaseCommand):
+    help = "Benchmark LDAP User synchronization against a synthetic emulated Active Directory, using a test database."
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("-u", "--users", type=int, default=1000, help="Number of directory users")
+        parser.add_argument("-g", "--groups", type=int, default=200, help="Number of directory groups")
+        parser.add_argument("-d", "--depth", type=int, default=3, help="Group nesting depth")
+        parser.add_argument("--groups-per-user", type=int, default=5, help="Direct groups of each user")
+        parser.add_argument("-n", "--iterations", type=int, default=100, help="Users measured by each benchmark")
+        parser.add_argument("-s", "--strategy", action="append", dest="strategies",
+                            help="GROUP_STRATEGY to benchmark, may be repeated (default: in_chain, token_groups, graph)")
+        parser.add_argument("--latency", type=float, default=0,
+                            help="Emulated latency (seconds) of each LDAP operation")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic directory")
+        parser.add_argument("-o", "--output", type=str, help="Save the results to a JSON file")
+        parser.add_argument("-c", "--compare", type=str, help="Compare the results to a previous JSON results file")
+        parser.add_argument("--log-level", type=str, default="WARNING",
+                            help="Log level of windows_auth while measuring, logging is part of the measured time")
+
+    def handle(self, users=1000, groups=200, depth=3, groups_per_user=5, iterations=100, strategies=None, latency=0,
+               seed=0, output=None, compare=None, log_level="WARNING", **options):
+        directory = SyntheticDirectory(users=users, groups=groups, depth=depth, groups_per_user=groups_per_user,
+                                       seed=seed)
+
+        # benchmarks create and delete users, never run them against the project database
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        logger = logging.getLogger("wauth")
+        old_level = logger.level
+        logger.setLevel(log_level.upper())
+        try:
+            results = run_benchmarks(directory, iterations=iterations, latency=latency, log=self.stdout.write,
+                                     **({"strategies": strategies} if strategies else {}))
+        finally:
+            logger.setLevel(old_level)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if output:
+            save_results(results, output)
+            self.stdout.write(f"Results saved to {output}")
+        if compare:
+            for line in compare_results(load_results(compare), results):
+                self.stdout.write(line)
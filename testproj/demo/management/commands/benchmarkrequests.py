@@ -0,0 +1,61 @@
+import logging
+import os
+import tempfile
+
+from django.core.management import BaseCommand, CommandParser
+from django.db import connection
+
+from demo.benchmarks import SyntheticDirectory, RESYNC_MODES, run_request_benchmarks, save_results, load_results, \
+    compare_results
+
+
+class Command(BaseCommand):
+    help = "Benchmark the per-request overhead of the windows_auth middleware, backend and decorators, " \
+           "using a synthetic emulated Active Directory and a test database."
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("-u", "--users", type=int, default=20, help="Number of users making requests")
+        parser.add_argument("-n", "--requests", type=int, default=200, help="Measured requests of each view")
+        parser.add_argument("-c", "--concurrency", type=int, default=4, help="Number of threads making requests")
+        parser.add_argument("-m", "--mode", action="append", dest="modes", choices=tuple(RESYNC_MODES),
+                            help="Re-sync mode to benchmark, may be repeated (default: all)")
+        parser.add_argument("--view", action="append", dest="views",
+                            choices=("middleware", "domain_required", "ldap_sync_required"),
+                            help="View to request, may be repeated (default: all)")
+        parser.add_argument("--resync-delta", type=int, default=600, help="WAUTH_RESYNC_DELTA (seconds)")
+        parser.add_argument("--latency", type=float, default=0,
+                            help="Emulated latency (seconds) of each LDAP operation")
+        parser.add_argument("-o", "--output", type=str, help="Save the results to a JSON file")
+        parser.add_argument("--compare", type=str, help="Compare the results to a previous JSON results file")
+        parser.add_argument("--log-level", type=str, default="WARNING",
+                            help="Log level of windows_auth while measuring, logging is part of the measured time")
+
+    def handle(self, users=20, requests=200, concurrency=4, modes=None, views=None, resync_delta=600, latency=0,
+               output=None, compare=None, log_level="WARNING", **options):
+        directory = SyntheticDirectory(users=users, groups=max(users // 5, 10))
+
+        # benchmarks create and delete users, never run them against the project database
+        old_name = connection.settings_dict["NAME"]
+        if connection.vendor == "sqlite":
+            # in-memory sqlite test databases lock whole tables for concurrent writers
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(tempfile.gettempdir(), "wauth_benchmark.sqlite3")
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        logger = logging.getLogger("wauth")
+        old_level = logger.level
+        logger.setLevel(log_level.upper())
+        try:
+            results = run_request_benchmarks(
+                directory, users=users, requests=requests, concurrency=concurrency, resync_delta=resync_delta,
+                latency=latency, log=self.stdout.write,
+                **({"modes": modes} if modes else {}), **({"views": views} if views else {}),
+            )
+        finally:
+            logger.setLevel(old_level)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if output:
+            save_results(results, output)
+            self.stdout.write(f"Results saved to {output}")
+        if compare:
+            for line in compare_results(load_results(compare), results):
+                self.stdout.write(line)
@@ -1,11 +1,64 @@
+import io
+import os
+import tempfile
+import time
+from threading import Event, Thread
+from types import SimpleNamespace
 from unittest import mock
 
-from django.test import TestCase, override_settings, RequestFactory
+from django.contrib.auth.models import User, Group
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings, RequestFactory, Client
+from django.db.models import Sum
+from django.db.models.signals import m2m_changed
 from django.urls import reverse
+from django.utils import timezone
+from ldap3 import MOCK_SYNC, OFFLINE_AD_2012_R2, MODIFY_ADD, MODIFY_REPLACE, SCHEMA, NONE, Server
+from ldap3.core.exceptions import LDAPException, LDAPSocketOpenError, LDAPNoSuchObjectResult
 
-from windows_auth.middleware import SimulateWindowsAuthMiddleware
-from windows_auth.models import LDAPUser
+from demo.benchmarks import SyntheticDirectory, run_benchmarks, compare_results, run_request_benchmarks, resync_mode, \
+    BENCHMARK_MIDDLEWARE
+from windows_auth.circuit import CircuitBreaker, LDAPCircuitOpenError, CIRCUIT_OPEN, CIRCUIT_HALF_OPEN, \
+    CIRCUIT_CLOSED
+from windows_auth.entry_cache import CachedEntry, CachedReader, LocalMemoryEntryCache
+from windows_auth.group_graph import GroupGraph, get_group_graph
+from windows_auth.groups import get_group_table
+from windows_auth.latency import LatencyHistogram, LatencyRegistry, get_latency_registry, collect_latency, \
+    PROCESSES_CACHE_KEY, RETIRED_CACHE_KEY, REGISTRY_LOCK_CACHE_KEY, OP_BIND, OP_SEARCH_USER, OP_SEARCH_GROUPS
+from windows_auth.ldap import LDAPManager, LDAPPoolTimeoutError, get_ldap_manager, preload_domains, _ldap_connections
+from windows_auth.ldap_metrics.models import LDAPUsage, LDAPUsageRollup
+from windows_auth.ldap_metrics.utils import MetricsFlusher, rollup_usage
+from windows_auth.middleware import SimulateWindowsAuthMiddleware, UserSyncMiddleware
+from windows_auth.models import LDAPUser, GroupIndex, _clear_local_groups
+from windows_auth.backends import WindowsAuthBackend
+from windows_auth import panels
+from windows_auth.panels import LDAPPanel, RingCollector, TimingCollector, OperationInfo
+from windows_auth.ratelimit import SyncRateLimiter, LDAPSyncRateLimitError
+from windows_auth.schema_cache import get_schema_cache_path, save_schema_cache, load_schema_cache
 from windows_auth.settings import LDAPSettings
+from windows_auth.sync import SyncWorkerPool, get_sync_state, sync_once, get_sync_lease_cache_key, SYNC_FRESH, \
+    SYNC_STALE, SYNC_EXPIRED, get_sync_failure_cache_key, is_sync_failed, _sync_flights
+from windows_auth.testing import ADEmulator, set_emulator, sid_to_bytes, MATCHING_RULE_IN_CHAIN, CallCounter, \
+    assert_max_calls, assert_request_budget
+from windows_auth.timing import Timer, Timing, subscribe, unsubscribe
+from windows_auth.views import ldap_metrics
+
+
+def create_mock_manager(domain="TEST", **settings) -> LDAPManager:
+    """
+    Create an LDAP Manager connected to an offline ldap3 mock directory with an Active Directory schema
+    """
+    return LDAPManager(domain, LDAPSettings(**{
+        "SERVER": "test.local",
+        "SEARCH_BASE": "DC=test,DC=local",
+        "USERNAME": "",
+        "PASSWORD": "",
+        "USE_SSL": False,
+        "SERVER_OPTIONS": {"get_info": OFFLINE_AD_2012_R2},
+        "CONNECTION_OPTIONS": {"client_strategy": MOCK_SYNC},
+        **settings,
+    }))
 
 
 class ModelTestCase(TestCase):
@@ -83,3 +136,1276 @@ class MiddlewareTestCase(TestCase):
         request = self.factory.get(reverse("demo:index"))
         self.pass_middleware(request)
         self.assertFalse(request.META.get("REMOTE_USER"))
+
+
+class ConnectionPoolTestCase(TestCase):
+
+    def test_checkout_exclusive(self):
+        manager = create_mock_manager(POOL_MIN_SIZE=1, POOL_MAX_SIZE=2)
+        self.assertEqual(manager.pool.size, 1)
+        with manager.get_connection() as first, manager.get_connection() as second:
+            self.assertIsNot(first, second)
+            self.assertEqual(manager.pool.size, 2)
+        # connections are reused after being released
+        with manager.get_connection() as connection:
+            self.assertIn(connection, (first, second))
+        manager.close()
+
+    def test_checkout_timeout(self):
+        manager = create_mock_manager(POOL_MIN_SIZE=0, POOL_MAX_SIZE=1)
+        with manager.get_connection():
+            with self.assertRaises(LDAPPoolTimeoutError):
+                with manager.get_connection(timeout=0.1):
+                    pass
+        manager.close()
+
+    def test_forked_process(self):
+        manager = create_mock_manager(POOL_MIN_SIZE=1)
+        parent_connection, parent_pool = manager.connection, manager.get_connections()[1:]
+        definition = manager.get_definition("user")
+
+        with mock.patch("windows_auth.ldap.os.getpid", return_value=os.getpid() + 1):
+            # inherited connections are neither used nor unbound by the child
+            self.assertFalse(manager.bound)
+            self.assertEqual(manager.get_connections(), [])
+
+            with manager.get_connection() as connection:
+                self.assertNotIn(connection, parent_pool)
+            self.assertIsNot(manager.connection, parent_connection)
+            self.assertTrue(manager.bound)
+            # preloaded definitions are kept
+            self.assertIs(manager.get_definition("user"), definition)
+            manager.close()
+
+
+class PreloadTestCase(TestCase):
+
+    def setUp(self):
+        self.release = Event()
+
+        def create_manager(domain, settings=None):
+            if domain == "SLOW":
+                # simulate an unreachable domain controller
+                self.release.wait(5)
+            return create_mock_manager(domain)
+
+        patcher = mock.patch("windows_auth.ldap.LDAPManager", side_effect=create_manager)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.release.set()
+        for domain in ("FAST", "SLOW"):
+            manager = _ldap_connections.pop(domain, None)
+            if manager:
+                manager.close()
+
+    def test_preload_timeout(self):
+        preloaded = preload_domains(["SLOW", "FAST"], timeout=0.5)
+        self.assertEqual(list(preloaded), ["FAST"])
+        self.assertNotIn("SLOW", _ldap_connections)
+
+        # pending domain keeps binding in background
+        self.release.set()
+        self.assertTrue(get_ldap_manager("SLOW").bound)
+
+    def test_domain_lock(self):
+        thread = Thread(target=get_ldap_manager, args=("SLOW",))
+        thread.start()
+        # binding a domain does not block other domains
+        self.assertTrue(get_ldap_manager("FAST").bound)
+        self.assertTrue(thread.is_alive())
+        self.release.set()
+        thread.join()
+
+
+class MetricsFlusherTestCase(TestCase):
+
+    def setUp(self):
+        self.manager = create_mock_manager("METRICS", COLLECT_METRICS=True, POOL_MIN_SIZE=1)
+        self.flusher = MetricsFlusher()
+
+    def tearDown(self):
+        self.manager.close()
+        _ldap_connections.pop("METRICS", None)
+
+    def search(self, count: int = 1):
+        with self.manager.get_connection() as connection:
+            for _ in range(count):
+                connection.search("DC=test,DC=local", "(objectClass=user)")
+
+    def flush(self):
+        return [usage for usage in self.flusher.flush() if usage.domain == "METRICS"]
+
+    def test_flush_delta(self):
+        self.search(2)
+        first, = self.flush()
+        self.assertEqual(first.search_operations, 2)
+
+        # no activity since the last flush
+        self.assertEqual(self.flush(), [])
+
+        self.search()
+        second, = self.flush()
+        self.assertEqual(second.search_operations, 1)
+        # collection period starts at the previous flush
+        self.assertLess(first.since, second.since)
+        self.assertLessEqual(second.since, second.timestamp)
+        self.assertEqual(LDAPUsage.objects.filter(domain="METRICS").count(), 2)
+
+    def test_connection_reopened(self):
+        self.search(3)
+        self.flush()
+
+        # usage is reset when connections are re-opened
+        for connection in self.manager.get_connections():
+            connection.usage.start()
+        self.search()
+        usage, = self.flush()
+        self.assertEqual(usage.search_operations, 1)
+
+
+class UsageRollupTestCase(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now().replace(minute=30, second=0, microsecond=0)
+
+    def create_usage(self, hours_ago: float, domain: str = "ROLLUP", pid: int = 1, **counters):
+        usage = LDAPUsage.objects.create(domain=domain, pid=pid, **counters)
+        # timestamp is set on save
+        LDAPUsage.objects.filter(pk=usage.pk).update(timestamp=self.now - timezone.timedelta(hours=hours_ago))
+
+    def test_rollup(self):
+        self.create_usage(2, pid=1, search_operations=2)
+        self.create_usage(2, pid=2, search_operations=3)
+        self.create_usage(1, search_operations=1)
+        self.create_usage(1, domain="OTHER", search_operations=4)
+        # current hour is incomplete
+        self.create_usage(0, search_operations=10)
+
+        rollup_usage(now=self.now)
+        hourly = LDAPUsageRollup.objects.filter(period=LDAPUsageRollup.PERIOD_HOUR, domain="ROLLUP") \
+            .order_by("period_start")
+        self.assertEqual([(r.search_operations, r.samples, r.processes) for r in hourly], [(5, 2, 2), (1, 1, 1)])
+
+        # the last rolled up hour is updated
+        self.create_usage(1, search_operations=1)
+        rollup_usage(now=self.now)
+        self.assertEqual(hourly.last().search_operations, 2)
+        self.assertEqual(hourly.count(), 2)
+
+        # the current hour is rolled up when complete
+        rollup_usage(now=self.now + timezone.timedelta(hours=1))
+        self.assertEqual(hourly.last().search_operations, 10)
+
+    def test_rollup_daily(self):
+        self.create_usage(48, search_operations=1)
+        self.create_usage(47, search_operations=2)
+        rollup_usage(now=self.now)
+
+        daily = LDAPUsageRollup.objects.filter(period=LDAPUsageRollup.PERIOD_DAY, domain="ROLLUP")
+        self.assertEqual(sum(daily.values_list("search_operations", flat=True)), 3)
+        self.assertLessEqual(daily.count(), 2)
+
+    def test_retention(self):
+        for hours_ago in (96, 50, 2):
+            self.create_usage(hours_ago, search_operations=1)
+
+        results = rollup_usage(now=self.now, raw_retention=1, hourly_retention=1, daily_retention=None, batch_size=1)
+        self.assertEqual(results["raw"], (0, 2))
+        self.assertEqual(LDAPUsage.objects.filter(domain="ROLLUP").count(), 1)
+        # rolled up data is kept
+        total = LDAPUsageRollup.objects.filter(period=LDAPUsageRollup.PERIOD_DAY, domain="ROLLUP") \
+            .aggregate(total=Sum("search_operations"))["total"]
+        self.assertEqual(total, 2)
+        # hourly rollups are kept until rolled up into a complete day
+        self.assertFalse(LDAPUsageRollup.objects.filter(
+            period=LDAPUsageRollup.PERIOD_HOUR, period_start__lt=self.now - timezone.timedelta(hours=95)).exists())
+        self.assertTrue(LDAPUsageRollup.objects.filter(
+            period=LDAPUsageRollup.PERIOD_HOUR, period_start__gt=self.now - timezone.timedelta(hours=3)).exists())
+
+    def test_not_rolled_up_kept(self):
+        self.create_usage(0, search_operations=1)
+        LDAPUsage.objects.update(timestamp=self.now - timezone.timedelta(minutes=1))
+        rollup_usage(now=self.now, raw_retention=0)
+        self.assertEqual(LDAPUsage.objects.count(), 1)
+
+    def test_command(self):
+        self.create_usage(2, search_operations=1)
+        call_command("rollupldapusage", "--raw-retention", "none", stdout=open(os.devnull, "w"))
+        self.assertTrue(LDAPUsageRollup.objects.filter(domain="ROLLUP").exists())
+        self.assertEqual(LDAPUsage.objects.count(), 1)
+
+
+class LatencyTestCase(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        cache.delete_many([PROCESSES_CACHE_KEY, RETIRED_CACHE_KEY, REGISTRY_LOCK_CACHE_KEY])
+
+    def test_histogram_quantile(self):
+        histogram = LatencyHistogram(buckets=(0.01, 0.1, 1.0))
+        self.assertIsNone(histogram.quantile(0.5))
+        for _ in range(90):
+            histogram.observe(0.005)
+        for _ in range(10):
+            histogram.observe(0.5, error=True)
+
+        self.assertEqual(histogram.counts, [90, 0, 10, 0])
+        self.assertEqual(histogram.errors, 10)
+        self.assertLess(histogram.quantile(0.5), 0.01)
+        self.assertTrue(0.1 < histogram.quantile(0.95) <= 1.0)
+
+    def test_observe_timers(self):
+        with Timer(OP_BIND, "LATENCY"):
+            pass
+        with self.assertRaises(LDAPException):
+            with Timer(OP_BIND, "LATENCY"):
+                raise LDAPException()
+
+        histogram = get_latency_registry().get_histogram("LATENCY", OP_BIND)
+        self.assertGreaterEqual(histogram.count, 2)
+        self.assertGreaterEqual(histogram.errors, 1)
+
+    def test_aggregate_processes(self):
+        registry = get_latency_registry()
+        registry.observe("LATENCY", OP_SEARCH_USER, 0.02)
+        # histograms published by another process
+        other = LatencyHistogram()
+        other.observe(0.02)
+        other.observe(3)
+        cache.set("wauth_latency_other_1", [("LATENCY", OP_SEARCH_USER, other.to_dict())])
+        cache.set(PROCESSES_CACHE_KEY, {"wauth_latency_other_1": time.time()})
+
+        histogram = collect_latency()[("LATENCY", OP_SEARCH_USER)]
+        self.assertEqual(histogram.count, registry.get_histogram("LATENCY", OP_SEARCH_USER).count + 2)
+
+    def test_retired_processes(self):
+        def count():
+            return collect_latency()[("RETIRED", OP_BIND)].count
+
+        first, second = LatencyRegistry(publish_interval=1), LatencyRegistry(publish_interval=1)
+        first.observe("RETIRED", OP_BIND, 0.02)
+        first.publish()
+        second.observe("RETIRED", OP_BIND, 0.02)
+        second.publish()
+        self.assertEqual(count(), 2)
+
+        # the histograms of terminated processes are kept in the aggregated counters
+        processes = cache.get(PROCESSES_CACHE_KEY)
+        processes[first.process_key] -= first.process_timeout
+        processes[second.process_key] -= first.process_timeout / 2
+        cache.set(PROCESSES_CACHE_KEY, processes)
+        second.publish()
+        self.assertNotIn(first.process_key, cache.get(PROCESSES_CACHE_KEY))
+        self.assertIsNone(cache.get(first.process_key))
+        self.assertEqual(count(), 2)
+
+        # a delayed process continues as a new process, without counting its observations twice
+        retired_key = first.process_key
+        first.publish()
+        self.assertNotEqual(first.process_key, retired_key)
+        self.assertEqual(count(), 2)
+        first.observe("RETIRED", OP_BIND, 0.02)
+        first.publish()
+        self.assertEqual(count(), 3)
+
+    def test_registry_locked(self):
+        registry = LatencyRegistry(publish_interval=1)
+        registry.observe("LOCKED", OP_BIND, 0.02)
+        cache.set(PROCESSES_CACHE_KEY, {"wauth_latency_other_1": time.time()})
+        cache.set(REGISTRY_LOCK_CACHE_KEY, "wauth_latency_other_1")
+
+        # the registry is not modified while another process holds the lock
+        registry.publish()
+        self.assertEqual(set(cache.get(PROCESSES_CACHE_KEY)), {"wauth_latency_other_1"})
+        cache.delete(REGISTRY_LOCK_CACHE_KEY)
+        registry.publish()
+        self.assertEqual(set(cache.get(PROCESSES_CACHE_KEY)), {"wauth_latency_other_1", registry.process_key})
+
+    def test_metrics_view(self):
+        get_latency_registry().observe("LATENCY", OP_SEARCH_GROUPS, 0.02)
+        response = ldap_metrics(self.factory.get("/metrics/", REMOTE_ADDR="127.0.0.1"))
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        self.assertIn('wauth_ldap_operation_duration_seconds_bucket{domain="LATENCY",operation="search_groups",'
+                      'le="+Inf"}', content)
+        self.assertIn('wauth_ldap_operation_duration_quantile_seconds{domain="LATENCY",operation="search_groups",'
+                      'quantile="0.99"}', content)
+
+        response = ldap_metrics(self.factory.get("/metrics/", REMOTE_ADDR="10.0.0.1"))
+        self.assertEqual(response.status_code, 403)
+
+
+class TimerTestCase(TestCase):
+
+    def setUp(self):
+        self.timings = []
+        subscribe(self.timings.append)
+        self.addCleanup(unsubscribe, self.timings.append)
+
+    def test_subscribers(self):
+        with Timer("test_timer", "TEST"):
+            pass
+        with self.assertRaises(ValueError):
+            with Timer("test_timer", "TEST"):
+                raise ValueError()
+
+        timings = [timing for timing in self.timings if timing.name == "test_timer"]
+        self.assertEqual([timing.error for timing in timings], [False, True])
+        self.assertTrue(all(isinstance(timing, Timing) and timing.duration_ns >= 0 for timing in timings))
+
+    def test_lazy_message(self):
+        class Unformattable:
+            def __str__(self):
+                raise AssertionError("message formatted while logging is disabled")
+
+        with self.assertLogs("wauth", level="DEBUG") as logs:
+            with Timer("test_timer", "TEST", "Timed %s", "block"):
+                pass
+        self.assertRegex(logs.output[0], r"Timed block: \d+\.\d{3} ms")
+
+        with mock.patch("windows_auth.logger.isEnabledFor", return_value=False):
+            with Timer("test_timer", "TEST", "Timed %s", Unformattable()):
+                pass
+
+    def test_disabled(self):
+        unsubscribe(self.timings.append)
+        with mock.patch("windows_auth.timing._subscribers", ()), \
+                mock.patch("windows_auth.logger.isEnabledFor", return_value=False), \
+                mock.patch("windows_auth.timing.perf_counter_ns") as clock:
+            with Timer("test_timer", "TEST", "Timed block"):
+                pass
+        clock.assert_not_called()
+
+
+class LDAPPanelTestCase(TestCase):
+
+    def test_ring_collector(self):
+        collector = RingCollector(max_size=3)
+        for index in range(5):
+            collector.collect(index)
+        self.assertEqual(list(collector.get_collection()), [2, 3, 4])
+        self.assertEqual(collector.get_dropped(), 2)
+
+        collector.clear_collection()
+        self.assertEqual(list(collector.get_collection()), [])
+        self.assertEqual(collector.get_dropped(), 0)
+
+    def test_executor_collection(self):
+        # items collected by executor threads are collected for the submitting thread
+        collector = RingCollector(max_size=3)
+        manager = create_mock_manager()
+        try:
+            manager.submit(collector.collect, "operation").result()
+        finally:
+            manager.close()
+        self.assertEqual(list(collector.get_collection()), ["operation"])
+
+    @mock.patch("windows_auth.panels.WAUTH_PANEL_MAX_ENTRIES", 10)
+    @mock.patch("windows_auth.panels.WAUTH_PANEL_STACKTRACE_RATE", 0)
+    def test_operation_truncated(self):
+        response = [
+            {"type": "searchResEntry", "dn": f"CN=computer{index},DC=test,DC=local", "attributes": {"cn": index}}
+            for index in range(5000)
+        ]
+        operation = OperationInfo("TEST", response, {"result": 0}, {"type": "searchRequest"}, 0, 1000)
+        self.assertEqual(operation.entry_count, 5000)
+        self.assertEqual(len(operation.entries), 10)
+        self.assertEqual(operation.stacktrace, "")
+
+        # entries are serialized only when rendered
+        entry = operation.entries[0]
+        self.assertNotIn("json", entry.__dict__)
+        self.assertIn("CN=computer0,DC=test,DC=local", entry.json)
+        self.assertEqual(entry.template, "windows_auth/panel/search_entry.html")
+
+    def test_timing_summary(self):
+        timings = TimingCollector()
+        timings(Timing("search_user", "TEST", 2_000_000, False))
+        timings(Timing("search_user", "TEST", 4_000_000, False))
+        timings(Timing("search_user", "OTHER", 1_000_000, False))
+
+        summary, = timings.get_summary("TEST")
+        self.assertEqual(summary["count"], 2)
+        self.assertEqual(summary["total"], timezone.timedelta(milliseconds=6))
+        self.assertEqual(summary["max"], timezone.timedelta(milliseconds=4))
+
+
+class AsyncLDAPTestCase(TestCase):
+
+    def setUp(self):
+        self.manager = create_mock_manager()
+        self.manager.connection.strategy.add_entry("CN=alice,DC=test,DC=local", {
+            "objectClass": ["top", "person", "user"],
+            "objectCategory": "person",
+            "sAMAccountName": "alice",
+            "givenName": "Alice",
+        })
+        self.ldap_user = LDAPUser.objects.create(user=User.objects.create_user("alice"), domain="TEST")
+
+    def tearDown(self):
+        self.manager.close()
+
+    async def test_aget_ldap_user(self):
+        entry = await self.ldap_user.aget_ldap_user()
+        self.assertEqual(entry.givenName.value, "Alice")
+
+
+class BackgroundSyncTestCase(TestCase):
+
+    @mock.patch("windows_auth.sync.WAUTH_USE_CACHE", False)
+    @mock.patch("windows_auth.sync.WAUTH_RESYNC_DELTA", timezone.timedelta(hours=1))
+    @mock.patch("windows_auth.sync.WAUTH_RESYNC_MAX_STALENESS", timezone.timedelta(days=1))
+    def test_sync_state(self):
+        ldap_user = LDAPUser(domain="TEST")
+        self.assertEqual(get_sync_state(ldap_user), SYNC_EXPIRED)
+        ldap_user.last_sync = timezone.now() - timezone.timedelta(minutes=5)
+        self.assertEqual(get_sync_state(ldap_user), SYNC_FRESH)
+        ldap_user.last_sync = timezone.now() - timezone.timedelta(hours=5)
+        self.assertEqual(get_sync_state(ldap_user), SYNC_STALE)
+        ldap_user.last_sync = timezone.now() - timezone.timedelta(days=2)
+        self.assertEqual(get_sync_state(ldap_user), SYNC_EXPIRED)
+
+    def test_worker_pool_dedup(self):
+        started, release = Event(), Event()
+
+        def blocking_sync():
+            started.set()
+            release.wait(5)
+
+        pool = SyncWorkerPool(workers=1, queue_size=1)
+        busy_user = mock.MagicMock(pk=1, sync=mock.MagicMock(side_effect=blocking_sync))
+        queued_user = mock.MagicMock(pk=2)
+        self.assertTrue(pool.submit(busy_user))
+        self.assertTrue(started.wait(5))
+
+        # queue holds a single user, duplicates are accepted without being queued again
+        self.assertTrue(pool.submit(queued_user))
+        self.assertTrue(pool.submit(queued_user))
+        self.assertFalse(pool.submit(mock.MagicMock(pk=3)))
+
+        release.set()
+        pool.queue.join()
+        busy_user.sync.assert_called_once()
+        queued_user.sync.assert_called_once()
+        self.assertEqual(pool.pending, 0)
+
+    def test_worker_failure(self):
+        pool = SyncWorkerPool(workers=1)
+        ldap_user = mock.MagicMock(pk=4, user_id=1004, sync=mock.MagicMock(side_effect=LDAPSocketOpenError("down")))
+        try:
+            # failed background syncs are not queued again by the following requests
+            self.assertTrue(pool.submit(ldap_user))
+            pool.queue.join()
+            self.assertTrue(is_sync_failed(ldap_user))
+        finally:
+            cache.delete(get_sync_failure_cache_key(ldap_user.user_id))
+
+
+class SessionSyncCheckTestCase(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create(username="session")
+        self.ldap_user = LDAPUser.objects.create(user=self.user, domain="TEST", last_sync=timezone.now())
+
+    def get_request(self, session):
+        request = self.factory.get(reverse("demo:index"))
+        request.user = self.user
+        request.session = session
+        return request
+
+    @mock.patch("windows_auth.sync.WAUTH_USE_CACHE", False)
+    @mock.patch("windows_auth.middleware.WAUTH_USE_SESSION", True)
+    @mock.patch("windows_auth.middleware.WAUTH_RESYNC_DELTA", 600)
+    @mock.patch("windows_auth.sync.WAUTH_RESYNC_DELTA", 600)
+    def test_session_skips_queries(self):
+        session = {}
+        middleware = UserSyncMiddleware(mock.MagicMock())
+        with self.assertNumQueries(1):
+            middleware(self.get_request(session))
+        self.assertEqual(session[UserSyncMiddleware.session_key]["user"], self.user.pk)
+
+        # steady state requests are served from the session
+        with self.assertNumQueries(0):
+            middleware(self.get_request(session))
+
+        # re-sync is checked again once the deadline passes
+        session[UserSyncMiddleware.session_key]["resync_at"] = timezone.now().timestamp() - 1
+        with self.assertNumQueries(1):
+            middleware(self.get_request(session))
+
+    @mock.patch("windows_auth.sync.WAUTH_USE_CACHE", False)
+    @mock.patch("windows_auth.middleware.WAUTH_USE_SESSION", True)
+    @mock.patch("windows_auth.middleware.WAUTH_RESYNC_DELTA", 600)
+    @mock.patch("windows_auth.sync.WAUTH_RESYNC_DELTA", 600)
+    def test_deferred_sync_rechecked(self):
+        LDAPUser.objects.filter(pk=self.ldap_user.pk).update(last_sync=None)
+        session = {}
+        middleware = UserSyncMiddleware(mock.MagicMock())
+        lease_key = get_sync_lease_cache_key(self.user.pk)
+        cache.set(lease_key, "other-process")
+        try:
+            # the user is synced by another process, no deadline is saved for the current state
+            middleware(self.get_request(session))
+            self.assertNotIn(UserSyncMiddleware.session_key, session)
+        finally:
+            cache.delete(lease_key)
+
+        manager = SimpleNamespace(sync_limiter=SyncRateLimiter("TEST"))
+        with mock.patch.object(LDAPUser, "get_ldap_manager", return_value=manager), \
+                mock.patch.object(LDAPUser, "sync") as sync:
+            middleware(self.get_request(session))
+        sync.assert_called_once()
+
+
+class SingleFlightTestCase(TestCase):
+
+    def test_concurrent_sync(self):
+        started, release = Event(), Event()
+
+        def blocking_sync():
+            started.set()
+            release.wait(5)
+
+        ldap_user = mock.MagicMock(user_id=1001, sync=mock.MagicMock(side_effect=blocking_sync))
+        results = []
+        first = Thread(target=lambda: results.append(sync_once(ldap_user)))
+        first.start()
+        self.assertTrue(started.wait(5))
+
+        # concurrent requests wait for the running sync instead of syncing again
+        waiters = [Thread(target=lambda: results.append(sync_once(ldap_user))) for _ in range(3)]
+        for waiter in waiters:
+            waiter.start()
+        release.set()
+        for thread in (first, *waiters):
+            thread.join(5)
+
+        ldap_user.sync.assert_called_once()
+        self.assertEqual(sorted(results), [False, False, False, True])
+
+    def test_lease_held_by_other_process(self):
+        ldap_user = mock.MagicMock(user_id=1002)
+        cache.set(get_sync_lease_cache_key(ldap_user.user_id), "other-process")
+        try:
+            self.assertFalse(sync_once(ldap_user))
+            ldap_user.sync.assert_not_called()
+        finally:
+            cache.delete(get_sync_lease_cache_key(ldap_user.user_id))
+        self.assertTrue(sync_once(ldap_user))
+        ldap_user.sync.assert_called_once()
+        # flights are not kept once the user's syncs are done
+        self.assertNotIn(ldap_user.user_id, _sync_flights)
+
+
+class SyncLDAPUsersCommandTestCase(TestCase):
+
+    def setUp(self):
+        self.manager = create_mock_manager()
+        for username, first_name in (("alice", "Alice"), ("bob", "Bob"), ("carol", "Carol")):
+            self.manager.connection.strategy.add_entry(f"CN={username},DC=test,DC=local", {
+                "objectClass": ["top", "person", "user"],
+                "objectCategory": "person",
+                "sAMAccountName": username,
+                "givenName": first_name,
+                "mail": f"{username}@test.local",
+            })
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_bulk_sync(self):
+        alice = User.objects.create_user("alice", first_name="Alice", email="alice@test.local")
+        bob = User.objects.create_user("bob", first_name="Robert")
+        missing = User.objects.create_user("dave", first_name="Dave")
+        for user in (alice, bob, missing):
+            LDAPUser.objects.create(user=user, domain="TEST")
+
+        call_command("syncldapusers", "TEST", page_size=2, stdout=mock.MagicMock())
+
+        bob.refresh_from_db()
+        self.assertEqual(bob.first_name, "Bob")
+        self.assertEqual(bob.email, "bob@test.local")
+        missing.refresh_from_db()
+        self.assertEqual(missing.first_name, "Dave")
+
+
+class EntryCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.manager = create_mock_manager()
+        self.manager.connection.strategy.add_entry("CN=alice,DC=test,DC=local", {
+            "objectClass": ["top", "person", "user"],
+            "objectCategory": "person",
+            "sAMAccountName": "alice",
+            "givenName": "Alice",
+            "description": "Test user",
+        })
+        self.ldap_user = LDAPUser.objects.create(user=User.objects.create_user("alice"), domain="TEST")
+        self.entry_cache = LocalMemoryEntryCache(timeout=60, max_size=2)
+        patcher = mock.patch("windows_auth.models.get_entry_cache", return_value=self.entry_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_cached_entry(self):
+        entry = self.ldap_user.get_ldap_user()
+        self.assertNotIsInstance(entry, CachedEntry)
+        cached = self.ldap_user.get_ldap_user()
+        self.assertIsInstance(cached, CachedEntry)
+        self.assertEqual(cached.givenName.value, "Alice")
+        self.assertEqual(self.entry_cache.stats(), {"hits": 1, "misses": 1})
+
+        # missing attributes are queried and merged into the cached entry
+        self.assertEqual(self.ldap_user.get_ldap_attr("description"), "Test user")
+        self.assertEqual(self.ldap_user.get_ldap_attr("givenName"), "Alice")
+        self.assertEqual(self.entry_cache.stats(), {"hits": 3, "misses": 1})
+
+    def test_size_bound(self):
+        for index in range(3):
+            self.entry_cache.set(str(index), {"dn": str(index), "attributes": {}})
+        self.assertEqual(len(self.entry_cache), 2)
+        self.assertIsNone(self.entry_cache.get("0"))
+
+
+class GroupIndexTestCase(TestCase):
+
+    def test_match(self):
+        reader = SimpleNamespace(entries=[
+            CachedEntry({"dn": "CN=Domain Admins,DC=test,DC=local",
+                         "attributes": {"cn": ["Domain Admins"], "sAMAccountName": ["Domain Admins"]}}),
+            CachedEntry({"dn": "CN=Web Users,DC=test,DC=local",
+                         "attributes": {"cn": ["Web Users"], "sAMAccountName": ["web-users"]}}),
+        ])
+        index = GroupIndex(reader, ["cn", "sAMAccountName"])
+
+        self.assertTrue(index.match("domain admins"))
+        self.assertTrue(index.match("WEB-USERS"))
+        self.assertTrue(index.match(["Missing", "Web Users"]))
+        self.assertFalse(index.match("Domain"))
+        self.assertFalse(index.match(None))
+        self.assertTrue(index.match([], default=True))
+        # only configured attributes are indexed
+        self.assertFalse(GroupIndex(reader, "cn").match("web-users"))
+
+
+class GroupMembershipSyncTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username="member")
+        self.ldap_user = LDAPUser.objects.create(user=self.user, domain="TEST")
+        self.manager = create_mock_manager(
+            SUPERUSER_GROUPS=None,
+            STAFF_GROUPS=None,
+            GROUP_MAP={"admins": "Domain Admins", "users": "Domain Users", "guests": "Domain Guests"},
+        )
+        Group.objects.create(name="guests").user_set.add(self.user)
+
+    def sync(self, *groups):
+        entry = CachedEntry({"dn": "CN=member,DC=test,DC=local", "attributes": {
+            "sAMAccountName": ["member"], "givenName": ["Member"], "sn": ["User"], "mail": ["member@test.local"],
+        }})
+        reader = SimpleNamespace(entries=[
+            CachedEntry({"dn": f"CN={group},DC=test,DC=local", "attributes": {"cn": [group]}})
+            for group in groups
+        ])
+        with mock.patch.object(LDAPUser, "get_ldap_manager", return_value=self.manager), \
+                mock.patch("windows_auth.models.WAUTH_USE_CACHE", True):
+            self.ldap_user._update_user(entry, reader)
+
+    def test_membership_delta(self):
+        self.sync("Domain Admins", "Domain Users")
+        self.assertEqual(set(self.user.groups.values_list("name", flat=True)), {"admins", "users"})
+
+        # a re-sync without changes reads the current membership only
+        with self.assertNumQueries(1):
+            self.sync("Domain Admins", "Domain Users")
+
+        # only the changed memberships are modified
+        with self.assertNumQueries(3):
+            self.sync("Domain Users", "Domain Guests")
+        self.assertEqual(set(self.user.groups.values_list("name", flat=True)), {"users", "guests"})
+
+    def test_membership_signals(self):
+        actions = []
+
+        def receiver(action, pk_set, **kwargs):
+            actions.append((action, {Group.objects.get(pk=pk).name for pk in pk_set}))
+
+        m2m_changed.connect(receiver, sender=User.groups.through)
+        try:
+            self.sync("Domain Admins")
+        finally:
+            m2m_changed.disconnect(receiver, sender=User.groups.through)
+        self.assertEqual(actions, [
+            ("pre_add", {"admins"}), ("post_add", {"admins"}),
+            ("pre_remove", {"guests"}), ("post_remove", {"guests"}),
+        ])
+
+
+class TokenGroupsTestCase(TestCase):
+    domain_sid = "S-1-5-21-1000-2000-3000"
+
+    def setUp(self):
+        self.manager = create_mock_manager(GROUP_STRATEGY="token_groups", GROUP_ATTRS=("cn", "sAMAccountName"))
+        for rid, name in ((512, "Domain Admins"), (513, "Domain Users"), (1105, "Web Users")):
+            self.manager.connection.strategy.add_entry(f"CN={name},DC=test,DC=local", {
+                "objectClass": ["top", "group"],
+                "cn": name,
+                "sAMAccountName": name,
+                "objectSid": sid_to_bytes(f"{self.domain_sid}-{rid}"),
+            })
+        self.manager.connection.strategy.add_entry("CN=bob,DC=test,DC=local", {
+            "objectClass": ["top", "person", "user"],
+            "objectCategory": "person",
+            "sAMAccountName": "bob",
+            "tokenGroups": [sid_to_bytes(f"{self.domain_sid}-{rid}") for rid in (513, 1105, 9999)],
+        })
+        self.ldap_user = LDAPUser.objects.create(user=User.objects.create_user("bob"), domain="TEST")
+
+    def tearDown(self):
+        self.manager.close()
+
+    def test_token_groups(self):
+        self.assertEqual(self.ldap_user.get_token_groups(),
+                         [f"{self.domain_sid}-{rid}" for rid in (513, 1105, 9999)])
+
+        groups = self.ldap_user.get_ldap_groups()
+        self.assertIsInstance(groups, CachedReader)
+        self.assertEqual(sorted(entry.cn.value for entry in groups), ["Domain Users", "Web Users"])
+        self.assertTrue(groups.match("cn", "web"))
+
+        # SIDs are resolved from the group table, including SIDs that are not groups
+        table = get_group_table(self.manager)
+        self.assertEqual(len(table), 3)
+        with mock.patch.object(table, "_search") as search:
+            self.ldap_user.get_ldap_groups()
+        search.assert_not_called()
+
+
+    def test_pipelined_sync(self):
+        self.ldap_user.sync()
+        self.ldap_user.refresh_from_db()
+        self.assertEqual(self.ldap_user.distinguished_name, "CN=bob,DC=test,DC=local")
+
+        # with a known DN, groups are searched concurrently with the user
+        with mock.patch.object(LDAPUser, "get_ldap_groups", autospec=True,
+                               side_effect=LDAPUser.get_ldap_groups) as get_ldap_groups, \
+                mock.patch.object(self.manager.executor, "submit", wraps=self.manager.executor.submit) as submit:
+            self.ldap_user.sync()
+        submit.assert_called_once()
+        get_ldap_groups.assert_called_once()
+
+    def test_pipelined_sync_timings(self):
+        self.ldap_user.sync()
+
+        # the group search running in the executor is timed for the request's thread
+        timings = TimingCollector()
+        subscribe(timings)
+        try:
+            self.ldap_user.sync()
+        finally:
+            unsubscribe(timings)
+        self.assertIn("search_groups", {timing["name"] for timing in timings.get_summary("TEST")})
+
+    @mock.patch("windows_auth.panels.WAUTH_PANEL_STACKTRACE_RATE", 0)
+    def test_panel_collects_sync(self):
+        panel = LDAPPanel(mock.MagicMock(), mock.MagicMock())
+        panels.collector.clear_collection()
+        panels.timing_collector.clear_summary()
+        panel.enable_instrumentation()
+        try:
+            # pooled connections are created during the request, the second sync is pipelined
+            self.ldap_user.sync()
+            self.ldap_user.sync()
+            connections = self.manager.get_connections()
+            self.assertGreater(len(connections), 1)
+            self.assertTrue(all(hasattr(connection.strategy.get_response, "original") for connection in connections))
+        finally:
+            panel.disable_instrumentation()
+
+        summary = {timing["name"]: timing for timing in panels.timing_collector.get_summary("TEST")}
+        self.assertEqual(summary["search_groups"]["count"], 2)
+        self.assertFalse(any(hasattr(connection.strategy.get_response, "original")
+                             for connection in self.manager.get_connections()))
+        panels.collector.clear_collection()
+        panels.timing_collector.clear_summary()
+
+    def test_pipelined_sync_moved_user(self):
+        self.ldap_user.distinguished_name = "CN=bob,OU=Old,DC=test,DC=local"
+        self.ldap_user.save()
+
+        # groups are searched again using the new DN
+        with mock.patch.object(LDAPUser, "_update_user", autospec=True) as update_user:
+            self.ldap_user.sync()
+        _, ldap_entry, groups = update_user.call_args[0]
+        self.assertEqual(sorted(entry.cn.value for entry in groups), ["Domain Users", "Web Users"])
+
+        self.ldap_user._update_user(ldap_entry, groups)
+        self.ldap_user.refresh_from_db()
+        self.assertEqual(self.ldap_user.distinguished_name, "CN=bob,DC=test,DC=local")
+
+
+class GroupGraphTestCase(TestCase):
+
+    def setUp(self):
+        self.manager = create_mock_manager(GROUP_STRATEGY="graph", READ_ONLY=False)
+        # A is nested in B, B is nested in C (and C in B)
+        for name, member_of in (("A", ["B"]), ("B", ["C"]), ("C", ["B"]), ("D", [])):
+            self.add_group(name, member_of)
+        self.manager.connection.strategy.add_entry("CN=carol,DC=test,DC=local", {
+            "objectClass": ["top", "person", "user"],
+            "objectCategory": "person",
+            "sAMAccountName": "carol",
+            "memberOf": [self.group_dn("A")],
+        })
+        self.ldap_user = LDAPUser.objects.create(user=User.objects.create_user("carol"), domain="TEST")
+
+    def tearDown(self):
+        self.manager.close()
+
+    @staticmethod
+    def group_dn(name):
+        return f"CN={name},DC=test,DC=local"
+
+    def add_group(self, name, member_of, when_changed="20260101000000.0Z"):
+        self.manager.connection.strategy.add_entry(self.group_dn(name), {
+            "objectClass": ["top", "group"],
+            "cn": name,
+            "whenChanged": when_changed,
+            "memberOf": [self.group_dn(parent) for parent in member_of],
+        })
+
+    def test_transitive_membership(self):
+        groups = self.ldap_user.get_ldap_groups()
+        self.assertIsInstance(groups, CachedReader)
+        self.assertEqual(sorted(entry.cn.value for entry in groups), ["A", "B", "C"])
+
+    def test_incremental_refresh(self):
+        graph = get_group_graph(self.manager)
+        state = graph.get_state()
+        self.assertEqual(len(state.groups), 4)
+
+        # nest A in D, modifying D
+        self.manager.connection.modify(self.group_dn("A"), {"memberOf": [(MODIFY_ADD, [self.group_dn("D")])]})
+        self.manager.connection.modify(self.group_dn("D"), {"whenChanged": [(MODIFY_REPLACE, ["20260601000000.0Z"])]})
+        self.add_group("E", ["D"], when_changed="20260601000000.0Z")
+
+        state = graph.update(state)
+        self.assertEqual(state.closure[self.group_dn("A").lower()],
+                         {self.group_dn(name).lower() for name in "ABCD"})
+        self.assertIn(self.group_dn("E").lower(), state.groups)
+        self.assertEqual(state.high_water_mark, timezone.datetime(2026, 6, 1, tzinfo=timezone.utc))
+
+    def test_background_refresh(self):
+        started, release = Event(), Event()
+
+        def blocking_refresh():
+            started.set()
+            release.wait(5)
+
+        graph = GroupGraph(self.manager, refresh_interval=60)
+        state = graph.get_state()
+        state.refreshed_at -= 120
+        with mock.patch.object(graph, "refresh", side_effect=blocking_refresh) as refresh:
+            # the current graph is served while a single refresh runs in background
+            self.assertIs(graph.get_state(), state)
+            self.assertTrue(started.wait(5))
+            self.assertIs(graph.get_state(), state)
+            release.set()
+            graph._refresh_thread.join(5)
+        refresh.assert_called_once()
+        self.assertFalse(graph._lock.locked())
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot_path = os.path.join(directory, "groups.json")
+            graph = GroupGraph(self.manager, snapshot_path=snapshot_path)
+            self.assertEqual(len(graph.get_state().groups), 4)
+            self.assertTrue(os.path.exists(snapshot_path))
+
+            # other processes load the snapshot instead of searching LDAP
+            other = GroupGraph(self.manager, snapshot_path=snapshot_path)
+            with mock.patch.object(other, "_search") as search, \
+                    mock.patch.object(other, "_write_snapshot") as write_snapshot:
+                groups = other.get_groups([self.group_dn("A")])
+            search.assert_not_called()
+            write_snapshot.assert_not_called()
+            self.assertEqual(sorted(group["dn"] for group in groups), [self.group_dn(name) for name in "ABC"])
+
+
+class SchemaCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = get_schema_cache_path(self.directory.name, "TEST")
+        offline_server = Server("test.local", get_info=OFFLINE_AD_2012_R2)
+        save_schema_cache(self.path, "test.local", offline_server.info, offline_server.schema, "20260101000000.0Z")
+
+    def test_load_cached_schema(self):
+        manager = create_mock_manager(
+            SCHEMA_CACHE_DIR=self.directory.name,
+            SERVER_OPTIONS={"get_info": SCHEMA},
+            PRELOAD_DEFINITIONS=["user", "computer"],
+        )
+        # server info is not read from the server, and definitions are generated from the cached schema
+        self.assertEqual(manager.server.get_info, NONE)
+        self.assertIn("user", manager.server.schema.object_classes)
+        self.assertIn("givenName", manager.get_definition("user"))
+        manager.close()
+
+    def test_cache_key(self):
+        cached_schema = load_schema_cache(self.path, "test.local")
+        self.assertEqual(cached_schema.schema_version, "20260101000000.0Z")
+        self.assertFalse(cached_schema.is_stale(60))
+        self.assertTrue(cached_schema.is_stale(-1))
+        # the cache is ignored for another server
+        self.assertIsNone(load_schema_cache(self.path, "other.local"))
+
+
+class BenchmarkTestCase(TestCase):
+
+    def test_synthetic_directory(self):
+        directory = SyntheticDirectory(users=10, groups=9, depth=3, groups_per_user=2)
+        # groups of the top level are not nested
+        self.assertEqual(directory.parents[0], [])
+        self.assertEqual(len(directory.parents[2]), 1)
+        user_groups = directory.member_of["user0"]
+        self.assertTrue(set(user_groups) <= set(directory.closure(user_groups)))
+
+    def test_run_benchmarks(self):
+        directory = SyntheticDirectory(users=5, groups=4, depth=2, groups_per_user=2)
+        results = run_benchmarks(directory, strategies=("token_groups",), iterations=2, log=lambda line: None)
+
+        result = results["results"]["token_groups"]["sync"]
+        self.assertEqual(result["iterations"], 2)
+        self.assertGreater(result["ldap_operations"], 0)
+        self.assertGreater(result["db_queries"], 0)
+        self.assertEqual(len(compare_results(results, results)), len(results["results"]["token_groups"]))
+        # benchmark users are deleted
+        self.assertFalse(LDAPUser.objects.filter(domain="BENCH").exists())
+
+
+class EmulatorTestCase(TestCase):
+
+    def setUp(self):
+        self.emulator = ADEmulator(search_base="DC=emu,DC=local")
+        set_emulator("EMU", self.emulator)
+        self.admins = self.emulator.add_group("Domain Admins", rid=512)
+        self.web = self.emulator.add_group("Web Users")
+        self.nested = self.emulator.add_group("Nested", members=[self.web])
+        self.user_dn = self.emulator.add_user("dave", groups=[self.admins, self.web], givenName="Dave",
+                                              mail="dave@emu.local")
+        self.manager = LDAPManager("EMU", LDAPSettings(
+            SERVER="emu.local",
+            SEARCH_BASE="DC=emu,DC=local",
+            USERNAME="EMU\\sync",
+            PASSWORD="secret",
+            USE_SSL=False,
+            GROUP_MAP={"admins": "Domain Admins", "nested": "Nested"},
+            SUPERUSER_GROUPS="Domain Admins",
+            CONNECTION_FACTORY="windows_auth.testing.emulator_connection",
+        ))
+        _ldap_connections["EMU"] = self.manager
+        self.ldap_user = LDAPUser.objects.create(user=User.objects.create_user("dave"), domain="EMU")
+
+    def tearDown(self):
+        self.manager.close()
+        _ldap_connections.pop("EMU", None)
+        set_emulator("EMU", None)
+
+    def test_in_chain_sync(self):
+        groups = {group.cn.value for group in self.ldap_user.get_ldap_groups()}
+        self.assertEqual(groups, {"Domain Admins", "Web Users", "Nested"})
+
+        self.ldap_user.sync()
+        user = User.objects.get(pk=self.ldap_user.user_id)
+        self.assertTrue(user.is_superuser)
+        self.assertEqual(user.first_name, "Dave")
+        self.assertEqual(set(user.groups.values_list("name", flat=True)), {"admins", "nested"})
+
+    def test_back_links(self):
+        with self.manager.get_connection() as connection:
+            connection.search(self.user_dn, "(objectClass=*)", search_scope="BASE",
+                              attributes=["memberOf", "tokenGroups"])
+            entry = connection.entries[0]
+            self.assertEqual(set(entry.memberOf.values), {self.admins, self.web})
+            self.assertIn(sid_to_bytes(f"{self.emulator.domain_sid}-513"), entry.tokenGroups.raw_values)
+
+            # members of a group, recursively
+            connection.search("DC=emu,DC=local", f"(memberOf:{MATCHING_RULE_IN_CHAIN}:={self.nested})")
+            self.assertEqual({entry.entry_dn for entry in connection.entries}, {self.web, self.user_dn})
+
+        self.emulator.remove_member(self.web, self.user_dn)
+        groups = {group.cn.value for group in self.ldap_user.get_ldap_groups()}
+        self.assertEqual(groups, {"Domain Admins"})
+
+    def test_failure_injection(self):
+        self.emulator.fail_next()
+        with self.assertRaises(LDAPException):
+            self.ldap_user.get_ldap_user(use_cache=False)
+        # the terminated connection is replaced
+        self.assertEqual(self.ldap_user.get_ldap_user(use_cache=False).givenName.value, "Dave")
+        self.assertGreaterEqual(self.emulator.operations["search"], 2)
+
+    def test_paged_sync(self):
+        for index in range(5):
+            self.emulator.add_user(f"user{index}", givenName=f"User {index}")
+            LDAPUser.objects.create(user=User.objects.create_user(f"user{index}"), domain="EMU")
+
+        call_command("syncldapusers", "EMU", page_size=2, stdout=mock.MagicMock())
+        self.assertEqual(User.objects.get(username="user4").first_name, "User 4")
+
+    def test_load_ldif(self):
+        dns = self.emulator.load_ldif(io.StringIO(
+            "version: 1\n"
+            "\n"
+            "dn: CN=erin,DC=emu,DC=local\n"
+            "objectClass: top\n"
+            "objectClass: user\n"
+            "sAMAccountName: erin\n"
+            "givenName:: RXJpbg==\n"
+        ))
+        self.assertEqual(dns, ["CN=erin,DC=emu,DC=local"])
+        self.emulator.add_member(self.web, dns[0])
+        with self.manager.get_connection() as connection:
+            connection.search("DC=emu,DC=local", "(sAMAccountName=erin)", attributes=["givenName", "memberOf"])
+            self.assertEqual(connection.entries[0].givenName.value, "Erin")
+            self.assertEqual(connection.entries[0].memberOf.value, self.web)
+
+
+@override_settings(ROOT_URLCONF="demo.benchmarks", MIDDLEWARE=BENCHMARK_MIDDLEWARE,
+                   AUTHENTICATION_BACKENDS=["windows_auth.backends.WindowsAuthBackend"])
+class CallBudgetTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = SyntheticDirectory(users=3, groups=4, depth=2, groups_per_user=2)
+        set_emulator("BENCH", self.directory.create_emulator())
+        self.manager = self.directory.create_manager("token_groups")
+        self.client = Client(REMOTE_USER="BENCH\\user0")
+        # groups cached by other tests were rolled back
+        _clear_local_groups()
+
+    def tearDown(self):
+        self.manager.close()
+        _ldap_connections.pop("BENCH", None)
+        set_emulator("BENCH", None)
+
+    def test_call_counter(self):
+        with CallCounter() as counter:
+            cache.get("wauth_test")
+            cache.get_or_set("wauth_test", 1)
+            User.objects.exists()
+        self.assertEqual(counter.cache_calls, 2)
+        self.assertEqual(counter.db_queries, 1)
+
+        with self.assertRaises(AssertionError):
+            with assert_max_calls(db=0):
+                User.objects.exists()
+
+    def test_request_budget(self):
+        with resync_mode("db", 600):
+            counter = assert_request_budget(self.client, "/middleware/", db=4, cache=0, ldap=0)
+            self.assertEqual(counter.ldap_operations, 0)
+            # the first request creates and syncs the user
+            self.assertTrue(LDAPUser.objects.filter(user__username="user0", domain="BENCH").exists())
+
+            with self.assertRaisesMessage(AssertionError, "DB queries"):
+                assert_request_budget(self.client, "/ldap_sync_required/", db=1)
+
+
+class RequestBenchmarkTestCase(TransactionTestCase):
+
+    def test_run_request_benchmarks(self):
+        directory = SyntheticDirectory(users=4, groups=4, depth=2, groups_per_user=2)
+        results = run_request_benchmarks(directory, modes=("db", "cache"), views=("middleware",), users=2,
+                                         requests=4, concurrency=1, log=lambda line: None)
+
+        result = results["results"]["db"]["middleware"]
+        self.assertEqual(result["iterations"], 4)
+        self.assertEqual(result["errors"], 0)
+        self.assertEqual(result["ldap_operations"], 0)
+        self.assertGreater(results["results"]["cache"]["middleware"]["cache_calls"], 0)
+        self.assertFalse(LDAPUser.objects.filter(domain="BENCH").exists())
+
+
+class CircuitBreakerTestCase(TestCase):
+
+    def test_states(self):
+        breaker = CircuitBreaker("TEST", failure_threshold=2, open_interval=60)
+        for _ in range(2):
+            with self.assertRaises(LDAPSocketOpenError), breaker.call():
+                raise LDAPSocketOpenError("down")
+        self.assertEqual(breaker.state, CIRCUIT_OPEN)
+        with self.assertRaises(LDAPCircuitOpenError), breaker.call():
+            self.fail("call allowed while the circuit is open")
+
+        # a single probe is allowed once the open interval passed
+        breaker.open_interval = 0
+        self.assertEqual(breaker.state, CIRCUIT_HALF_OPEN)
+        with breaker.call():
+            with self.assertRaises(LDAPCircuitOpenError), breaker.call():
+                self.fail("concurrent call allowed while probing")
+        self.assertEqual(breaker.state, CIRCUIT_CLOSED)
+
+    def test_server_errors(self):
+        # errors returned by the server are not failures of the server
+        breaker = CircuitBreaker("TEST", failure_threshold=1)
+        with self.assertRaises(LDAPNoSuchObjectResult), breaker.call():
+            raise LDAPNoSuchObjectResult()
+        with self.assertRaises(ValueError), breaker.call():
+            raise ValueError()
+        self.assertEqual(breaker.state, CIRCUIT_CLOSED)
+
+    def test_nested_probe(self):
+        # a nested guarded call failing fast during the probe did not contact the server
+        breaker = CircuitBreaker("TEST", failure_threshold=1, open_interval=0)
+        with self.assertRaises(LDAPSocketOpenError), breaker.call():
+            raise LDAPSocketOpenError("down")
+        with self.assertRaises(LDAPCircuitOpenError), breaker.call():
+            with breaker.call():
+                self.fail("nested call allowed while probing")
+        self.assertNotEqual(breaker.state, CIRCUIT_CLOSED)
+
+        with self.assertRaises(LDAPSyncRateLimitError), breaker.call():
+            raise LDAPSyncRateLimitError()
+        self.assertNotEqual(breaker.state, CIRCUIT_CLOSED)
+
+    def test_manager_fails_fast(self):
+        emulator = ADEmulator(search_base="DC=circuit,DC=local")
+        emulator.add_user("dave", givenName="Dave")
+        set_emulator("CIRCUIT", emulator)
+        manager = LDAPManager("CIRCUIT", LDAPSettings(
+            SERVER="circuit.local",
+            SEARCH_BASE="DC=circuit,DC=local",
+            USERNAME="CIRCUIT\\sync",
+            PASSWORD="secret",
+            USE_SSL=False,
+            CIRCUIT_FAILURE_THRESHOLD=2,
+            CIRCUIT_OPEN_INTERVAL=60,
+            CONNECTION_FACTORY="windows_auth.testing.emulator_connection",
+        ))
+        ldap_user = LDAPUser.objects.create(user=User.objects.create_user("dave"), domain="CIRCUIT")
+        try:
+            emulator.fail_next(2)
+            for _ in range(2):
+                with self.assertRaises(LDAPException):
+                    ldap_user.get_ldap_user(use_cache=False)
+
+            emulator.reset_operations()
+            with self.assertRaises(LDAPCircuitOpenError):
+                ldap_user.get_ldap_user(use_cache=False)
+            self.assertFalse(emulator.operations)
+
+            manager.circuit.open_interval = 0
+            self.assertEqual(ldap_user.get_ldap_user(use_cache=False).givenName.value, "Dave")
+            self.assertEqual(manager.circuit.state, CIRCUIT_CLOSED)
+        finally:
+            manager.circuit.reset()
+            manager.close()
+            _ldap_connections.pop("CIRCUIT", None)
+            set_emulator("CIRCUIT", None)
+
+    @mock.patch("windows_auth.middleware.WAUTH_REQUIRE_RESYNC", False)
+    @mock.patch("windows_auth.middleware.WAUTH_RESYNC_DELTA", 600)
+    @mock.patch("windows_auth.sync.WAUTH_USE_CACHE", False)
+    @mock.patch("windows_auth.sync.WAUTH_RESYNC_DELTA", 600)
+    def test_middleware_negative_cache(self):
+        user = User.objects.create(username="negative")
+        LDAPUser.objects.create(user=user, domain="TEST")
+        request = RequestFactory().get(reverse("demo:index"))
+        request.user = user
+        get_response = mock.MagicMock()
+        middleware = UserSyncMiddleware(get_response)
+
+        with mock.patch("windows_auth.middleware.sync_once", side_effect=LDAPSocketOpenError("down")) as sync:
+            # the request proceeds with the user's current state
+            middleware(request)
+            middleware(request)
+            sync.assert_called_once()
+            self.assertEqual(get_response.call_count, 2)
+
+            # re-sync is attempted again after the failure timeout
+            cache.delete(get_sync_failure_cache_key(user.pk))
+            middleware(request)
+            self.assertEqual(sync.call_count, 2)
+        cache.delete(get_sync_failure_cache_key(user.pk))
+
+
+class SyncRateLimitTestCase(TestCase):
+
+    def test_rate(self):
+        limiter = SyncRateLimiter("TEST", rate=0.5, burst=2)
+        for _ in range(2):
+            self.assertTrue(limiter.acquire())
+            limiter.release()
+        self.assertFalse(limiter.acquire())
+        self.assertGreater(limiter.try_acquire(), 1)
+
+        # a burst below a single sync still allows syncs at the rate
+        self.assertTrue(SyncRateLimiter("TEST", rate=1, burst=0).acquire())
+
+    def test_concurrency(self):
+        limiter = SyncRateLimiter("TEST", max_concurrent=1)
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        with self.assertRaises(LDAPSyncRateLimitError), limiter.limit(timeout=0.05):
+            self.fail("sync allowed over the concurrency limit")
+
+        limiter.release()
+        self.assertEqual(limiter.running, 0)
+        with limiter.limit(timeout=0):
+            self.assertEqual(limiter.running, 1)
+
+    def test_shared(self):
+        # limiters of different processes share their counts through the cache
+        first = SyncRateLimiter("SHARED", rate=0.5, max_concurrent=1, shared=True)
+        second = SyncRateLimiter("SHARED", rate=0.5, max_concurrent=1, shared=True)
+        try:
+            self.assertTrue(first.acquire())
+            self.assertFalse(second.acquire())
+            first.release()
+            # the concurrency slot is free, but the shared rate window is exhausted
+            self.assertFalse(second.acquire())
+            self.assertEqual(cache.get(second.concurrency_cache_key), 0)
+        finally:
+            cache.clear()
+
+    def test_sync_deferred(self):
+        limiter = SyncRateLimiter("TEST", max_concurrent=1)
+        ldap_user = mock.MagicMock(user_id=1003)
+        ldap_user.get_ldap_manager.return_value.sync_limiter = limiter
+
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(sync_once(ldap_user))
+        ldap_user.sync.assert_not_called()
+
+        limiter.release()
+        self.assertTrue(sync_once(ldap_user))
+        ldap_user.sync.assert_called_once()
+        self.assertEqual(limiter.running, 0)
+
+    def test_new_user_waits(self):
+        limiter = SyncRateLimiter("TEST", max_concurrent=1)
+        manager = SimpleNamespace(sync_limiter=limiter, settings=SimpleNamespace(SYNC_LIMIT_TIMEOUT=0.05))
+        backend = WindowsAuthBackend()
+        backend.domain = "TEST"
+        user = User(username="limited")
+
+        with mock.patch.object(LDAPUser, "get_ldap_manager", return_value=manager), \
+                mock.patch.object(LDAPUser, "sync") as sync:
+            self.assertTrue(limiter.acquire())
+            with self.assertRaises(LDAPSyncRateLimitError):
+                backend.configure_user(None, user)
+            sync.assert_not_called()
+
+            # the sync proceeds once a running sync completes
+            Thread(target=lambda: (time.sleep(0.01), limiter.release())).start()
+            manager.settings.SYNC_LIMIT_TIMEOUT = 5
+            self.assertEqual(backend.configure_user(None, user), user)
+            sync.assert_called_once()
@@ -21,4 +21,5 @@ urlpatterns = [
     path("", include("demo.urls")),
     path('__debug__/', include(debug_toolbar.urls)),
     path('admin/', admin.site.urls),
+    path('wauth/', include('windows_auth.urls')),
 ]
@@ -1,7 +1,6 @@
 import atexit
 
 from django.db import DatabaseError
-from ldap3.core.exceptions import LDAPException
 from django.apps import AppConfig
 from django.db.models import Count
 
@@ -13,9 +12,11 @@ class WindowsAuthConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
 
     def ready(self):
-        from windows_auth.conf import WAUTH_IGNORE_SETTING_WARNINGS, WAUTH_PRELOAD_DOMAINS, WAUTH_DOMAINS
+        from windows_auth.conf import WAUTH_IGNORE_SETTING_WARNINGS, WAUTH_PRELOAD_DOMAINS, WAUTH_DOMAINS, \
+            WAUTH_PRELOAD_TIMEOUT, WAUTH_PRELOAD_BACKGROUND
         from windows_auth.settings import DEFAULT_DOMAIN_SETTING
-        from windows_auth.ldap import get_ldap_manager, close_connections
+        from windows_auth.ldap import preload_domains as preload, close_connections
+        from windows_auth.latency import get_latency_registry
 
         # Note, when using "runserver" command this method will run multiple times due to the server first validating
         # models before loading the project. When using WAUTH_PRELOAD_DOMAINS, this may cause multiple LDAP connections
@@ -45,16 +46,10 @@ class WindowsAuthConfig(AppConfig):
 
         # preload domains
         if preload_domains:
-            for domain in preload_domains:
-                try:
-                    # attempt to load LDAP connection
-                    manager = get_ldap_manager(domain)
-                    if manager.connection.bound:
-                        logger.debug(f"Preloaded LDAP connection to domain {domain} successfully.")
-                    else:
-                        logger.warning(f"Failed to preload connection to domain {domain}.")
-                except LDAPException as e:
-                    logger.exception(f"Failed to preload connection to domain {domain}.")
+            preload(preload_domains, timeout=WAUTH_PRELOAD_TIMEOUT, background=WAUTH_PRELOAD_BACKGROUND)
+
+        # publish LDAP latency metrics of this process
+        get_latency_registry().start()
 
         # unbind all connection at exit
         atexit.register(close_connections)
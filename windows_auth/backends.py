@@ -32,9 +32,15 @@ class WindowsAuthBackend(RemoteUserBackend):
     def configure_user(self, request, user):
         """
         Create new LDAP User object and perform initialize LDAP sync
+        New users have no state to be served with, so the sync waits for the domain's sync limits
+        up to the SYNC_LIMIT_TIMEOUT setting.
+        :return: The configured user, to be logged in
         """
         ldap_user = LDAPUser(
             user=user,
             domain=self.domain,
         )
-        ldap_user.sync()
+        manager = ldap_user.get_ldap_manager()
+        with manager.sync_limiter.limit(manager.settings.SYNC_LIMIT_TIMEOUT):
+            ldap_user.sync()
+        return user
@@ -0,0 +1,185 @@
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Optional, Dict, Iterator, Tuple, Type
+
+from ldap3.core.exceptions import LDAPException, LDAPCommunicationError, LDAPResponseTimeoutError
+
+from windows_auth import logger
+from windows_auth.ratelimit import LDAPSyncRateLimitError
+
+# circuit breaker states
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# exceptions counted as failures of the server, other exceptions mean the server did respond
+CIRCUIT_FAILURES = (LDAPCommunicationError, LDAPResponseTimeoutError)
+
+
+class LDAPCircuitOpenError(LDAPException):
+    """
+    LDAP operations to the domain are not attempted, the server failed repeatedly.
+    """
+
+
+class CircuitBreaker:
+    """
+    Fail fast while the LDAP server of a domain is unavailable.
+
+    After failure_threshold consecutive failures the circuit opens, and calls fail immediately for open_interval
+    seconds. Then a single call probes the server (half open): the circuit closes when it succeeds,
+    and opens again when it fails.
+    """
+
+    def __init__(self, domain: str, failure_threshold: Optional[int] = 5, open_interval: float = 30):
+        """
+        :param domain: Domain of the server, used for logging
+        :param failure_threshold: Consecutive failures opening the circuit, None to never open
+        :param open_interval: Time (seconds) the circuit stays open before probing the server
+        """
+        self.domain = domain
+        self.failure_threshold = failure_threshold
+        self.open_interval = open_interval
+
+        self._lock = Lock()
+        self._state = CIRCUIT_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == CIRCUIT_OPEN and time.monotonic() - self._opened_at >= self.open_interval:
+                return CIRCUIT_HALF_OPEN
+            return self._state
+
+    @property
+    def retry_in(self) -> float:
+        """
+        Time (seconds) until the server is probed, 0 when calls are allowed.
+        """
+        with self._lock:
+            if self._state != CIRCUIT_OPEN:
+                return 0.0
+            return max(self.open_interval - (time.monotonic() - self._opened_at), 0.0)
+
+    def before_call(self) -> None:
+        """
+        Check whether a call is allowed, when half open only a single probe is allowed at a time.
+        Every allowed call must be followed by on_success(), on_failure() or on_ignored().
+        :raises LDAPCircuitOpenError: Calls are not allowed
+        """
+        with self._lock:
+            if self._state == CIRCUIT_CLOSED:
+                return
+
+            if self._state == CIRCUIT_OPEN and time.monotonic() - self._opened_at >= self.open_interval:
+                self._state = CIRCUIT_HALF_OPEN
+            if self._state == CIRCUIT_HALF_OPEN and not self._probing:
+                self._probing = True
+                logger.info(f"Probing LDAP server of domain {self.domain}")
+                return
+
+            retry_in = max(self.open_interval - (time.monotonic() - self._opened_at), 0.0)
+        raise LDAPCircuitOpenError(f"LDAP circuit of domain {self.domain} is open, retrying in {retry_in:.1f} seconds")
+
+    def on_success(self) -> None:
+        with self._lock:
+            if self._state != CIRCUIT_CLOSED:
+                logger.warning(f"LDAP server of domain {self.domain} recovered, closing circuit")
+            self._state = CIRCUIT_CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def on_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == CIRCUIT_HALF_OPEN or (
+                    self._state == CIRCUIT_CLOSED and self.failure_threshold is not None
+                    and self._failures >= self.failure_threshold):
+                logger.warning(f"LDAP server of domain {self.domain} failed {self._failures} times, "
+                               f"opening circuit for {self.open_interval} seconds")
+                self._state = CIRCUIT_OPEN
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def on_ignored(self) -> None:
+        """
+        The call ended without telling whether the server is available.
+        """
+        with self._lock:
+            self._probing = False
+
+    @contextmanager
+    def call(self, ignored: Tuple[Type[BaseException], ...] = ()) -> Iterator[None]:
+        """
+        Guard a block of LDAP operations.
+        :param ignored: Exceptions not telling whether the server is available
+        :raises LDAPCircuitOpenError: Calls are not allowed
+        """
+        self.before_call()
+        try:
+            yield
+        except CIRCUIT_FAILURES:
+            self.on_failure()
+            raise
+        except (LDAPCircuitOpenError, LDAPSyncRateLimitError) + tuple(ignored):
+            # raised without contacting the server, e.g. by a nested guarded call
+            self.on_ignored()
+            raise
+        except LDAPException:
+            # the server responded with an error
+            self.on_success()
+            raise
+        except BaseException:
+            self.on_ignored()
+            raise
+        else:
+            self.on_success()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state = CIRCUIT_CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def _after_fork(self) -> None:
+        self._lock = Lock()
+        self._probing = False
+
+
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = Lock()
+
+
+def get_circuit_breaker(domain: str, failure_threshold: Optional[int] = 5,
+                        open_interval: float = 30) -> CircuitBreaker:
+    """
+    Get or create the circuit breaker of a domain.
+    The circuit breaker outlives the domain's LDAP Manager, so failures to create the manager are counted too.
+    :param domain: Domain NetBIOS name
+    :param failure_threshold: Consecutive failures opening the circuit, None to never open
+    :param open_interval: Time (seconds) the circuit stays open before probing the server
+    """
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(domain)
+        if breaker is None:
+            breaker = _circuit_breakers[domain] = CircuitBreaker(domain, failure_threshold, open_interval)
+        else:
+            breaker.failure_threshold = failure_threshold
+            breaker.open_interval = open_interval
+        return breaker
+
+
+def _reset_locks_after_fork():
+    global _circuit_breakers_lock
+    _circuit_breakers_lock = Lock()
+    for breaker in _circuit_breakers.values():
+        breaker._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
@@ -30,5 +30,48 @@ WAUTH_LOWERCASE_USERNAME: bool = getattr(settings, "WAUTH_LOWERCASE_USERNAME", T
 WAUTH_IGNORE_SETTING_WARNINGS: bool = getattr(settings, "WAUTH_IGNORE_SETTING_WARNINGS", False)
 # List of domains to preload and connect during process startup
 WAUTH_PRELOAD_DOMAINS: Optional[Iterable[str]] = getattr(settings, "WAUTH_PRELOAD_DOMAINS", None)
+# Maximum time (seconds) to wait for preloading all domains during process startup
+WAUTH_PRELOAD_TIMEOUT: Optional[float] = getattr(settings, "WAUTH_PRELOAD_TIMEOUT", 30)
+# Preload domains in background, without delaying process startup
+WAUTH_PRELOAD_BACKGROUND: bool = getattr(settings, "WAUTH_PRELOAD_BACKGROUND", False)
+# Interval (seconds) for saving LDAP connection metrics of long-running processes
+WAUTH_METRICS_FLUSH_INTERVAL: Optional[float] = getattr(settings, "WAUTH_METRICS_FLUSH_INTERVAL", 300)
+# Days to keep raw LDAP usage metrics after they are rolled up, and hourly / daily rollups, None to keep forever
+WAUTH_METRICS_RAW_RETENTION: Optional[float] = getattr(settings, "WAUTH_METRICS_RAW_RETENTION", 7)
+WAUTH_METRICS_HOURLY_RETENTION: Optional[float] = getattr(settings, "WAUTH_METRICS_HOURLY_RETENTION", 90)
+WAUTH_METRICS_DAILY_RETENTION: Optional[float] = getattr(settings, "WAUTH_METRICS_DAILY_RETENTION", None)
+# Interval (seconds) for publishing LDAP latency histograms to the cache, aggregating all processes
+WAUTH_LATENCY_PUBLISH_INTERVAL: Optional[float] = getattr(settings, "WAUTH_LATENCY_PUBLISH_INTERVAL", 15)
+# Client IP addresses or networks allowed to access the LDAP metrics view, None to allow all clients
+WAUTH_METRICS_ALLOWED_IPS: Optional[Iterable[str]] = getattr(settings, "WAUTH_METRICS_ALLOWED_IPS",
+                                                             ("127.0.0.1", "::1"))
+# Maximum LDAP operations kept by the debug toolbar LDAP Panel for each request, the oldest are dropped
+WAUTH_PANEL_MAX_OPERATIONS: int = getattr(settings, "WAUTH_PANEL_MAX_OPERATIONS", 100)
+# Maximum response entries kept for each LDAP operation in the debug toolbar LDAP Panel
+WAUTH_PANEL_MAX_ENTRIES: int = getattr(settings, "WAUTH_PANEL_MAX_ENTRIES", 100)
+# Fraction of LDAP operations with a stack trace in the debug toolbar LDAP Panel
+WAUTH_PANEL_STACKTRACE_RATE: float = getattr(settings, "WAUTH_PANEL_STACKTRACE_RATE", 0.1)
 # User to impersonate when using SimulateWindowsAuthMiddleware
 WAUTH_SIMULATE_USER: str = getattr(settings, "WAUTH_SIMULATE_USER", "")
+# Serve users with expired sync immediately and re-sync them in a background worker
+WAUTH_RESYNC_BACKGROUND: bool = getattr(settings, "WAUTH_RESYNC_BACKGROUND", False)
+# Maximum time since last sync for serving a user while re-syncing in background, otherwise re-sync inline
+WAUTH_RESYNC_MAX_STALENESS: Optional[Union[str, int, timezone.timedelta]] = getattr(settings,
+                                                                                    "WAUTH_RESYNC_MAX_STALENESS",
+                                                                                    None)
+# Number of background re-sync worker threads
+WAUTH_RESYNC_WORKERS: int = getattr(settings, "WAUTH_RESYNC_WORKERS", 2)
+# Maximum number of users waiting for background re-sync
+WAUTH_RESYNC_QUEUE_SIZE: int = getattr(settings, "WAUTH_RESYNC_QUEUE_SIZE", 100)
+# Maximum time (seconds) a user sync holds the sync lock, and concurrent requests wait for it
+WAUTH_SYNC_LOCK_TIMEOUT: int = getattr(settings, "WAUTH_SYNC_LOCK_TIMEOUT", 30)
+# Time (seconds) UserSyncMiddleware does not re-sync a user after the user's sync failed, None to always re-sync
+WAUTH_SYNC_FAILURE_TIMEOUT: Optional[int] = getattr(settings, "WAUTH_SYNC_FAILURE_TIMEOUT", 30)
+# Cache backend for LDAP User entries, "local" for in-process memory, a CACHES alias, or None to disable
+WAUTH_ENTRY_CACHE: Optional[str] = getattr(settings, "WAUTH_ENTRY_CACHE", "local")
+# Time (seconds) to keep LDAP User entries in cache
+WAUTH_ENTRY_CACHE_TIMEOUT: int = getattr(settings, "WAUTH_ENTRY_CACHE_TIMEOUT", 300)
+# Maximum number of LDAP User entries kept in the "local" cache
+WAUTH_ENTRY_CACHE_SIZE: int = getattr(settings, "WAUTH_ENTRY_CACHE_SIZE", 1024)
+# Use the session for determining re-sync, avoiding DB and cache queries until re-sync is due
+WAUTH_USE_SESSION: bool = getattr(settings, "WAUTH_USE_SESSION", False)
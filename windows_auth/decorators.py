@@ -3,6 +3,7 @@ from django.utils import timezone
 
 from windows_auth.conf import WAUTH_USE_CACHE
 from windows_auth.models import LDAPUser
+from windows_auth.sync import sync_once
 
 
 def domain_required(function=None, domain=None, login_url=None, bypass_superuser=True):
@@ -51,11 +52,11 @@ def ldap_sync_required(function=None, timedelta=None, login_url=None, allow_non_
         if user.is_authenticated and LDAPUser.objects.filter(user=user).exists():
             try:
                 if WAUTH_USE_CACHE:
-                    user.ldap.sync()
+                    sync_once(user.ldap)
                 else:
                     # check via database query
                     if not timedelta or not user.ldap.last_sync or user.ldap.last_sync < timezone.now() - timedelta:
-                        user.ldap.sync()
+                        sync_once(user.ldap)
 
                 return True
             except Exception as e:
@@ -0,0 +1,265 @@
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional, Dict, Any, List, Iterable
+
+from django.core.cache import caches
+from ldap3 import Entry
+
+from windows_auth.conf import WAUTH_ENTRY_CACHE, WAUTH_ENTRY_CACHE_TIMEOUT, WAUTH_ENTRY_CACHE_SIZE
+
+
+def serialize_entry(entry: Entry, attributes: Iterable[str] = ()) -> Dict[str, Any]:
+    """
+    Compact representation of an ldap3 Entry, used for caching.
+    :param entry: ldap3 Entry
+    :param attributes: The attributes that were requested, remembering those without value in the entry
+    """
+    values = {
+        name: list(values)
+        for name, values in entry.entry_attributes_as_dict.items()
+    }
+    present = {name.lower() for name in values}
+    return {
+        "dn": entry.entry_dn,
+        "attributes": values,
+        "missing": [name for name in attributes if name.lower() not in present],
+    }
+
+
+class CachedAttribute:
+    """
+    Read-only attribute of a cached LDAP entry, mimicking the ldap3 Attribute interface.
+    """
+
+    def __init__(self, key: str, values: List[Any]):
+        self.key = key
+        self.values = values
+
+    @property
+    def value(self):
+        if not self.values:
+            return None
+        elif len(self.values) == 1:
+            return self.values[0]
+        else:
+            return self.values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __repr__(self):
+        return f"{self.key}: {self.value}"
+
+
+class CachedEntry:
+    """
+    Read-only LDAP entry loaded from the entry cache, mimicking the ldap3 Entry interface.
+    """
+
+    def __init__(self, data: Dict[str, Any]):
+        self._data = data
+        self._attributes = {name.lower(): name for name in data["attributes"]}
+
+    @property
+    def entry_dn(self) -> str:
+        return self._data["dn"]
+
+    @property
+    def entry_attributes(self) -> List[str]:
+        return list(self._data["attributes"].keys())
+
+    @property
+    def entry_attributes_as_dict(self) -> Dict[str, List[Any]]:
+        return dict(self._data["attributes"])
+
+    def __contains__(self, item: str) -> bool:
+        return item.lower() in self._attributes
+
+    def __getitem__(self, item: str) -> CachedAttribute:
+        if item not in self:
+            raise KeyError(item)
+        name = self._attributes[item.lower()]
+        return CachedAttribute(name, self._data["attributes"][name])
+
+    def __getattr__(self, item: str) -> CachedAttribute:
+        if item.startswith("_") or item not in self:
+            raise AttributeError(item)
+        return self[item]
+
+    def __repr__(self):
+        return f"DN: {self.entry_dn} - STATUS: Cached"
+
+
+class CachedReader:
+    """
+    Read-only list of cached LDAP entries, mimicking the searched ldap3 Reader interface.
+    """
+
+    def __init__(self, entries: List[CachedEntry]):
+        self.entries = entries
+
+    def match(self, attributes, value) -> List[CachedEntry]:
+        """
+        Return entries with text in one of the specified attributes
+        """
+        if isinstance(attributes, str):
+            attributes = [attributes]
+
+        return [
+            entry for entry in self.entries
+            if any(
+                str(value).lower() in str(attr_value).lower()
+                for attribute in attributes if attribute in entry
+                for attr_value in entry[attribute].values
+            )
+        ]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, item: int) -> CachedEntry:
+        return self.entries[item]
+
+
+def has_attributes(data: Dict[str, Any], attributes: Iterable[str]) -> bool:
+    """
+    Check whether a cached entry contains all the attributes.
+    """
+    cached = {name.lower() for name in (*data["attributes"], *data.get("missing", ()))}
+    return all(attribute.lower() in cached for attribute in attributes)
+
+
+class EntryCache:
+    """
+    Base cache for serialized LDAP entries, counting cache hits and misses.
+    """
+
+    def __init__(self, timeout: int):
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        data = self._get(key)
+        with self._stats_lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return data
+
+    def set(self, key: str, data: Dict[str, Any]) -> None:
+        raise NotImplementedError()
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError()
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+class LocalMemoryEntryCache(EntryCache):
+    """
+    In-process LRU cache, bounded by number of entries.
+    """
+
+    def __init__(self, timeout: int, max_size: int):
+        super().__init__(timeout)
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = Lock()
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+
+            expires, data = self._entries[key]
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return data
+
+    def set(self, key: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoEntryCache(EntryCache):
+    """
+    Cache shared between processes using a Django cache backend.
+    """
+
+    key_prefix = "wauth_entry_"
+
+    def __init__(self, timeout: int, alias: str):
+        super().__init__(timeout)
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, key: str) -> str:
+        # usernames may contain characters not supported by some cache backends
+        return self.key_prefix + hashlib.sha1(key.encode()).hexdigest()
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.cache.get(self.make_key(key))
+
+    def set(self, key: str, data: Dict[str, Any]) -> None:
+        self.cache.set(self.make_key(key), data, self.timeout)
+
+    def delete(self, key: str) -> None:
+        self.cache.delete(self.make_key(key))
+
+
+_entry_cache: Optional[EntryCache] = None
+_entry_cache_lock = Lock()
+
+
+def get_entry_cache() -> Optional[EntryCache]:
+    """
+    Get the process entry cache configured by WAUTH_ENTRY_CACHE setting.
+    :return: Entry cache, None when disabled
+    """
+    global _entry_cache
+    if WAUTH_ENTRY_CACHE is None:
+        return None
+
+    if _entry_cache is None:
+        with _entry_cache_lock:
+            if _entry_cache is None:
+                if WAUTH_ENTRY_CACHE == "local":
+                    _entry_cache = LocalMemoryEntryCache(WAUTH_ENTRY_CACHE_TIMEOUT, WAUTH_ENTRY_CACHE_SIZE)
+                else:
+                    _entry_cache = DjangoEntryCache(WAUTH_ENTRY_CACHE_TIMEOUT, WAUTH_ENTRY_CACHE)
+    return _entry_cache
@@ -0,0 +1,342 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from threading import Lock, Thread
+from typing import Dict, Any, Optional, Iterable, List, Set, FrozenSet
+
+from django.core.cache import cache
+from ldap3.utils.conv import escape_filter_chars
+
+from windows_auth import logger
+from windows_auth.ldap import LDAPManager
+from windows_auth.timing import Timer
+
+# version of the snapshot file format
+SNAPSHOT_VERSION = 1
+
+
+def _to_list(value) -> List[Any]:
+    if value is None:
+        return []
+    elif isinstance(value, (list, tuple)):
+        return list(value)
+    else:
+        return [value]
+
+
+def _to_generalized_time(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y%m%d%H%M%S.0Z")
+
+
+def compute_closure(parents: Dict[str, Set[str]]) -> Dict[str, FrozenSet[str]]:
+    """
+    Compute the transitive closure of nested group membership.
+    Cycles in group nesting are allowed.
+    :param parents: Mapping of group DN to the DNs of the groups it is a direct member of
+    :return: Mapping of group DN to the DNs of all groups it is a member of, including itself
+    """
+    closure = {}
+    for dn in parents:
+        ancestors = {dn}
+        stack = [dn]
+        while stack:
+            for parent in parents.get(stack.pop(), ()):
+                if parent not in ancestors:
+                    ancestors.add(parent)
+                    stack.append(parent)
+        closure[dn] = frozenset(ancestors)
+    return closure
+
+
+class _GraphState:
+    """
+    Immutable state of a loaded group graph, replaced as a whole on refresh.
+    """
+
+    def __init__(self, groups: Dict[str, Dict[str, Any]], parents: Dict[str, Set[str]],
+                 high_water_mark: Optional[datetime], loaded_at: float, refreshed_at: float):
+        self.groups = groups
+        self.parents = parents
+        self.closure = compute_closure(parents)
+        self.high_water_mark = high_water_mark
+        self.loaded_at = loaded_at
+        self.refreshed_at = refreshed_at
+
+
+class GroupGraph:
+    """
+    In-memory graph of the nested groups of a domain, for resolving user group membership locally
+    from the user's direct memberOf attribute.
+
+    The graph is loaded using a single paged search, and refreshed incrementally by searching groups
+    changed since the last refresh. Refreshed graphs can be saved to a snapshot file,
+    shared by all processes of the project.
+    """
+
+    # time subtracted from the last seen whenChanged, covering replication and clock differences
+    refresh_overlap = timedelta(minutes=5)
+    page_size = 1000
+
+    def __init__(self, manager: LDAPManager, refresh_interval: Optional[float] = None,
+                 reload_interval: Optional[float] = None, snapshot_path: Optional[str] = None):
+        self.manager = manager
+        self.refresh_interval = refresh_interval
+        self.reload_interval = reload_interval
+        self.snapshot_path = snapshot_path
+        self.attributes = _to_list(manager.settings.GROUP_ATTRS)
+        self._state: Optional[_GraphState] = None
+        self._lock = Lock()
+        self._refresh_thread: Optional[Thread] = None
+
+    def has_attributes(self, attributes: Iterable[str]) -> bool:
+        """
+        Check whether the graph holds all the group attributes.
+        """
+        loaded = {name.lower() for name in self.attributes}
+        return all(name.lower() in loaded for name in _to_list(attributes))
+
+    def get_groups(self, member_of: Iterable[str]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Get all groups of a user, directly or in-directly.
+        :param member_of: DNs of the groups the user is a direct member of
+        :return: List of serialized group entries, None when a group is missing from the graph
+        """
+        state = self.get_state()
+        groups = set()
+        for dn in member_of:
+            ancestors = state.closure.get(dn.lower())
+            if ancestors is None:
+                # group was created after the last refresh, or is outside of the search base
+                logger.debug(f"Group {dn} is missing from the group graph of domain {self.manager.domain}")
+                return None
+            groups.update(ancestors)
+
+        return [state.groups[dn] for dn in sorted(groups) if dn in state.groups]
+
+    def get_state(self) -> _GraphState:
+        """
+        Get the loaded graph, loading it when needed.
+        Only the first load blocks, refreshes run in a single background thread while the current graph is used.
+        """
+        if self._state is None:
+            with self._lock:
+                if self._state is None:
+                    self._state = self._read_snapshot(max_age=self.reload_interval)
+                    if self._state is None:
+                        self._state = self.load()
+                        # share the loaded graph, a graph read from the snapshot is already shared
+                        self._write_snapshot()
+
+        if self._is_due(self._state.refreshed_at, self.refresh_interval) and self._lock.acquire(blocking=False):
+            try:
+                self._refresh_thread = Thread(target=self._refresh_in_background, daemon=True,
+                                              name=f"wauth-group-graph-{self.manager.domain}")
+                self._refresh_thread.start()
+            except Exception:
+                self._lock.release()
+                raise
+
+        return self._state
+
+    def _refresh_in_background(self) -> None:
+        # the lock was acquired by the thread starting the refresh
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception(f"Failed to refresh group graph of domain {self.manager.domain}")
+        finally:
+            self._lock.release()
+
+    def refresh(self) -> None:
+        """
+        Refresh the graph using a newer snapshot saved by another process, or by searching changed groups.
+        A full reload is performed every reload interval, removing deleted groups from the graph.
+        """
+        snapshot = self._read_snapshot()
+        if snapshot is not None and snapshot.refreshed_at > self._state.refreshed_at:
+            self._state = snapshot
+            if not self._is_due(snapshot.refreshed_at, self.refresh_interval):
+                return
+
+        # when sharing a snapshot, only one process refreshes the graph
+        lease_key = f"wauth_group_graph_{self.manager.domain}"
+        if self.snapshot_path and not cache.add(lease_key, os.getpid(), self.refresh_interval or 60):
+            return
+
+        try:
+            if self._is_due(self._state.loaded_at, self.reload_interval):
+                self._state = self.load()
+            else:
+                self._state = self.update(self._state)
+            self._write_snapshot()
+        finally:
+            if self.snapshot_path:
+                cache.delete(lease_key)
+
+    def load(self) -> _GraphState:
+        """
+        Load all groups of the domain using a paged search.
+        """
+        groups, parents = {}, {}
+        with Timer("load_group_graph", self.manager.domain, "Load group graph of domain %s", self.manager.domain):
+            high_water_mark = self._search("(objectClass=group)", groups, parents)
+
+        now = time.time()
+        logger.info(f"Loaded group graph of domain {self.manager.domain} with {len(groups)} groups")
+        return _GraphState(groups, parents, high_water_mark, loaded_at=now, refreshed_at=now)
+
+    def update(self, state: _GraphState) -> _GraphState:
+        """
+        Update the graph with groups changed since the last refresh.
+        Membership changes modify the parent group, so the members of each changed group are searched again.
+        """
+        groups, parents = dict(state.groups), {dn: set(value) for dn, value in state.parents.items()}
+        high_water_mark = state.high_water_mark
+
+        with Timer("update_group_graph", self.manager.domain, "Update group graph of domain %s", self.manager.domain):
+            changed = {}
+            query = "(objectClass=group)"
+            if high_water_mark is not None:
+                query = f"(&{query}(whenChanged>={_to_generalized_time(high_water_mark - self.refresh_overlap)}))"
+            high_water_mark = self._search(query, changed, parents, high_water_mark)
+            groups.update(changed)
+
+            if changed:
+                children = {}
+                for dn, group_parents in parents.items():
+                    for parent in group_parents:
+                        children.setdefault(parent, set()).add(dn)
+
+                for dn, group in changed.items():
+                    members = {}
+                    query = f"(&(objectClass=group)(memberOf={escape_filter_chars(group['dn'])}))"
+                    high_water_mark = self._search(query, members, parents, high_water_mark)
+                    groups.update(members)
+                    # groups removed from the changed group
+                    for child in children.get(dn, set()) - members.keys():
+                        parents[child].discard(dn)
+
+        logger.debug(f"Updated {len(changed)} changed groups in group graph of domain {self.manager.domain}")
+        return _GraphState(groups, parents, high_water_mark, loaded_at=state.loaded_at, refreshed_at=time.time())
+
+    def _search(self, query: str, groups: Dict[str, Dict[str, Any]], parents: Dict[str, Set[str]],
+                high_water_mark: Optional[datetime] = None) -> Optional[datetime]:
+        # search groups into the mappings, returning the latest whenChanged seen
+        with self.manager.get_connection() as connection:
+            results = connection.extend.standard.paged_search(
+                self.manager.settings.SEARCH_BASE,
+                query,
+                attributes=[*self.attributes, "memberOf", "whenChanged"],
+                paged_size=self.page_size,
+                generator=True,
+            )
+            for result in results:
+                if result.get("type") != "searchResEntry":
+                    continue
+
+                attributes = result["attributes"]
+                dn = result["dn"].lower()
+                groups[dn] = {
+                    "dn": result["dn"],
+                    "attributes": {
+                        name: _to_list(attributes[name])
+                        for name in self.attributes if name in attributes
+                    },
+                }
+                parents[dn] = {parent.lower() for parent in _to_list(attributes.get("memberOf"))}
+
+                when_changed = attributes.get("whenChanged")
+                if isinstance(when_changed, datetime) and (high_water_mark is None or when_changed > high_water_mark):
+                    high_water_mark = when_changed
+
+        return high_water_mark
+
+    @staticmethod
+    def _is_due(since: float, interval: Optional[float]) -> bool:
+        return interval is not None and time.time() - since > interval
+
+    def _read_snapshot(self, max_age: Optional[float] = None) -> Optional[_GraphState]:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+
+        try:
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read group graph snapshot {self.snapshot_path}: {e}")
+            return None
+
+        if data.get("version") != SNAPSHOT_VERSION or data.get("domain") != self.manager.domain \
+                or not self.has_attributes(data.get("attributes", ())):
+            return None
+        if max_age is not None and time.time() - data["loaded_at"] > max_age:
+            return None
+
+        high_water_mark = data.get("high_water_mark")
+        return _GraphState(
+            groups=data["groups"],
+            parents={dn: set(value) for dn, value in data["parents"].items()},
+            high_water_mark=datetime.fromisoformat(high_water_mark) if high_water_mark else None,
+            loaded_at=data["loaded_at"],
+            refreshed_at=data["refreshed_at"],
+        )
+
+    def _write_snapshot(self) -> None:
+        if not self.snapshot_path:
+            return
+
+        state = self._state
+        data = {
+            "version": SNAPSHOT_VERSION,
+            "domain": self.manager.domain,
+            "attributes": self.attributes,
+            "high_water_mark": state.high_water_mark.isoformat() if state.high_water_mark else None,
+            "loaded_at": state.loaded_at,
+            "refreshed_at": state.refreshed_at,
+            "groups": state.groups,
+            "parents": {dn: sorted(value) for dn, value in state.parents.items()},
+        }
+
+        # replace the snapshot atomically, other processes may be reading it
+        temp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, default=str)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError as e:
+            logger.warning(f"Failed to write group graph snapshot {self.snapshot_path}: {e}")
+
+
+_group_graphs: Dict[str, GroupGraph] = {}
+_group_graphs_lock = Lock()
+
+
+def get_group_graph(manager: LDAPManager) -> GroupGraph:
+    """
+    Get or create the group graph of a domain.
+    :param manager: LDAP Manager of the domain
+    """
+    with _group_graphs_lock:
+        graph = _group_graphs.get(manager.domain)
+        if graph is None or graph.manager is not manager:
+            graph = _group_graphs[manager.domain] = GroupGraph(
+                manager,
+                refresh_interval=manager.settings.GROUP_GRAPH_REFRESH_INTERVAL,
+                reload_interval=manager.settings.GROUP_GRAPH_RELOAD_INTERVAL,
+                snapshot_path=manager.settings.GROUP_GRAPH_SNAPSHOT,
+            )
+        return graph
+
+
+def _reset_locks_after_fork():
+    # refresh threads are not running in the child process, the locks they held are never released
+    global _group_graphs_lock
+    _group_graphs_lock = Lock()
+    for graph in _group_graphs.values():
+        graph._lock = Lock()
+        graph._refresh_thread = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
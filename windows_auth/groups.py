@@ -0,0 +1,126 @@
+import time
+from threading import Lock
+from typing import Dict, Any, Optional, Iterable, List
+
+from ldap3.protocol.formatters.formatters import format_sid
+from ldap3.utils.conv import escape_filter_chars
+
+from windows_auth import logger
+from windows_auth.entry_cache import serialize_entry
+from windows_auth.ldap import LDAPManager
+from windows_auth.timing import Timer
+
+# group strategies for resolving users group membership
+GROUP_STRATEGY_IN_CHAIN = "in_chain"
+GROUP_STRATEGY_TOKEN_GROUPS = "token_groups"
+GROUP_STRATEGY_GRAPH = "graph"
+
+
+def to_sid(value) -> str:
+    """
+    Format a SID attribute value, tokenGroups values are returned as raw bytes.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return format_sid(value)
+    return str(value)
+
+
+class GroupSIDTable:
+    """
+    Cached table of LDAP Groups by their SID, for resolving tokenGroups of users.
+    Groups are searched only for SIDs missing from the table, and the table is cleared after a timeout.
+    """
+
+    # maximum SIDs searched in a single filter
+    chunk_size = 100
+
+    def __init__(self, manager: LDAPManager, timeout: Optional[float] = None):
+        self.manager = manager
+        self.timeout = timeout
+        self._groups: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._attributes: Dict[str, str] = {}
+        self._loaded_at = time.monotonic()
+        self._lock = Lock()
+
+    def resolve(self, sids: Iterable[str], attributes: Iterable[str]) -> List[Dict[str, Any]]:
+        """
+        Get the serialized LDAP Groups of SIDs.
+        :param sids: Group SIDs
+        :param attributes: LDAP Group attributes to get
+        :return: List of serialized group entries, SIDs that are not groups in the domain are omitted
+        """
+        sids = list(sids)
+        with self._lock:
+            self._expire(attributes)
+            missing = [sid for sid in sids if sid not in self._groups]
+            search_attributes = list(self._attributes.values())
+
+        if missing:
+            groups = self._search(missing, search_attributes)
+            with self._lock:
+                self._groups.update(groups)
+        else:
+            groups = {}
+
+        with self._lock:
+            return [
+                group
+                for group in (self._groups.get(sid, groups.get(sid)) for sid in sids)
+                if group is not None
+            ]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._groups.clear()
+            self._loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._groups)
+
+    def _expire(self, attributes: Iterable[str]) -> None:
+        # clear the table when expired, or when attributes missing from cached groups are requested
+        new_attributes = {
+            name.lower(): name
+            for name in ("objectSid", *attributes)
+            if name.lower() not in self._attributes
+        }
+        if new_attributes or (self.timeout is not None and time.monotonic() - self._loaded_at > self.timeout):
+            self._attributes.update(new_attributes)
+            self._groups.clear()
+            self._loaded_at = time.monotonic()
+
+    def _search(self, sids: List[str], attributes: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        groups: Dict[str, Optional[Dict[str, Any]]] = dict.fromkeys(sids)
+        with self.manager.get_connection() as connection:
+            for i in range(0, len(sids), self.chunk_size):
+                chunk = sids[i:i + self.chunk_size]
+                query = "".join(f"(objectSid={escape_filter_chars(sid)})" for sid in chunk)
+                with Timer("search_groups_by_sid", self.manager.domain, "Query %d LDAP Groups by SID for domain %s",
+                           len(chunk), self.manager.domain):
+                    connection.search(
+                        self.manager.settings.SEARCH_BASE,
+                        f"(&(objectClass=group)(|{query}))",
+                        attributes=attributes,
+                    )
+                for entry in connection.entries:
+                    groups[to_sid(entry["objectSid"].value)] = serialize_entry(entry, attributes)
+
+        logger.debug(f"Resolved {sum(group is not None for group in groups.values())} of {len(sids)} "
+                     f"group SIDs for domain {self.manager.domain}")
+        return groups
+
+
+_group_tables: Dict[str, GroupSIDTable] = {}
+_group_tables_lock = Lock()
+
+
+def get_group_table(manager: LDAPManager) -> GroupSIDTable:
+    """
+    Get or create the group SID table of a domain.
+    :param manager: LDAP Manager of the domain
+    """
+    with _group_tables_lock:
+        table = _group_tables.get(manager.domain)
+        if table is None or table.manager is not manager:
+            table = _group_tables[manager.domain] = GroupSIDTable(manager, manager.settings.GROUP_TABLE_TIMEOUT)
+        return table
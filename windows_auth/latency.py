@@ -0,0 +1,333 @@
+import os
+import socket
+import time
+from bisect import bisect_left
+from threading import Event, Lock, Thread
+from typing import Dict, Tuple, Optional, List, Any, Sequence
+from uuid import uuid4
+
+from django.core.cache import cache
+
+from windows_auth import logger
+from windows_auth.conf import WAUTH_LATENCY_PUBLISH_INTERVAL
+from windows_auth.timing import Timing, subscribe
+
+# timer names of the measured LDAP operations
+OP_BIND = "bind"
+OP_SEARCH_USER = "search_user"
+OP_SEARCH_GROUPS = "search_groups"
+LATENCY_OPERATIONS = frozenset((OP_BIND, OP_SEARCH_USER, OP_SEARCH_GROUPS))
+
+# upper bounds (seconds) of the histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LATENCY_QUANTILES = (0.5, 0.95, 0.99)
+
+PROCESSES_CACHE_KEY = "wauth_latency_processes"
+# histograms of terminated processes, folded together so the aggregated counters never decrease
+RETIRED_CACHE_KEY = "wauth_latency_retired"
+# lock of the processes registry and the retired histograms, held while modifying them
+REGISTRY_LOCK_CACHE_KEY = "wauth_latency_lock"
+REGISTRY_LOCK_TIMEOUT = 10
+# time (seconds) terminated processes are remembered, so a process that was only delayed is not counted twice
+RETIRED_PROCESS_TIMEOUT = 86400
+
+Snapshot = List[Tuple[str, str, Dict[str, Any]]]
+
+
+def _new_process_key() -> str:
+    # unique across hosts, reused PIDs and processes that continue after being retired
+    return f"wauth_latency_{socket.gethostname()}_{os.getpid()}_{uuid4().hex[:8]}"
+
+
+class LatencyHistogram:
+    """
+    Cumulative latency histogram of an LDAP operation, using fixed buckets.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.errors = 0
+        self._lock = Lock()
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += seconds
+            if error:
+                self.errors += 1
+
+    def merge(self, data: Dict[str, Any]) -> None:
+        """
+        Add the observations of a serialized histogram with the same buckets.
+        """
+        with self._lock:
+            self.counts = [count + other for count, other in zip(self.counts, data["counts"])]
+            self.sum += data["sum"]
+            self.errors += data["errors"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"counts": list(self.counts), "sum": self.sum, "errors": self.errors}
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a quantile, interpolating linearly inside the bucket it falls in.
+        :param q: Quantile between 0 and 1
+        :return: Estimated latency (seconds), None when there are no observations
+        """
+        counts = list(self.counts)
+        total = sum(counts)
+        if not total:
+            return None
+
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if count and cumulative + count >= rank:
+                if index == len(self.buckets):
+                    # unbounded bucket, the highest bound is the best estimate
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+
+def merge_snapshots(snapshots: Sequence[Snapshot]) -> Dict[Tuple[str, str], LatencyHistogram]:
+    """
+    Aggregate serialized histograms by domain and operation.
+    """
+    histograms = {}
+    for snapshot in snapshots:
+        for domain, operation, data in snapshot:
+            histograms.setdefault((domain, operation), LatencyHistogram()).merge(data)
+    return histograms
+
+
+class LatencyRegistry:
+    """
+    In-process latency histograms by domain and operation.
+
+    Each process publishes its histograms to the Django cache every publish interval,
+    so the histograms of all the project's processes can be aggregated by any of them.
+    The histograms of terminated processes are folded into the retired histograms, keeping the counters monotonic.
+    """
+
+    def __init__(self, publish_interval: Optional[float] = None):
+        self.publish_interval = publish_interval
+        self.process_key = _new_process_key()
+        self._histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+
+    def get_histogram(self, domain: str, operation: str) -> LatencyHistogram:
+        key = (domain, operation)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def observe(self, domain: str, operation: str, seconds: float, error: bool = False) -> None:
+        self.get_histogram(domain, operation).observe(seconds, error)
+
+    def on_timing(self, timing: Timing) -> None:
+        """
+        Timing subscriber, observing the timers of LDAP operations.
+        """
+        if timing.name in LATENCY_OPERATIONS and timing.domain is not None:
+            self.observe(timing.domain, timing.name, timing.seconds, timing.error)
+
+    def snapshot(self) -> Snapshot:
+        with self._lock:
+            histograms = list(self._histograms.items())
+        return [(domain, operation, histogram.to_dict()) for (domain, operation), histogram in histograms]
+
+    @property
+    def process_timeout(self) -> float:
+        # processes that did not publish for a few intervals are considered terminated
+        return max((self.publish_interval or 0) * 3, 60)
+
+    def publish(self) -> None:
+        """
+        Save the process histograms to the cache, and register the process for aggregation.
+        """
+        if not self._histograms:
+            return
+
+        processes = cache.get(PROCESSES_CACHE_KEY) or {}
+        if time.time() - processes.get(self.process_key, 0) > self.process_timeout / 3:
+            self._register()
+
+        # kept until folded into the retired histograms by another process
+        cache.set(self.process_key, self.snapshot(), None)
+
+    def _register(self) -> None:
+        """
+        Register the process, retiring processes that did not publish within the process timeout.
+        """
+        if not cache.add(REGISTRY_LOCK_CACHE_KEY, self.process_key, REGISTRY_LOCK_TIMEOUT):
+            # registered by a later publish
+            return
+
+        try:
+            now = time.time()
+            processes = cache.get(PROCESSES_CACHE_KEY) or {}
+            retired = cache.get(RETIRED_CACHE_KEY) or {"histograms": [], "processes": {}}
+            if self.process_key in retired["processes"]:
+                # considered terminated while delayed, its published histograms were folded already
+                logger.warning(f"LDAP latency metrics of process {self.process_key} were retired, "
+                               f"continuing as a new process")
+                with self._lock:
+                    self.process_key = _new_process_key()
+                    self._histograms = {}
+
+            expired = [key for key, seen in processes.items() if now - seen >= self.process_timeout]
+            if expired:
+                histograms = merge_snapshots([retired["histograms"], *cache.get_many(expired).values()])
+                retired = {
+                    "histograms": [(domain, operation, histogram.to_dict())
+                                   for (domain, operation), histogram in histograms.items()],
+                    "processes": {
+                        **{key: seen for key, seen in retired["processes"].items()
+                           if now - seen < RETIRED_PROCESS_TIMEOUT},
+                        **dict.fromkeys(expired, now),
+                    },
+                }
+                cache.set(RETIRED_CACHE_KEY, retired, None)
+
+            processes = {key: seen for key, seen in processes.items() if key not in expired}
+            processes[self.process_key] = now
+            cache.set(PROCESSES_CACHE_KEY, processes, None)
+            cache.delete_many(expired)
+        finally:
+            if cache.get(REGISTRY_LOCK_CACHE_KEY) == self.process_key:
+                cache.delete(REGISTRY_LOCK_CACHE_KEY)
+
+    def start(self) -> None:
+        """
+        Start publishing every interval, unless already started or the interval is not configured.
+        """
+        if not self.publish_interval or (self._thread is not None and self._thread.is_alive()):
+            return
+
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name="wauth-latency", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.publish_interval):
+            try:
+                self.publish()
+            except Exception as e:
+                logger.exception(f"Publishing LDAP latency metrics failed: {e}")
+
+    def _after_fork(self):
+        # observations of the parent process are published by the parent
+        self.process_key = _new_process_key()
+        self._histograms = {}
+        self._lock = Lock()
+        self._thread = None
+        self.start()
+
+
+_latency_registry: Optional[LatencyRegistry] = None
+_latency_registry_lock = Lock()
+
+
+def get_latency_registry() -> LatencyRegistry:
+    """
+    Get or create the process latency registry, published every WAUTH_LATENCY_PUBLISH_INTERVAL seconds.
+    The registry observes the LDAP operation timers from its creation.
+    """
+    global _latency_registry
+    if _latency_registry is None:
+        with _latency_registry_lock:
+            if _latency_registry is None:
+                _latency_registry = LatencyRegistry(publish_interval=WAUTH_LATENCY_PUBLISH_INTERVAL)
+                subscribe(_latency_registry.on_timing)
+                if hasattr(os, "register_at_fork"):
+                    os.register_at_fork(after_in_child=_latency_registry._after_fork)
+    return _latency_registry
+
+
+def collect_latency() -> Dict[Tuple[str, str], LatencyHistogram]:
+    """
+    Aggregate the latency histograms of all processes published to the cache, and of the current process.
+    :return: Mapping of (domain, operation) to the aggregated histogram
+    """
+    registry = get_latency_registry()
+    processes = set(cache.get(PROCESSES_CACHE_KEY) or {})
+    processes.discard(registry.process_key)
+    published = cache.get_many([*processes, RETIRED_CACHE_KEY])
+    retired = published.pop(RETIRED_CACHE_KEY, None) or {"histograms": [], "processes": {}}
+
+    # skip processes retired after the registry was read, their histograms are in the retired histograms
+    snapshots = [snapshot for key, snapshot in published.items() if key not in retired["processes"]]
+    snapshots.append(retired["histograms"])
+    if registry.process_key not in retired["processes"]:
+        snapshots.append(registry.snapshot())
+    return merge_snapshots(snapshots)
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_float(value: float) -> str:
+    return repr(float(value))
+
+
+def render_latency(histograms: Dict[Tuple[str, str], LatencyHistogram]) -> str:
+    """
+    Render latency histograms in the Prometheus text exposition format.
+    """
+    items = sorted(histograms.items())
+    lines = [
+        "# HELP wauth_ldap_operation_duration_seconds Latency of LDAP operations.",
+        "# TYPE wauth_ldap_operation_duration_seconds histogram",
+    ]
+    for (domain, operation), histogram in items:
+        labels = f"domain=\"{_escape_label(domain)}\",operation=\"{_escape_label(operation)}\""
+        cumulative = 0
+        for bound, count in zip((*histogram.buckets, None), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound is None else _format_float(bound)
+            lines.append(f"wauth_ldap_operation_duration_seconds_bucket{{{labels},le=\"{le}\"}} {cumulative}")
+        lines.append(f"wauth_ldap_operation_duration_seconds_sum{{{labels}}} {_format_float(histogram.sum)}")
+        lines.append(f"wauth_ldap_operation_duration_seconds_count{{{labels}}} {cumulative}")
+
+    lines += [
+        "# HELP wauth_ldap_operation_errors_total LDAP operations failed with an exception.",
+        "# TYPE wauth_ldap_operation_errors_total counter",
+    ]
+    for (domain, operation), histogram in items:
+        labels = f"domain=\"{_escape_label(domain)}\",operation=\"{_escape_label(operation)}\""
+        lines.append(f"wauth_ldap_operation_errors_total{{{labels}}} {histogram.errors}")
+
+    lines += [
+        "# HELP wauth_ldap_operation_duration_quantile_seconds Latency quantiles of LDAP operations, "
+        "estimated from the histogram.",
+        "# TYPE wauth_ldap_operation_duration_quantile_seconds gauge",
+    ]
+    for (domain, operation), histogram in items:
+        labels = f"domain=\"{_escape_label(domain)}\",operation=\"{_escape_label(operation)}\""
+        for q in LATENCY_QUANTILES:
+            value = histogram.quantile(q)
+            if value is not None:
+                lines.append(f"wauth_ldap_operation_duration_quantile_seconds{{{labels},quantile=\"{q}\"}} "
+                             f"{_format_float(value)}")
+
+    return "\n".join(lines) + "\n"
@@ -1,11 +1,233 @@
-from typing import List, Union, Iterable, Optional, Dict
+import asyncio
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import partial
+from copy import copy
+from threading import Condition, Lock, RLock, Thread, current_thread, local
+from typing import List, Union, Iterable, Optional, Dict, Iterator, Callable, Any
 
-from ldap3 import Connection, Server, Reader, ObjectDef, AttrDef
+from django.utils.module_loading import import_string
+from ldap3 import Connection, Server, Reader, ObjectDef, AttrDef, BASE, NONE, SCHEMA, ALL
+from ldap3.core.exceptions import LDAPException, LDAPCommunicationError
 from ldap3.core.usage import ConnectionUsage
 
 from windows_auth import logger
+from windows_auth.circuit import CircuitBreaker, get_circuit_breaker
+from windows_auth.latency import OP_BIND
+from windows_auth.ratelimit import SyncRateLimiter, get_sync_limiter
+from windows_auth.schema_cache import CachedSchema, get_schema_cache_path, load_schema_cache, save_schema_cache, \
+    read_schema_version
 from windows_auth.settings import LDAPSettings
-from windows_auth.utils import LogExecutionTime
+from windows_auth.signals import ldap_connection_created
+from windows_auth.timing import Timer
+
+
+# thread that submitted the executor work running in the current thread
+_origin = local()
+
+
+def get_origin_thread() -> Thread:
+    """
+    Get the thread the current work is done for.
+    Work submitted to an LDAP Manager's executor is attributed to the submitting thread.
+    """
+    return getattr(_origin, "thread", None) or current_thread()
+
+
+def _run_for(origin: Thread, func: Callable, *args, **kwargs) -> Any:
+    _origin.thread = origin
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _origin.thread = None
+
+
+class LDAPPoolTimeoutError(LDAPException):
+    """
+    No LDAP connection became available in the pool before the checkout timeout.
+    """
+
+
+class LDAPConnectionPool:
+    """
+    Bounded pool of bound LDAP connections for a single domain.
+
+    Connections are checked out exclusively by a single thread at a time, so concurrent requests never share
+    a connection. Idle connections are health checked on checkout and replaced when found stale.
+    """
+
+    def __init__(self, manager: "LDAPManager", min_size: int = 1, max_size: int = 10,
+                 timeout: Optional[float] = None, health_check_interval: Optional[float] = None):
+        """
+        :param manager: The LDAP Manager used to create new connections
+        :param min_size: Number of connections to bind when the pool is created
+        :param max_size: Maximum number of connections the pool may hold at once
+        :param timeout: Default time (seconds) to wait for a connection on checkout, None to wait forever
+        :param health_check_interval: Idle time (seconds) after which a connection is probed on checkout
+        """
+        self.manager = manager
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self._condition = Condition(Lock())
+        self._idle = deque()
+        self._connections: List[Connection] = []
+        self._last_used: Dict[int, float] = {}
+        self._pending = 0
+
+        for _ in range(min(self.min_size, self.max_size)):
+            connection = self.manager._create_connection()
+            self._connections.append(connection)
+            self._idle.append(connection)
+            self._last_used[id(connection)] = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        """
+        Number of connections currently held by the pool, both idle and checked out.
+        """
+        return len(self._connections) + self._pending
+
+    @property
+    def connections(self) -> List[Connection]:
+        return list(self._connections)
+
+    def acquire(self, timeout: Optional[float] = None) -> Connection:
+        """
+        Check out a bound connection from the pool, creating a new one when the pool is not full.
+        :param timeout: Time (seconds) to wait for a connection, defaults to the pool timeout
+        :return: ldap3 Connection, must be returned using release()
+        """
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        with self._condition:
+            while True:
+                if self._idle:
+                    connection = self._idle.pop()
+                    break
+                elif self.size < self.max_size:
+                    # reserve a slot and create the connection outside the lock
+                    self._pending += 1
+                    connection = None
+                    break
+
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    raise LDAPPoolTimeoutError(f"Timed out waiting for an LDAP connection to domain "
+                                               f"{self.manager.domain} (pool size {self.max_size})")
+                self._condition.wait(remaining)
+
+        if connection is None:
+            return self._create()
+        else:
+            return self._check(connection)
+
+    def release(self, connection: Connection) -> None:
+        """
+        Return a checked out connection to the pool.
+        :param connection: Connection received from acquire()
+        """
+        with self._condition:
+            pooled = connection in self._connections
+            if pooled:
+                self._last_used[id(connection)] = time.monotonic()
+                self._idle.append(connection)
+                self._condition.notify()
+
+        # connection was checked out while the pool closed
+        if not pooled and connection.bound:
+            connection.unbind()
+
+    def discard(self, connection: Connection) -> None:
+        """
+        Remove a broken connection from the pool, freeing its slot for a new connection.
+        :param connection: Connection received from acquire()
+        """
+        with self._condition:
+            self._remove(connection)
+            self._condition.notify()
+
+        self._unbind_quietly(connection)
+
+    def close(self) -> None:
+        """
+        Unbind all connections held by the pool.
+        """
+        with self._condition:
+            connections, self._connections = self._connections, []
+            self._idle.clear()
+            self._last_used.clear()
+            self._condition.notify_all()
+
+        for connection in connections:
+            if connection.bound:
+                connection.unbind()
+
+    def _create(self) -> Connection:
+        try:
+            with Timer("pool_connect", self.manager.domain, "Binding pooled LDAP connection for domain %s",
+                       self.manager.domain):
+                connection = self.manager._create_connection()
+        except Exception:
+            with self._condition:
+                self._pending -= 1
+                self._condition.notify()
+            raise
+
+        with self._condition:
+            self._pending -= 1
+            self._connections.append(connection)
+        return connection
+
+    def _check(self, connection: Connection) -> Connection:
+        """
+        Health check an idle connection, rebinding or replacing it when stale.
+        """
+        try:
+            if connection.closed or not connection.bound:
+                with Timer(OP_BIND, self.manager.domain, "Rebinding pooled connection for domain %s",
+                           self.manager.domain):
+                    connection.rebind()
+            elif self._is_idle_expired(connection) and not self._probe(connection):
+                raise LDAPCommunicationError("Connection failed health check")
+            return connection
+        except LDAPException as e:
+            logger.info(f"Replacing stale LDAP connection for domain {self.manager.domain}: {e}")
+            # keep the slot reserved while replacing the connection
+            with self._condition:
+                self._remove(connection)
+                self._pending += 1
+            self._unbind_quietly(connection)
+            return self._create()
+
+    def _remove(self, connection: Connection) -> None:
+        if connection in self._connections:
+            self._connections.remove(connection)
+        self._last_used.pop(id(connection), None)
+
+    @staticmethod
+    def _unbind_quietly(connection: Connection) -> None:
+        try:
+            connection.unbind()
+        except LDAPException:
+            pass
+
+    def _is_idle_expired(self, connection: Connection) -> bool:
+        if self.health_check_interval is None:
+            return False
+        last_used = self._last_used.get(id(connection), 0)
+        return time.monotonic() - last_used > self.health_check_interval
+
+    @staticmethod
+    def _probe(connection: Connection) -> bool:
+        # cheap read of the Root DSE
+        return connection.search("", "(objectClass=*)", search_scope=BASE, attributes=["1.1"])
 
 
 class LDAPManager:
@@ -13,14 +235,29 @@ class LDAPManager:
     def __init__(self, domain: str, settings: Optional[LDAPSettings] = None):
         self.domain = domain
         self.settings = settings if settings else LDAPSettings.for_domain(domain)
-        # create server
-        self.server = self._create_server()
+        # process owning the connections, see _check_process()
+        self._pid = os.getpid()
+        # fail fast while the domain's server is unavailable
+        self.circuit: CircuitBreaker = get_circuit_breaker(domain, self.settings.CIRCUIT_FAILURE_THRESHOLD,
+                                                           self.settings.CIRCUIT_OPEN_INTERVAL)
+        # limit the rate and concurrency of user syncs against the domain's server
+        self.sync_limiter: SyncRateLimiter = get_sync_limiter(domain, self.settings.SYNC_RATE,
+                                                              self.settings.SYNC_BURST,
+                                                              self.settings.SYNC_MAX_CONCURRENT,
+                                                              self.settings.SYNC_LIMIT_SHARED)
+        # create server, using the cached schema when available
+        cached_schema = self._load_schema_cache()
+        self.server = self._create_server(cached_schema)
         # bind connection
-        with LogExecutionTime(f"Binding LDAP connection for domain {self.domain}"):
+        with self.circuit.call(), \
+                Timer("connect", self.domain, "Binding LDAP connection for domain %s", self.domain):
             self._conn = self._create_connection()
         logger.info(f"LDAP Connection Info: {self.connection}")
+        # server info and schema are read by the first connection only
+        self._disable_server_info()
 
         self.definitions: Dict[str, ObjectDef] = {}
+        self._definitions_lock = RLock()
 
         # preload definitions
         if self.settings.PRELOAD_DEFINITIONS:
@@ -31,41 +268,278 @@ class LDAPManager:
                     object_class, attributes = definition
                     self.get_definition(object_class, attributes=attributes)
 
+        # create connection pool
+        self.pool = self._create_pool()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = Lock()
+
+        # save schema to cache, or refresh it in background when stale
+        if cached_schema is None:
+            self._save_schema_cache()
+        elif cached_schema.is_stale(self.settings.SCHEMA_CACHE_TIMEOUT):
+            Thread(target=self.refresh_schema_cache, name=f"wauth-schema-{self.domain}", daemon=True).start()
+
         # save manager to process context
         _ldap_connections[domain] = self
 
-    def _create_server(self) -> Server:
-        return Server(
+    def _create_server(self, cached_schema: Optional[CachedSchema] = None) -> Server:
+        if cached_schema is None:
+            return Server(
+                host=self.settings.SERVER,
+                use_ssl=self.settings.USE_SSL,
+                **self.settings.SERVER_OPTIONS
+            )
+
+        server = Server(
             host=self.settings.SERVER,
             use_ssl=self.settings.USE_SSL,
-            **self.settings.SERVER_OPTIONS
+            **{**self.settings.SERVER_OPTIONS, "get_info": NONE}
         )
+        server.attach_dsa_info(cached_schema.info)
+        server.attach_schema_info(cached_schema.schema)
+        return server
+
+    def _create_connection(self, server: Optional[Server] = None) -> Connection:
+        with Timer(OP_BIND, self.domain):
+            if self.settings.CONNECTION_FACTORY:
+                connection = import_string(self.settings.CONNECTION_FACTORY)(self, server or self.server)
+            else:
+                connection = Connection(
+                    server or self.server,
+                    user=self.settings.USERNAME,
+                    password=self.settings.PASSWORD,
+                    auto_bind=True,
+                    read_only=self.settings.READ_ONLY,
+                    collect_usage=self.settings.COLLECT_METRICS,
+                    **self.settings.CONNECTION_OPTIONS,
+                )
+
+        ldap_connection_created.send(sender=self.__class__, domain=self.domain, connection=connection)
+        return connection
+
+    def _disable_server_info(self) -> None:
+        # ldap3 reads the server info and schema on every bind, when already loaded it is kept for new connections
+        if self.server.schema is not None or self.server.info is not None:
+            self.server.get_info = NONE
+
+    @property
+    def schema_cache_path(self) -> Optional[str]:
+        """
+        Path of the schema cache file, None when schema cache is not used.
+        Schema is cached only when read from the server (get_info server option is SCHEMA or ALL).
+        """
+        get_info = self.settings.SERVER_OPTIONS.get("get_info", SCHEMA)
+        if not self.settings.SCHEMA_CACHE_DIR or get_info not in (SCHEMA, ALL):
+            return None
+        return get_schema_cache_path(self.settings.SCHEMA_CACHE_DIR, self.domain)
+
+    def _load_schema_cache(self) -> Optional[CachedSchema]:
+        if not self.schema_cache_path:
+            return None
+
+        cached_schema = load_schema_cache(self.schema_cache_path, self.settings.SERVER)
+        if cached_schema is not None:
+            logger.debug(f"Loaded LDAP schema for domain {self.domain} from cache {self.schema_cache_path}")
+        return cached_schema
 
-    def _create_connection(self) -> Connection:
-        return Connection(
-            self.server,
-            user=self.settings.USERNAME,
-            password=self.settings.PASSWORD,
-            auto_bind=True,
-            read_only=self.settings.READ_ONLY,
-            collect_usage=self.settings.COLLECT_METRICS,
-            **self.settings.CONNECTION_OPTIONS,
+    def _save_schema_cache(self, schema_version: Optional[str] = None) -> None:
+        if not self.schema_cache_path or self.server.schema is None:
+            return
+
+        if schema_version is None:
+            with self.get_connection() as connection:
+                schema_version = read_schema_version(connection, self.server.schema)
+        save_schema_cache(self.schema_cache_path, self.settings.SERVER, self.server.info, self.server.schema,
+                          schema_version)
+
+    def refresh_schema_cache(self) -> bool:
+        """
+        Check the schema version on the server, and update the schema cache file when the schema was modified.
+        The schema of this manager is replaced, while definitions that were already loaded are kept.
+        :return: True when the schema was modified
+        """
+        if not self.schema_cache_path:
+            return False
+
+        try:
+            with self.get_connection() as connection:
+                schema_version = read_schema_version(connection, self.server.schema)
+
+            cached_schema = load_schema_cache(self.schema_cache_path, self.settings.SERVER)
+            if cached_schema is not None and schema_version == cached_schema.schema_version:
+                # mark the cache as fresh
+                save_schema_cache(self.schema_cache_path, self.settings.SERVER, cached_schema.info,
+                                  cached_schema.schema, schema_version)
+                return False
+
+            # read the modified schema using a temporary connection
+            with Timer("read_schema", self.domain, "Reading LDAP schema for domain %s", self.domain):
+                server = self._create_server()
+                self._create_connection(server).unbind()
+            self.server.attach_dsa_info(server.info)
+            self.server.attach_schema_info(server.schema)
+            save_schema_cache(self.schema_cache_path, self.settings.SERVER, server.info, server.schema,
+                              schema_version)
+            logger.info(f"LDAP schema for domain {self.domain} was modified, schema cache updated")
+            return True
+        except LDAPException:
+            logger.exception(f"Failed to refresh LDAP schema cache for domain {self.domain}")
+            return False
+
+    def _create_pool(self) -> LDAPConnectionPool:
+        return LDAPConnectionPool(
+            self,
+            min_size=self.settings.POOL_MIN_SIZE,
+            max_size=self.settings.POOL_MAX_SIZE,
+            timeout=self.settings.POOL_TIMEOUT,
+            health_check_interval=self.settings.POOL_HEALTH_CHECK_INTERVAL,
         )
 
+    def _is_forked(self) -> bool:
+        return self._pid != os.getpid()
+
+    def _check_process(self) -> None:
+        """
+        Re-establish connections after the process was forked.
+        Sockets inherited from the parent process must not be used by the child, as LDAP messages of both processes
+        would interleave on the same connection. The server and the preloaded schema definitions are kept.
+        """
+        if not self._is_forked():
+            return
+
+        with _fork_lock:
+            if not self._is_forked():
+                return
+
+            logger.debug(f"Process forked, re-establishing LDAP connections for domain {self.domain}")
+            self._close_inherited()
+            # locks and threads of the parent process are not valid in the child
+            self._definitions_lock = RLock()
+            self._executor = None
+            self._executor_lock = Lock()
+            self.server.dit_lock = Lock()
+
+            self._conn = self._create_connection()
+            self.pool = self._create_pool()
+            self._pid = os.getpid()
+
+    def _close_inherited(self) -> None:
+        # close the child's copy of the sockets, without unbinding the parent's sessions
+        for connection in [self._conn, *self.pool.connections]:
+            socket = getattr(connection, "socket", None)
+            if socket is not None:
+                try:
+                    socket.close()
+                except OSError:
+                    pass
+
     @property
     def connection(self) -> Connection:
+        """
+        The manager's shared connection.
+        This connection is not safe for concurrent use, prefer get_connection() in multi-threaded code.
+        """
+        self._check_process()
         if not self._conn.bound:
-            with LogExecutionTime(f"Rebinding connection for domain {self.domain}"):
+            with self.circuit.call(), \
+                    Timer(OP_BIND, self.domain, "Rebinding connection for domain %s", self.domain):
                 self._conn.rebind()
         return self._conn
 
+    @contextmanager
+    def get_connection(self, timeout: Optional[float] = None) -> Iterator[Connection]:
+        """
+        Check out a dedicated connection from the domain's connection pool for the duration of the block.
+        Connections failing with a communication error are discarded from the pool.
+        While the domain's circuit is open, LDAPCircuitOpenError is raised without connecting.
+        :param timeout: Time (seconds) to wait for a free connection, defaults to POOL_TIMEOUT setting
+        :return: Bound ldap3 Connection
+        """
+        self._check_process()
+        with self.circuit.call(ignored=(LDAPPoolTimeoutError,)):
+            connection = self.pool.acquire(timeout=timeout)
+            try:
+                yield connection
+            except LDAPCommunicationError:
+                self.pool.discard(connection)
+                connection = None
+                raise
+            finally:
+                if connection is not None:
+                    self.pool.release(connection)
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """
+        Executor running blocking LDAP operations for asyncio code.
+        Bounded to POOL_MAX_SIZE threads, so every thread can check out its own pooled connection.
+        """
+        self._check_process()
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=max(self.settings.POOL_MAX_SIZE, 1),
+                        thread_name_prefix=f"wauth-ldap-{self.domain}",
+                    )
+        return self._executor
+
+    def submit(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Run a blocking function in the manager's executor, attributed to the submitting thread.
+        :param func: Function performing LDAP operations
+        :return: Future of the function's return value
+        """
+        return self.executor.submit(_run_for, get_origin_thread(), func, *args, **kwargs)
+
+    async def run_in_executor(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Await a blocking function running in the manager's executor.
+        :param func: Function performing LDAP operations
+        :return: The function's return value
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(_run_for, get_origin_thread(), func, *args, **kwargs))
+
+    def get_connections(self) -> List[Connection]:
+        """
+        All connections held by this manager, the shared connection first.
+        Connections inherited from a parent process are not included.
+        """
+        if self._is_forked():
+            return []
+        return [self._conn, *self.pool.connections]
+
     def close(self):
+        if self._is_forked():
+            # connections were not used by this process
+            self._close_inherited()
+            return False
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.pool.close()
         return self._conn.unbind()
 
-    def get_usage(self, unbind: bool = False) -> ConnectionUsage:
+    def get_usage(self, unbind: bool = False) -> Optional[ConnectionUsage]:
+        """
+        Usage metrics summed over all the manager's connections.
+        :param unbind: Unbind all connections before collecting
+        :return: ldap3 ConnectionUsage, None when metrics are not collected
+        """
+        connections = self.get_connections()
         if unbind:
             self.close()
-        return self._conn.usage
+
+        usages = [connection.usage for connection in connections if connection.usage is not None]
+        if not usages:
+            return None
+
+        usage = copy(usages[0])
+        for connection_usage in usages[1:]:
+            usage += connection_usage
+        return usage
 
     def get_definition(self, object_class: Union[str, List[str]], attributes: Iterable[str] = None) -> ObjectDef:
         """
@@ -75,20 +549,24 @@ class LDAPManager:
         :param attributes: Extra LDAP attributes to include
         :return: ldap3 ObjectDef instance
         """
-        # create definition if missing
-        if object_class not in self.definitions:
-            with LogExecutionTime(f"Loading LDAP Schema definition for objectClass {object_class}"):
-                self.definitions[object_class] = ObjectDef(object_class, self.connection)
+        self._check_process()
+        with self._definitions_lock:
+            # create definition if missing
+            if object_class not in self.definitions:
+                with Timer("load_definition", self.domain, "Loading LDAP Schema definition for objectClass %s",
+                           object_class):
+                    self.definitions[object_class] = ObjectDef(object_class, self.connection)
 
-        # add missing attributes
-        if attributes:
-            for attr in attributes:
-                if attr not in self.definitions[object_class]:
-                    self.definitions[object_class] += AttrDef(attr)
+            # add missing attributes
+            if attributes:
+                for attr in attributes:
+                    if attr not in self.definitions[object_class]:
+                        self.definitions[object_class] += AttrDef(attr)
 
-        return self.definitions[object_class]
+            return self.definitions[object_class]
 
-    def get_reader(self, object_class: Union[str, List[str]], query: str = None, attributes: Iterable[str] = None) -> Reader:
+    def get_reader(self, object_class: Union[str, List[str]], query: str = None, attributes: Iterable[str] = None,
+                   connection: Optional[Connection] = None) -> Reader:
         """
         Create a new ldap3 Reader for an object.
         Object definition is generated using LDAP Schema and is cached in the LDAP Manager for later uses.
@@ -97,10 +575,11 @@ class LDAPManager:
         :param object_class: LDAP objectClass type to refer to
         :param query: Optional query to narrow down the search
         :param attributes: Specific attributes to read
+        :param connection: Connection to search with, defaults to the manager's shared connection
         :return: ldap3 Reader object
         """
         return Reader(
-            self.connection,
+            connection or self.connection,
             self.get_definition(object_class, attributes=attributes),
             self.settings.SEARCH_BASE,
             query,
@@ -109,13 +588,33 @@ class LDAPManager:
 
     @property
     def bound(self) -> bool:
-        return self._conn.bound
+        return not self._is_forked() and self._conn.bound
 
     def __bool__(self):
         return self.bound
 
 
 _ldap_connections: Dict[str, LDAPManager] = {}
+_ldap_connections_lock = Lock()
+_ldap_domain_locks: Dict[str, Lock] = {}
+_fork_lock = Lock()
+
+
+def _reset_locks_after_fork() -> None:
+    """
+    Replace module locks in a forked child process, they may have been held by other threads of the parent.
+    Connections are re-established lazily by each manager on first use.
+    """
+    global _ldap_connections_lock, _ldap_domain_locks, _fork_lock
+    _ldap_connections_lock = Lock()
+    _ldap_domain_locks = {}
+    _fork_lock = Lock()
+    # global message id lock of ldap3
+    Server._message_id_lock = Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
 
 
 def get_ldap_manager(domain: str, settings: Optional[LDAPSettings] = None) -> LDAPManager:
@@ -126,11 +625,91 @@ def get_ldap_manager(domain: str, settings: Optional[LDAPSettings] = None) -> LD
     :return: LDAP Manager
     """
     if domain not in _ldap_connections:
-        _ldap_connections[domain] = LDAPManager(domain, settings=settings)
+        # only threads requesting the same domain wait while it is binding
+        with _get_domain_lock(domain):
+            # another thread may have created the manager while waiting
+            if domain not in _ldap_connections:
+                _ldap_connections[domain] = LDAPManager(domain, settings=settings)
 
     return _ldap_connections[domain]
 
 
+def _get_domain_lock(domain: str) -> Lock:
+    with _ldap_connections_lock:
+        if domain not in _ldap_domain_locks:
+            _ldap_domain_locks[domain] = Lock()
+        return _ldap_domain_locks[domain]
+
+
+async def aget_ldap_manager(domain: str, settings: Optional[LDAPSettings] = None) -> LDAPManager:
+    """
+    Asynchronous version of get_ldap_manager.
+    Managers that are not loaded yet are created (and bound) outside of the event loop.
+    :param domain: LDAP Manager for domain
+    :param settings: Custom LDAP Settings
+    :return: LDAP Manager
+    """
+    if domain in _ldap_connections:
+        return _ldap_connections[domain]
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, partial(get_ldap_manager, domain, settings=settings))
+
+
+def preload_domains(domains: Iterable[str], timeout: Optional[float] = None,
+                    background: bool = False) -> Dict[str, float]:
+    """
+    Load and bind LDAP Managers for multiple domains concurrently.
+    Domains that are not bound before the timeout keep binding in background, while requests for these domains
+    wait only for their own domain.
+    :param domains: Domains to preload
+    :param timeout: Overall time (seconds) to wait for all domains, None to wait until all domains are bound
+    :param background: Preload in a background thread, and return immediately
+    :return: Mapping of preloaded domains to their bind time (seconds), failed and pending domains are omitted
+    """
+    domains = list(domains)
+    if not domains:
+        return {}
+
+    if background:
+        Thread(target=preload_domains, args=(domains, timeout), name="wauth-preload", daemon=True).start()
+        return {}
+
+    executor = ThreadPoolExecutor(max_workers=len(domains), thread_name_prefix="wauth-preload")
+    futures = {executor.submit(_preload_domain, domain): domain for domain in domains}
+    with Timer("preload", None, "Preloading %d LDAP domains", len(domains)):
+        done, pending = wait(futures, timeout=timeout)
+    executor.shutdown(wait=False)
+
+    for future in pending:
+        logger.warning(f"Preloading connection to domain {futures[future]} did not complete in {timeout} seconds, "
+                       f"continuing in background.")
+
+    preloaded = {}
+    for future in done:
+        bind_time = future.result()
+        if bind_time is not None:
+            preloaded[futures[future]] = bind_time
+    return preloaded
+
+
+def _preload_domain(domain: str) -> Optional[float]:
+    start = time.perf_counter()
+    try:
+        manager = get_ldap_manager(domain)
+    except LDAPException:
+        logger.exception(f"Failed to preload connection to domain {domain}.")
+        return None
+
+    bind_time = time.perf_counter() - start
+    if manager.bound:
+        logger.debug(f"Preloaded LDAP connection to domain {domain} successfully in {bind_time:.3f} seconds.")
+        return bind_time
+    else:
+        logger.warning(f"Failed to preload connection to domain {domain}.")
+        return None
+
+
 def close_connections(domains: List[str] = None):
     """
     Unbind LDAP connections for domains.
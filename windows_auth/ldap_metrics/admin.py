@@ -1,13 +1,34 @@
 from django.contrib import admin
-from django.db.models import F, ExpressionWrapper, DurationField
 
-from windows_auth.ldap_metrics.models import LDAPUsage
+from windows_auth.ldap_metrics.models import LDAPUsage, LDAPUsageRollup
 from windows_auth.ldap_metrics.utils import format_bytes
 
 
+class UsageCountersAdminMixin:
+    """
+    Read-only admin display of LDAP Connection usage counters
+    """
+
+    def bytes(self, obj):
+        return format_bytes(obj.bytes_received) + " / " + format_bytes(obj.bytes_transmitted)
+
+    def messages(self, obj):
+        return str(obj.messages_received) + " / " + str(obj.messages_transmitted)
+
+    def sockets(self, obj):
+        return str(obj.open_sockets) + " / " + str(obj.closed_sockets) + " / " + str(obj.wrapped_sockets)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(LDAPUsage)
-class LDAPUsageAdmin(admin.ModelAdmin):
-    date_hierarchy = "timestamp"
+class LDAPUsageAdmin(UsageCountersAdminMixin, admin.ModelAdmin):
+    # raw metrics grow quickly, avoid queries over the whole table
+    show_full_result_count = False
     list_display = ("timestamp", "elapsed_time", "domain", "pid", "operations",
                     "sockets", "bytes", "messages", )
     list_filter = ("domain",)
@@ -16,7 +37,7 @@ class LDAPUsageAdmin(admin.ModelAdmin):
     fieldsets = (
         ("General", {
             "description": "Connection's general context",
-            "fields": ("timestamp", "pid", "domain"),
+            "fields": ("since", "timestamp", "pid", "domain"),
         }),
         ("Time", {
             "description": "Connection timings",
@@ -51,27 +72,49 @@ class LDAPUsageAdmin(admin.ModelAdmin):
         }),
     )
 
-    def get_queryset(self, request):
-        return super().get_queryset(request).annotate(
-            elapsed_time=ExpressionWrapper(
-                F("connection_stop_time") - F("open_socket_start_time"),
-                output_field=DurationField()),
-        )
-
     def elapsed_time(self, obj):
-        return obj.elapsed_time
+        if obj.connection_stop_time and obj.open_socket_start_time:
+            return obj.connection_stop_time - obj.open_socket_start_time
+        return None
 
-    def bytes(self, obj):
-        return format_bytes(obj.bytes_received) + " / " + format_bytes(obj.bytes_transmitted)
 
-    def messages(self, obj):
-        return str(obj.messages_received) + " / " + str(obj.messages_transmitted)
+@admin.register(LDAPUsageRollup)
+class LDAPUsageRollupAdmin(UsageCountersAdminMixin, admin.ModelAdmin):
+    date_hierarchy = "period_start"
+    list_display = ("period_start", "period", "domain", "samples", "processes", "operations",
+                    "search_operations", "bind_operations", "sockets", "bytes", "messages", )
+    list_filter = ("period", "domain")
+    search_fields = ("domain", )
 
-    def sockets(self, obj):
-        return str(obj.open_sockets) + " / " + str(obj.closed_sockets) + " / " + str(obj.wrapped_sockets)
-
-    def has_add_permission(self, request):
-        return False
-
-    def has_change_permission(self, request, obj=None):
-        return False
+    fieldsets = (
+        ("General", {
+            "description": "Rollup period",
+            "fields": ("period", "period_start", "domain", "samples", "processes"),
+        }),
+        ("Server", {
+            "description": "Socket metrics",
+            "fields": ("servers_from_pool", "open_sockets", "closed_sockets", "wrapped_sockets"),
+        }),
+        ("Bytes", {
+            "description": "Traffic metrics",
+            "fields": ("bytes_transmitted", "bytes_received"),
+        }),
+        ("Messages", {
+            "description": "LDAP Messages counts",
+            "fields": ("messages_transmitted", "messages_received"),
+        }),
+        ("Operations", {
+            "description": "LDAP Operations",
+            "fields": ("operations", "abandon_operations", "bind_operations", "add_operations", "compare_operations",
+                       "delete_operations", "extended_operations", "modify_operations", "modify_dn_operations",
+                       "search_operations", "unbind_operations"),
+        }),
+        ("Referrals", {
+            "description": "LDAP Alternate Locations References",
+            "fields": ("referrals_received", "referrals_followed", "referrals_connections"),
+        }),
+        ("Restartable tries", {
+            "description": "Restartable connection metrics",
+            "fields": ("restartable_failures", "restartable_successes"),
+        }),
+    )
@@ -8,5 +8,6 @@ class LdapMetricsConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
 
     def ready(self):
-        from windows_auth.ldap_metrics.utils import collect_metrics
+        from windows_auth.ldap_metrics.utils import collect_metrics, get_metrics_flusher
+        get_metrics_flusher().start()
         atexit.register(collect_metrics)
@@ -0,0 +1,33 @@
+from django.core.management import BaseCommand, CommandParser
+
+from windows_auth.conf import WAUTH_METRICS_RAW_RETENTION, WAUTH_METRICS_HOURLY_RETENTION, \
+    WAUTH_METRICS_DAILY_RETENTION
+from windows_auth.ldap_metrics.utils import rollup_usage
+
+
+def parse_retention(value: str):
+    # "none" keeps the records forever
+    return None if value.lower() == "none" else float(value)
+
+
+class Command(BaseCommand):
+    help = "Roll up LDAP usage metrics into hourly and daily rollups, and prune records older than their retention."
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("--raw-retention", type=parse_retention, default=WAUTH_METRICS_RAW_RETENTION,
+                            help="Days to keep raw usage metrics, \"none\" to keep forever")
+        parser.add_argument("--hourly-retention", type=parse_retention, default=WAUTH_METRICS_HOURLY_RETENTION,
+                            help="Days to keep hourly rollups, \"none\" to keep forever")
+        parser.add_argument("--daily-retention", type=parse_retention, default=WAUTH_METRICS_DAILY_RETENTION,
+                            help="Days to keep daily rollups, \"none\" to keep forever")
+        parser.add_argument("-b", "--batch-size", type=int, default=10000, help="Records deleted in each DB query")
+
+    def handle(self, raw_retention=None, hourly_retention=None, daily_retention=None, batch_size=10000, **options):
+        results = rollup_usage(
+            raw_retention=raw_retention,
+            hourly_retention=hourly_retention,
+            daily_retention=daily_retention,
+            batch_size=batch_size,
+        )
+        for name, (saved, deleted) in results.items():
+            self.stdout.write(f"{name}: {saved} records saved, {deleted} records deleted.")
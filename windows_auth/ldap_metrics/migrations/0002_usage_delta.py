@@ -0,0 +1,139 @@
+# Generated by Django 3.2.5 on 2026-10-17 13:23
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ldap_metrics', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ldapusage',
+            name='since',
+            field=models.DateTimeField(help_text='Start of the collection period', null=True),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='abandon_operations',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Abandon Operations'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='add_operations',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Add Operations'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='bind_operations',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Bind Operations'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='bytes_received',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Bytes received'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='bytes_transmitted',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Bytes transmitted'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='closed_sockets',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. of sockets closed'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='compare_operations',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Compare Operations'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='delete_operations',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Delete Operations'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='extended_operations',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Extended Operations'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='messages_received',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Messages received'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='messages_transmitted',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Messages transmitted'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='modify_dn_operations',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Move Operations'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='modify_operations',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Modify Operations'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='open_sockets',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. of sockets opened'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='operations',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Operations'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='referrals_connections',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Referrals Connections'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='referrals_followed',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Referrals Followed'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='referrals_received',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Referrals Received'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='restartable_failures',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Restartable Failures'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='restartable_successes',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Restartable Successes'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='search_operations',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Search Operations'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='servers_from_pool',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. servers from pool'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='unbind_operations',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Unbind Operations'),
+        ),
+        migrations.AlterField(
+            model_name='ldapusage',
+            name='wrapped_sockets',
+            field=models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. of sockets wrapped by TLS'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.5 on 2026-10-17 13:31
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ldap_metrics', '0002_usage_delta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LDAPUsageRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('servers_from_pool', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. servers from pool')),
+                ('open_sockets', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. of sockets opened')),
+                ('closed_sockets', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. of sockets closed')),
+                ('wrapped_sockets', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. of sockets wrapped by TLS')),
+                ('bytes_transmitted', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Bytes transmitted')),
+                ('bytes_received', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Bytes received')),
+                ('messages_transmitted', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Messages transmitted')),
+                ('messages_received', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Messages received')),
+                ('operations', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Operations')),
+                ('abandon_operations', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Abandon Operations')),
+                ('bind_operations', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Bind Operations')),
+                ('add_operations', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Add Operations')),
+                ('compare_operations', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Compare Operations')),
+                ('delete_operations', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Delete Operations')),
+                ('extended_operations', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Extended Operations')),
+                ('modify_operations', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Modify Operations')),
+                ('modify_dn_operations', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Move Operations')),
+                ('search_operations', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Search Operations')),
+                ('unbind_operations', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Unbind Operations')),
+                ('referrals_received', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Referrals Received')),
+                ('referrals_followed', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Referrals Followed')),
+                ('referrals_connections', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Referrals Connections')),
+                ('restartable_failures', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Restartable Failures')),
+                ('restartable_successes', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. Restartable Successes')),
+                ('period', models.CharField(choices=[('hour', 'Hourly'), ('day', 'Daily')], help_text='Aggregation period', max_length=4)),
+                ('period_start', models.DateTimeField(db_index=True, help_text='Start of the aggregation period')),
+                ('domain', models.CharField(db_index=True, help_text="Connection's domain", max_length=128)),
+                ('samples', models.BigIntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)], help_text='Num. of aggregated metrics records')),
+                ('processes', models.PositiveIntegerField(default=0, help_text='Num. of reporting processes (peak hour for daily)')),
+            ],
+            options={
+                'ordering': ['-period_start', 'domain'],
+                'get_latest_by': 'period_start',
+                'unique_together': {('period', 'domain', 'period_start')},
+            },
+        ),
+    ]
@@ -1,10 +1,56 @@
+from django.core.validators import MinValueValidator
 from django.db import models
 
 
-class LDAPUsage(models.Model):
+def counter_field(help_text: str) -> models.BigIntegerField:
+    """
+    Non-negative counter, BigIntegerField with a validator as PositiveBigIntegerField requires Django 3.1
+    """
+    return models.BigIntegerField(default=0, validators=[MinValueValidator(0)], help_text=help_text)
+
+
+class UsageCounters(models.Model):
+    """
+    LDAP Connection usage counters, see ldap3 ConnectionUsage
+    """
+    servers_from_pool = counter_field("Num. servers from pool")
+    open_sockets = counter_field("Num. of sockets opened")
+    closed_sockets = counter_field("Num. of sockets closed")
+    wrapped_sockets = counter_field("Num. of sockets wrapped by TLS")
+
+    bytes_transmitted = counter_field("Bytes transmitted")
+    bytes_received = counter_field("Bytes received")
+    messages_transmitted = counter_field("Messages transmitted")
+    messages_received = counter_field("Messages received")
+
+    operations = counter_field("Num. Operations")
+    abandon_operations = counter_field("Num. Abandon Operations")
+    bind_operations = counter_field("Num. Bind Operations")
+    add_operations = counter_field("Num. Add Operations")
+    compare_operations = counter_field("Num. Compare Operations")
+    delete_operations = counter_field("Num. Delete Operations")
+    extended_operations = counter_field("Num. Extended Operations")
+    modify_operations = counter_field("Num. Modify Operations")
+    modify_dn_operations = counter_field("Num. Move Operations")
+    search_operations = counter_field("Num. Search Operations")
+    unbind_operations = counter_field("Num. Unbind Operations")
+
+    referrals_received = counter_field("Num. Referrals Received")
+    referrals_followed = counter_field("Num. Referrals Followed")
+    referrals_connections = counter_field("Num. Referrals Connections")
+
+    restartable_failures = counter_field("Num. Restartable Failures")
+    restartable_successes = counter_field("Num. Restartable Successes")
+
+    class Meta:
+        abstract = True
+
+
+class LDAPUsage(UsageCounters):
     timestamp = models.DateTimeField(auto_now=True, db_index=True, help_text="Metrics Collection Time")
     pid = models.IntegerField(help_text="Process ID")
     domain = models.CharField(max_length=128, db_index=True, help_text="Connection's domain")
+    since = models.DateTimeField(null=True, help_text="Start of the collection period")
 
     initial_connection_start_time = models.DateTimeField(null=True, help_text="Initialization timestamp")
     open_socket_start_time = models.DateTimeField(null=True, help_text="Socket Open timestamp")
@@ -12,35 +58,29 @@ class LDAPUsage(models.Model):
     last_transmitted_time = models.DateTimeField(null=True, help_text="Last message transmitted timestamp")
     last_received_time = models.DateTimeField(null=True, help_text="Last message received timestamp")
 
-    servers_from_pool = models.PositiveSmallIntegerField(default=0, help_text="Num. servers from pool")
-    open_sockets = models.PositiveSmallIntegerField(default=0, help_text="Num. of sockets opened")
-    closed_sockets = models.PositiveSmallIntegerField(default=0, help_text="Num. of sockets closed")
-    wrapped_sockets = models.PositiveSmallIntegerField(default=0, help_text="Num. of sockets wrapped by TLS")
-
-    bytes_transmitted = models.PositiveIntegerField(default=0, help_text="Bytes transmitted")
-    bytes_received = models.PositiveIntegerField(default=0, help_text="Bytes received")
-    messages_transmitted = models.PositiveIntegerField(default=0, help_text="Messages transmitted")
-    messages_received = models.PositiveIntegerField(default=0, help_text="Messages received")
-
-    operations = models.PositiveSmallIntegerField(default=0, help_text="Num. Operations")
-    abandon_operations = models.PositiveSmallIntegerField(default=0, help_text="Num. Abandon Operations")
-    bind_operations = models.PositiveSmallIntegerField(default=0, help_text="Num. Bind Operations")
-    add_operations = models.PositiveSmallIntegerField(default=0, help_text="Num. Add Operations")
-    compare_operations = models.PositiveSmallIntegerField(default=0, help_text="Num. Compare Operations")
-    delete_operations = models.PositiveSmallIntegerField(default=0, help_text="Num. Delete Operations")
-    extended_operations = models.PositiveSmallIntegerField(default=0, help_text="Num. Extended Operations")
-    modify_operations = models.PositiveSmallIntegerField(default=0, help_text="Num. Modify Operations")
-    modify_dn_operations = models.PositiveSmallIntegerField(default=0, help_text="Num. Move Operations")
-    search_operations = models.PositiveSmallIntegerField(default=0, help_text="Num. Search Operations")
-    unbind_operations = models.PositiveSmallIntegerField(default=0, help_text="Num. Unbind Operations")
-
-    referrals_received = models.PositiveSmallIntegerField(default=0, help_text="Num. Referrals Received")
-    referrals_followed = models.PositiveSmallIntegerField(default=0, help_text="Num. Referrals Followed")
-    referrals_connections = models.PositiveSmallIntegerField(default=0, help_text="Num. Referrals Connections")
-
-    restartable_failures = models.PositiveSmallIntegerField(default=0, help_text="Num. Restartable Failures")
-    restartable_successes = models.PositiveSmallIntegerField(default=0, help_text="Num. Restartable Successes")
-
     class Meta:
         ordering = ["-timestamp"]
         get_latest_by = "timestamp"
+
+
+class LDAPUsageRollup(UsageCounters):
+    """
+    LDAP Connection usage of a domain aggregated over an hour or a day
+    """
+    PERIOD_HOUR = "hour"
+    PERIOD_DAY = "day"
+    PERIOD_CHOICES = (
+        (PERIOD_HOUR, "Hourly"),
+        (PERIOD_DAY, "Daily"),
+    )
+
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES, help_text="Aggregation period")
+    period_start = models.DateTimeField(db_index=True, help_text="Start of the aggregation period")
+    domain = models.CharField(max_length=128, db_index=True, help_text="Connection's domain")
+    samples = counter_field("Num. of aggregated metrics records")
+    processes = models.PositiveIntegerField(default=0, help_text="Num. of reporting processes (peak hour for daily)")
+
+    class Meta:
+        ordering = ["-period_start", "domain"]
+        get_latest_by = "period_start"
+        unique_together = (("period", "domain", "period_start"),)
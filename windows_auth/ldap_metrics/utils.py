@@ -1,12 +1,24 @@
 import os
+from copy import copy
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from typing import Optional, List, Dict, Any, Iterable, Tuple
+from weakref import WeakKeyDictionary
 
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import QuerySet, Sum, Count, Max, Min
+from django.db.models.functions import TruncHour, TruncDay
+from django.utils import timezone
 from django.utils.timezone import make_aware
+from ldap3 import Connection
 from ldap3.core.usage import ConnectionUsage
 
 from windows_auth import logger
+from windows_auth.conf import WAUTH_METRICS_FLUSH_INTERVAL
 from windows_auth.ldap import _ldap_connections
-from windows_auth.ldap_metrics.models import LDAPUsage
-from windows_auth.utils import LogExecutionTime
+from windows_auth.ldap_metrics.models import LDAPUsage, LDAPUsageRollup
+from windows_auth.timing import Timer
 
 
 def format_bytes(value, precision=2, step_size=1024, steps=('B', 'KB', 'MB', 'GB', 'TB')):
@@ -25,11 +37,24 @@ def optional_make_aware(value, timezone=None, is_dst=None):
         return None
 
 
-def create_usage(domain: str, usage: ConnectionUsage) -> LDAPUsage:
+# ConnectionUsage counters, saved as deltas between flushes
+USAGE_COUNTERS = (
+    "servers_from_pool", "open_sockets", "closed_sockets", "wrapped_sockets",
+    "bytes_transmitted", "bytes_received", "messages_transmitted", "messages_received",
+    "operations", "abandon_operations", "bind_operations", "add_operations", "compare_operations",
+    "delete_operations", "extended_operations", "modify_operations", "modify_dn_operations",
+    "search_operations", "unbind_operations",
+    "referrals_received", "referrals_followed", "referrals_connections",
+    "restartable_failures", "restartable_successes",
+)
+
+
+def create_usage(domain: str, usage: ConnectionUsage, since: Optional[datetime] = None) -> LDAPUsage:
     logger.debug(f"Collecting LDAP Connection metrics for {domain}")
     return LDAPUsage(
         domain=domain,
         pid=os.getpid(),
+        since=since,
 
         initial_connection_start_time=optional_make_aware(usage.initial_connection_start_time),
         open_socket_start_time=optional_make_aware(usage.open_socket_start_time),
@@ -68,16 +93,288 @@ def create_usage(domain: str, usage: ConnectionUsage) -> LDAPUsage:
     )
 
 
+class MetricsFlusher:
+    """
+    Save the LDAP Connection usage metrics of all domains periodically from a background thread.
+    Each flush saves the usage since the previous flush, so long-running processes report their usage
+    without unbinding their connections, and a killed process loses only the last interval.
+    """
+
+    def __init__(self, interval: Optional[float] = None, batch_size: int = 100):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.since = timezone.now()
+        # counters of each connection at the last flush
+        self._last: "WeakKeyDictionary[Connection, Dict[str, Any]]" = WeakKeyDictionary()
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread: Optional[Thread] = None
+
+    def start(self) -> None:
+        """
+        Start flushing every interval, unless already started or the interval is not configured.
+        """
+        if not self.interval or (self._thread is not None and self._thread.is_alive()):
+            return
+
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name="wauth-metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(f"Periodic collection of LDAP Connection Metrics failed: {e}")
+            finally:
+                close_old_connections()
+
+    def flush(self, unbind: bool = False) -> List[LDAPUsage]:
+        """
+        Save the usage metrics of each domain since the last flush.
+        Domains without any LDAP activity since the last flush are skipped.
+        :param unbind: Unbind all connections before collecting
+        :return: The saved usage metrics
+        """
+        with self._lock:
+            since, self.since = self.since, timezone.now()
+            usages = []
+            for domain, manager in list(_ldap_connections.items()):
+                connections = manager.get_connections()
+                if unbind:
+                    manager.close()
+
+                usage = self._get_delta(connections)
+                if usage is not None:
+                    usages.append(create_usage(domain, usage, since=since))
+
+            if usages:
+                with Timer("save_metrics", None, "Saving LDAP Connection metrics for %d domains", len(usages)):
+                    LDAPUsage.objects.bulk_create(usages, batch_size=self.batch_size)
+            return usages
+
+    def _get_delta(self, connections: Iterable[Connection]) -> Optional[ConnectionUsage]:
+        total = None
+        for connection in connections:
+            usage = connection.usage
+            if usage is None:
+                continue
+
+            current = {name: getattr(usage, name) for name in USAGE_COUNTERS}
+            current["open_socket_start_time"] = usage.open_socket_start_time
+            last = self._last.get(connection)
+            # counters are reset when the connection is re-opened
+            if last is not None and (last["open_socket_start_time"] != usage.open_socket_start_time
+                                     or any(current[name] < last[name] for name in USAGE_COUNTERS)):
+                last = None
+            self._last[connection] = current
+
+            delta = copy(usage)
+            for name in USAGE_COUNTERS:
+                setattr(delta, name, current[name] - (last[name] if last else 0))
+
+            if total is None:
+                total = delta
+            else:
+                total += delta
+
+        if total is None or not any(getattr(total, name) for name in USAGE_COUNTERS):
+            return None
+        return total
+
+    def _after_fork(self):
+        # connections and the flusher thread of the parent process are not used by the child
+        self._last = WeakKeyDictionary()
+        self._lock = Lock()
+        self.since = timezone.now()
+        self._thread = None
+        self.start()
+
+
+_metrics_flusher: Optional[MetricsFlusher] = None
+_metrics_flusher_lock = Lock()
+
+
+def get_metrics_flusher() -> MetricsFlusher:
+    """
+    Get or create the process metrics flusher, configured by WAUTH_METRICS_FLUSH_INTERVAL setting.
+    """
+    global _metrics_flusher
+    if _metrics_flusher is None:
+        with _metrics_flusher_lock:
+            if _metrics_flusher is None:
+                _metrics_flusher = MetricsFlusher(interval=WAUTH_METRICS_FLUSH_INTERVAL)
+                if hasattr(os, "register_at_fork"):
+                    os.register_at_fork(after_in_child=_metrics_flusher._after_fork)
+    return _metrics_flusher
+
+
 def collect_metrics(unbind: bool = True):
     if unbind:
         logger.info(f"Unbinding all LDAP Connections for collecting metrics")
 
-    with LogExecutionTime("Collecting LDAP Connection metrics"):
+    with Timer("collect_metrics", None, "Collecting LDAP Connection metrics"):
         try:
-            LDAPUsage.objects.bulk_create(
-                create_usage(domain, manager.get_usage())
-                for domain, manager in _ldap_connections.items()
-                if manager.get_usage(unbind=unbind)
-            )
+            get_metrics_flusher().flush(unbind=unbind)
         except Exception as e:
             logger.exception(f"Collection of LDAP Connection Metrics failed: {e}")
+
+
+def _floor_hour(value: datetime) -> datetime:
+    # hourly rollups are aligned to UTC hours
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _floor_day(value: datetime) -> datetime:
+    # daily rollups are aligned to days of the current time zone
+    if not settings.USE_TZ:
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    local = timezone.localtime(value).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+    return timezone.make_aware(local, is_dst=False)
+
+
+def _save_rollups(period: str, rows: Iterable[Dict[str, Any]]) -> int:
+    count = 0
+    with transaction.atomic():
+        for row in rows:
+            domain, period_start = row.pop("domain"), row.pop("start")
+            LDAPUsageRollup.objects.update_or_create(
+                period=period,
+                domain=domain,
+                period_start=period_start,
+                defaults=row,
+            )
+            count += 1
+    return count
+
+
+def _get_watermark(period: str) -> Optional[datetime]:
+    # the last rolled up period may have been incomplete, and is rolled up again
+    return LDAPUsageRollup.objects.filter(period=period).aggregate(last=Max("period_start"))["last"]
+
+
+def rollup_hourly(until: datetime, batch_hours: int = 24) -> int:
+    """
+    Aggregate the raw usage metrics of each domain into hourly rollups, up to an hour.
+    Hours are aggregated in batches, keeping each aggregation query short.
+    :param until: Aggregate the hours before this time
+    :param batch_hours: Hours aggregated by each query
+    :return: Number of saved rollups
+    """
+    end = _floor_hour(until)
+    start = _get_watermark(LDAPUsageRollup.PERIOD_HOUR)
+    if start is None:
+        first = LDAPUsage.objects.aggregate(first=Min("timestamp"))["first"]
+        if first is None:
+            return 0
+        start = _floor_hour(first)
+
+    count = 0
+    batch = timedelta(hours=max(batch_hours, 1))
+    while start < end:
+        batch_end = min(start + batch, end)
+        rows = (
+            LDAPUsage.objects
+            .filter(timestamp__gte=start, timestamp__lt=batch_end)
+            .annotate(start=TruncHour("timestamp", tzinfo=timezone.utc))
+            .order_by()
+            .values("domain", "start")
+            .annotate(
+                samples=Count("id"),
+                processes=Count("pid", distinct=True),
+                **{name: Sum(name) for name in USAGE_COUNTERS},
+            )
+        )
+        count += _save_rollups(LDAPUsageRollup.PERIOD_HOUR, rows)
+        start = batch_end
+    return count
+
+
+def rollup_daily(until: datetime) -> int:
+    """
+    Aggregate the hourly rollups of each domain into daily rollups, up to a day.
+    :param until: Aggregate the days before this time
+    :return: Number of saved rollups
+    """
+    queryset = LDAPUsageRollup.objects.filter(period=LDAPUsageRollup.PERIOD_HOUR,
+                                              period_start__lt=_floor_day(until))
+    start = _get_watermark(LDAPUsageRollup.PERIOD_DAY)
+    if start is not None:
+        queryset = queryset.filter(period_start__gte=start)
+
+    rows = (
+        queryset
+        .annotate(start=TruncDay("period_start"))
+        .order_by()
+        .values("domain", "start")
+        .annotate(
+            samples=Sum("samples"),
+            processes=Max("processes"),
+            **{name: Sum(name) for name in USAGE_COUNTERS},
+        )
+    )
+    return _save_rollups(LDAPUsageRollup.PERIOD_DAY, rows)
+
+
+def delete_in_batches(queryset: QuerySet, batch_size: int = 10000) -> int:
+    """
+    Delete the records of a queryset by primary key in batches, keeping each delete query and lock short.
+    :return: Number of deleted records
+    """
+    deleted = 0
+    while True:
+        pks = list(queryset.order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += queryset.model.objects.filter(pk__in=pks).delete()[0]
+
+
+def _retention_cutoff(now: datetime, days: Optional[float], watermark: Optional[datetime]) -> Optional[datetime]:
+    # records are kept until they were rolled up, regardless of retention
+    if days is None or watermark is None:
+        return None
+    return min(now - timedelta(days=days), watermark)
+
+
+def rollup_usage(now: Optional[datetime] = None, raw_retention: Optional[float] = None,
+                 hourly_retention: Optional[float] = None, daily_retention: Optional[float] = None,
+                 batch_size: int = 10000) -> Dict[str, Tuple[int, int]]:
+    """
+    Roll up the raw usage metrics into hourly and daily rollups, and prune records older than their retention.
+    Records are never pruned before they are rolled up.
+    :param now: Current time, only complete hours and days before it are rolled up
+    :param raw_retention: Days to keep raw usage metrics, None to keep forever
+    :param hourly_retention: Days to keep hourly rollups, None to keep forever
+    :param daily_retention: Days to keep daily rollups, None to keep forever
+    :param batch_size: Records deleted by each query
+    :return: Mapping of record type to the number of saved and deleted records
+    """
+    now = now or timezone.now()
+    with Timer("rollup_metrics", None, "Rolling up LDAP Connection metrics"):
+        hourly = rollup_hourly(now)
+        daily = rollup_daily(now)
+
+    with Timer("prune_metrics", None, "Pruning LDAP Connection metrics"):
+        cutoff = _retention_cutoff(now, raw_retention, _get_watermark(LDAPUsageRollup.PERIOD_HOUR))
+        raw_deleted = delete_in_batches(LDAPUsage.objects.filter(timestamp__lt=cutoff), batch_size) \
+            if cutoff else 0
+
+        cutoff = _retention_cutoff(now, hourly_retention, _get_watermark(LDAPUsageRollup.PERIOD_DAY))
+        hourly_deleted = delete_in_batches(LDAPUsageRollup.objects.filter(
+            period=LDAPUsageRollup.PERIOD_HOUR, period_start__lt=cutoff), batch_size) if cutoff else 0
+
+        daily_deleted = 0
+        if daily_retention is not None:
+            daily_deleted = delete_in_batches(LDAPUsageRollup.objects.filter(
+                period=LDAPUsageRollup.PERIOD_DAY, period_start__lt=now - timedelta(days=daily_retention)),
+                batch_size)
+
+    return {
+        "raw": (0, raw_deleted),
+        "hourly": (hourly, hourly_deleted),
+        "daily": (daily, daily_deleted),
+    }
@@ -7,7 +7,8 @@ from django.utils import timezone
 from pythoncom import com_error
 
 from windows_auth.scheduler import create_task_definition, LOCAL_SERVICE, add_schedule_trigger, register_task
-from windows_auth.predefined_tasks import clear_sessions_task, clean_duplicate_history_task, clean_old_history_task, process_tasks_task
+from windows_auth.predefined_tasks import clear_sessions_task, clean_duplicate_history_task, clean_old_history_task, \
+    process_tasks_task, rollup_ldap_usage_task
 
 
 def parse_datetime(string):
@@ -37,6 +38,7 @@ PREDEFINED_TASKS = {
     "clean_duplicate_history": clean_duplicate_history_task,
     "clean_old_history": clean_old_history_task,
     "process_tasks": process_tasks_task,
+    "rollup_ldap_usage": rollup_ldap_usage_task,
 }
 
 
@@ -0,0 +1,111 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandParser, CommandError
+from ldap3.core.exceptions import LDAPException
+
+from windows_auth.ldap import get_ldap_manager
+from windows_auth.models import LDAPUser
+from windows_auth.timing import Timer
+
+
+def fetch_ldap_users(domain: str, page_size: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Search all users of a domain using a single paged search.
+    :param domain: Domain to search
+    :param page_size: Number of entries for each search page
+    :return: Mapping of the lowercase USER_QUERY_FIELD value to the user's field values
+    """
+    manager = get_ldap_manager(domain)
+    field_map = manager.settings.USER_FIELD_MAP
+    query_attr = field_map[manager.settings.USER_QUERY_FIELD]
+
+    users = {}
+    with manager.get_connection() as connection:
+        reader = manager.get_reader(
+            "user",
+            ", ".join(f"{key}: {value}" for key, value in manager.settings.USER_QUERY_FILTER.items()),
+            attributes=field_map.values(),
+            connection=connection,
+        )
+        with Timer("search_users", domain, "Paged search of LDAP Users for domain %s", domain):
+            for entry in reader.search_paged(page_size, paged_criticality=False):
+                if query_attr not in entry or entry[query_attr].value is None:
+                    continue
+
+                users[str(entry[query_attr].value).lower()] = {
+                    field: entry[attr].value
+                    for field, attr in field_map.items()
+                    if attr in entry
+                }
+
+    return users
+
+
+class Command(BaseCommand):
+    help = "Synchronize fields of all LDAP Users against LDAP in bulk."
+
+    def add_arguments(self, parser: CommandParser):
+        parser.add_argument("domains", nargs="*", help="Domains to synchronize (default: all domains with users)")
+        parser.add_argument("-p", "--page-size", type=int, default=1000, help="LDAP paged search size")
+        parser.add_argument("-b", "--batch-size", type=int, default=500, help="Users updated in each DB query")
+        parser.add_argument("-w", "--workers", type=int, default=4, help="Domains searched in parallel")
+        parser.add_argument("--dry-run", action="store_true", help="Report changes without saving them")
+
+    def handle(self, domains=None, page_size=1000, batch_size=500, workers=4, dry_run=False, **options):
+        if not domains:
+            domains = list(LDAPUser.objects.values_list("domain", flat=True).distinct().order_by("domain"))
+
+        failed = False
+        # search domains in parallel, and apply changes to the DB from the main thread
+        with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="wauth-syncldapusers") as executor:
+            futures = {executor.submit(fetch_ldap_users, domain, page_size): domain for domain in domains}
+            for future in as_completed(futures):
+                domain = futures[future]
+                try:
+                    ldap_users = future.result()
+                except LDAPException as e:
+                    failed = True
+                    self.stderr.write(f"Failed to search users for domain {domain}: {e}")
+                    continue
+
+                self.sync_domain(domain, ldap_users, batch_size, dry_run)
+
+        if failed:
+            raise CommandError("Some domains failed to synchronize.")
+
+    def sync_domain(self, domain: str, ldap_users: Dict[str, Dict[str, Any]], batch_size: int, dry_run: bool):
+        """
+        Match LDAP User entries to the domain's users and bulk update the changed fields.
+        """
+        manager = get_ldap_manager(domain)
+        query_field = manager.settings.USER_QUERY_FIELD
+        fields = [field for field in manager.settings.USER_FIELD_MAP.keys() if field != query_field]
+
+        changed = []
+        missing = 0
+        queryset = LDAPUser.objects.filter(domain=domain).select_related("user")
+        for ldap_user in queryset.iterator(chunk_size=batch_size):
+            user = ldap_user.user
+            values = ldap_users.get(str(getattr(user, query_field)).lower())
+            if values is None:
+                missing += 1
+                continue
+
+            updated = False
+            for field in fields:
+                value = values.get(field)
+                if value is not None and getattr(user, field) != value:
+                    setattr(user, field, value)
+                    updated = True
+
+            if updated:
+                changed.append(user)
+
+        if not dry_run and changed and fields:
+            with Timer("bulk_update_users", domain, "Bulk update of %d users for domain %s", len(changed), domain):
+                get_user_model().objects.bulk_update(changed, fields, batch_size=batch_size)
+
+        self.stdout.write(f"{domain}: {len(ldap_users)} LDAP users found, {len(changed)} users updated, "
+                          f"{missing} users missing from LDAP.")
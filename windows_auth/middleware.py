@@ -1,15 +1,20 @@
+from typing import Optional
+
 from django.conf import settings
-from django.core.cache import cache
 from django.http import HttpResponse, HttpRequest
 from django.utils import timezone
 
 from windows_auth import logger
-from windows_auth.conf import WAUTH_RESYNC_DELTA, WAUTH_USE_CACHE, WAUTH_REQUIRE_RESYNC, WAUTH_ERROR_RESPONSE, \
-    WAUTH_SIMULATE_USER
+from windows_auth.circuit import LDAPCircuitOpenError
+from windows_auth.conf import WAUTH_RESYNC_DELTA, WAUTH_REQUIRE_RESYNC, WAUTH_ERROR_RESPONSE, WAUTH_SIMULATE_USER, \
+    WAUTH_RESYNC_BACKGROUND, WAUTH_USE_SESSION
 from windows_auth.models import LDAPUser
+from windows_auth.sync import get_sync_state, get_sync_pool, get_last_sync, sync_once, to_seconds, SYNC_STALE, \
+    SYNC_FRESH, SyncSkippedError, is_sync_failed, set_sync_failed
 
 
 class UserSyncMiddleware:
+    session_key = "_wauth_sync"
 
     def __init__(self, get_response):
         self.get_response = get_response
@@ -21,34 +26,39 @@ class UserSyncMiddleware:
         :return: HTTP Response
         """
 
-        if (request.user and request.user.is_authenticated
-                and LDAPUser.objects.filter(user=request.user).exists() and WAUTH_RESYNC_DELTA not in (None, False)):
+        if (request.user and request.user.is_authenticated and WAUTH_RESYNC_DELTA not in (None, False)
+                and not self.is_sync_checked(request)):
+            ldap_user = None
             try:
-                # convert timeout to seconds
-                if isinstance(WAUTH_RESYNC_DELTA, timezone.timedelta):
-                    timeout = WAUTH_RESYNC_DELTA.total_seconds()
-                else:
-                    timeout = int(WAUTH_RESYNC_DELTA)
-
-                ldap_user = LDAPUser.objects.get(user=request.user)
-
-                if WAUTH_USE_CACHE:
-                    # if cache does not exist
-                    cache_key = f"wauth_resync_user_{ldap_user.user.id}"
-                    if not cache.get(cache_key):
-                        ldap_user.sync()
-
-                        # create new cache key
-                        cache.set(cache_key, True, timeout)
+                ldap_user = LDAPUser.objects.filter(user=request.user).first()
+                if ldap_user is None:
+                    # not an LDAP user, or user is getting created the first time
+                    self.save_sync_check(request, timezone.now())
                 else:
-                    # check via database query
-                    if not ldap_user.last_sync or ldap_user.last_sync < timezone.now() - timezone.timedelta(seconds=timeout):
-                        ldap_user.sync()
-            except LDAPUser.DoesNotExist:
-                # user is getting created the first time
-                pass
+                    sync_state = get_sync_state(ldap_user)
+                    if sync_state != SYNC_FRESH and is_sync_failed(ldap_user):
+                        # do not wait for the server again, until the failure timeout
+                        raise SyncSkippedError(f"Re-sync of user {ldap_user} recently failed")
+                    elif sync_state == SYNC_STALE and WAUTH_RESYNC_BACKGROUND:
+                        # serve the user with current state, and re-sync in background
+                        if not get_sync_pool().submit(ldap_user):
+                            logger.debug(f"Background sync queue is full, skipping re-sync for user {ldap_user}")
+                    elif sync_state == SYNC_FRESH or sync_once(ldap_user):
+                        self.save_sync_check(request, get_last_sync(ldap_user))
+                    else:
+                        # sync was deferred to another process or by the sync limits, check again on next request
+                        logger.debug(f"User {ldap_user} was not synced, proceeding with current state")
             except Exception as e:
-                logger.exception(f"Failed to synchronize user {request.user} against LDAP")
+                if isinstance(e, SyncSkippedError):
+                    logger.debug(str(e))
+                elif isinstance(e, LDAPCircuitOpenError):
+                    # the domain is known to be unavailable, a stack trace adds nothing
+                    logger.warning(f"Failed to synchronize user {request.user} against LDAP: {e}")
+                else:
+                    logger.exception(f"Failed to synchronize user {request.user} against LDAP")
+                if ldap_user is not None and not isinstance(e, SyncSkippedError):
+                    set_sync_failed(ldap_user)
+
                 # return error response
                 if WAUTH_REQUIRE_RESYNC:
                     if isinstance(WAUTH_ERROR_RESPONSE, int):
@@ -60,6 +70,31 @@ class UserSyncMiddleware:
         response = self.get_response(request)
         return response
 
+    def is_sync_checked(self, request) -> bool:
+        """
+        Check the session for a re-sync deadline saved for the user, when WAUTH_USE_SESSION is configured.
+        """
+        if not WAUTH_USE_SESSION or not hasattr(request, "session"):
+            return False
+
+        sync_check = request.session.get(self.session_key)
+        return (sync_check is not None and sync_check.get("user") == request.user.pk
+                and sync_check.get("resync_at", 0) > timezone.now().timestamp())
+
+    def save_sync_check(self, request, last_sync: Optional[timezone.datetime]) -> None:
+        """
+        Save the next re-sync deadline for the user to the session, when WAUTH_USE_SESSION is configured.
+        :param last_sync: Time the user was last synced, no deadline is saved when the user was never synced
+        """
+        if not WAUTH_USE_SESSION or not hasattr(request, "session") or last_sync is None:
+            return
+
+        resync_at = last_sync + timezone.timedelta(seconds=to_seconds(WAUTH_RESYNC_DELTA))
+        request.session[self.session_key] = {
+            "user": request.user.pk,
+            "resync_at": resync_at.timestamp(),
+        }
+
 
 class SimulateWindowsAuthMiddleware:
 
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.5 on 2026-10-17 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('windows_auth', '0002_auto_20201205_2300'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ldapuser',
+            name='distinguished_name',
+            field=models.TextField(blank=True, default=None, help_text='Last known distinguished name of the LDAP User', null=True),
+        ),
+    ]
@@ -1,36 +1,110 @@
-from functools import lru_cache
-from typing import Union, Iterable, Optional, Dict
+import asyncio
+from threading import Lock
+from typing import Union, Iterable, Optional, Dict, Tuple, List
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User, Group
-from django.db import models
+from django.core.exceptions import ImproperlyConfigured
+from django.core.cache import cache
+from django.db import models, IntegrityError
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.forms import model_to_dict
 from django.utils import timezone
-from ldap3 import Reader, Entry, Attribute
+from ldap3 import Reader, Entry, Attribute, BASE
+from ldap3.utils.conv import escape_filter_chars
 
 from windows_auth import logger
 from windows_auth.conf import WAUTH_USE_CACHE, WAUTH_USE_SPN, WAUTH_LOWERCASE_USERNAME
-from windows_auth.ldap import LDAPManager, get_ldap_manager
+from windows_auth.entry_cache import get_entry_cache, CachedEntry, CachedAttribute, CachedReader, serialize_entry, \
+    has_attributes
+from windows_auth.group_graph import get_group_graph
+from windows_auth.groups import get_group_table, to_sid, GROUP_STRATEGY_IN_CHAIN, GROUP_STRATEGY_TOKEN_GROUPS, \
+    GROUP_STRATEGY_GRAPH
+from windows_auth.latency import OP_SEARCH_USER, OP_SEARCH_GROUPS
+from windows_auth.ldap import LDAPManager, get_ldap_manager, aget_ldap_manager
 from windows_auth.signals import ldap_user_sync
-from windows_auth.utils import LogExecutionTime
+from windows_auth.sync import get_resync_cache_key, get_resync_cache_timeout
+from windows_auth.timing import Timer
 
 
-def _match_groups(reader: Reader, groups: Optional[Union[Iterable[str], str]], attributes, default=False) -> bool:
+class GroupIndex:
     """
-    Check if at least one of the provided groups exists in a LDAP Reader for Groups.
-    :param reader: LDAP Reader for Groups
-    :param groups: One or more group names
-    :param attributes: List of attributes to check for comparing group's name
-    :param default: Default value when no group is provided.
-    :return: Boolean if exist
+    Case-insensitive index of the group attribute values of a LDAP Reader for Groups.
+    Built once per sync, so every group check is a single set lookup.
     """
-    if not groups:
-        return default
-    elif isinstance(groups, str):
-        return bool(reader.match(attributes, groups))
-    else:
-        return bool(any(reader.match(attributes, group) for group in groups))
+
+    def __init__(self, reader: Union[Reader, CachedReader], attributes: Union[Iterable[str], str]):
+        if isinstance(attributes, str):
+            attributes = [attributes]
+
+        self._values = set()
+        for entry in reader.entries:
+            for attribute in attributes:
+                if attribute in entry:
+                    self._values.update(_index_value(value) for value in entry[attribute].values)
+
+    def match(self, groups: Optional[Union[Iterable[str], str]], default=False) -> bool:
+        """
+        Check if at least one of the provided groups exists in the index.
+        :param groups: One or more group names
+        :param default: Default value when no group is provided.
+        :return: Boolean if exist
+        """
+        if not groups:
+            return default
+        elif isinstance(groups, str):
+            return _index_value(groups) in self._values
+        else:
+            return any(_index_value(group) in self._values for group in groups)
+
+    def __len__(self):
+        return len(self._values)
+
+
+def _index_value(value) -> str:
+    return str(value).lower()
+
+
+# process cache of local groups from GROUP_MAP settings, by name
+_local_groups: Dict[str, Group] = {}
+_local_groups_lock = Lock()
+
+
+@receiver([post_save, post_delete], sender=Group)
+def _clear_local_groups(**kwargs) -> None:
+    with _local_groups_lock:
+        _local_groups.clear()
+
+
+def get_local_groups(names: Iterable[str], domain: str) -> Dict[str, Group]:
+    """
+    Get Django Groups by name, creating missing groups.
+    Groups are cached in-process, and missing from cache are loaded using a single query.
+    :param names: Group names
+    :param domain: Domain the group names are configured for, used for logging
+    :return: Mapping of group name to Group
+    """
+    names = list(names)
+    with _local_groups_lock:
+        groups = {name: _local_groups[name] for name in names if name in _local_groups}
+
+    missing = [name for name in names if name not in groups]
+    if missing:
+        groups.update({group.name: group for group in Group.objects.filter(name__in=missing)})
+        for name in missing:
+            if name not in groups:
+                groups[name], created = Group.objects.get_or_create(name=name)
+                if created:
+                    logger.info(f"The group \"{name}\" from GROUP_MAP setting for domain {domain}"
+                                f" was not found and was created automatically.")
+
+        with _local_groups_lock:
+            _local_groups.update(groups)
+
+    return groups
 
 
 class LDAPUserManager(models.Manager):
@@ -69,9 +143,17 @@ class LDAPUser(models.Model):
     last_sync = models.DateTimeField(blank=True, null=True, default=None,
                                      help_text="Last time performed LDAP sync for user attributes and group membership")
 
+    distinguished_name = models.TextField(blank=True, null=True, default=None,
+                                          help_text="Last known distinguished name of the LDAP User")
+
     objects = LDAPUserManager()
 
-    _ldap_user_cache: Optional[Entry] = None
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the saved DN, for saving it only when changed
+        instance._saved_dn = instance.__dict__.get("distinguished_name")
+        return instance
 
     def get_ldap_manager(self) -> LDAPManager:
         return get_ldap_manager(self.domain)
@@ -83,65 +165,170 @@ class LDAPUser(models.Model):
         :param as_list: The attribute's value is a list
         :return: Value of attribute from the related LDAP User
         """
-        ldap_user = self.get_ldap_user()
-
-        # check if is already in default cached entry
-        if attribute not in ldap_user:
-            ldap_user = self.get_ldap_user(attributes=[attribute])
+        # request the default attributes too, so the cached entry stays useful for other attributes
+        manager = self.get_ldap_manager()
+        ldap_user = self.get_ldap_user(attributes=(*manager.settings.USER_FIELD_MAP.values(), attribute))
 
         if attribute not in ldap_user:
             raise AttributeError(f"User {self.user} does not have LDAP Attribute {attribute}")
 
-        attribute_obj: Attribute = getattr(ldap_user, attribute)
+        attribute_obj: Union[Attribute, CachedAttribute] = ldap_user[attribute]
         if as_list:
             return attribute_obj.values
         else:
             return attribute_obj.value
 
-    @lru_cache()
-    def get_ldap_user(self, attributes: Optional[Iterable[str]] = None) -> Entry:
+    def get_ldap_user(self, attributes: Optional[Iterable[str]] = None,
+                      use_cache: bool = True) -> Union[Entry, CachedEntry]:
         """
         Query LDAP for related user entry.
+        Entries are cached using the WAUTH_ENTRY_CACHE setting, a cached entry is used when it contains all
+        requested attributes.
         :param attributes: List of attributes to get
-        :return: ldap3 Entry of the related LDAP User
+        :param use_cache: Use a cached entry when available, otherwise always query LDAP
+        :return: ldap3 Entry of the related LDAP User, or a read-only CachedEntry
         """
-        # re-query when no cache available or is missing a requested attribute
         manager = self.get_ldap_manager()
+        attributes = list(attributes or manager.settings.USER_FIELD_MAP.values())
+        query_value = getattr(self.user, manager.settings.USER_QUERY_FIELD)
+
+        entry_cache = get_entry_cache()
+        cache_key = f"{self.domain}_{query_value}".lower()
+        cached = entry_cache.get(cache_key) if entry_cache is not None else None
+        if cached is not None:
+            if use_cache and has_attributes(cached, attributes):
+                return CachedEntry(cached)
+            # re-query cached attributes too, keeping the cached entry complete
+            attributes = list({
+                name.lower(): name
+                for name in (*cached["attributes"].keys(), *cached.get("missing", ()), *attributes)
+            }.values())
+
         username_ldap_field = manager.settings.USER_FIELD_MAP[manager.settings.USER_QUERY_FIELD]
         ldap_filter = {
             **manager.settings.USER_QUERY_FILTER,
-            username_ldap_field: getattr(self.user, manager.settings.USER_QUERY_FIELD)
+            username_ldap_field: query_value,
         }
-        user_reader = manager.get_reader(
-            "user",
-            ", ".join(f"{key}: {value}" for key, value in ldap_filter.items()),
-            attributes=attributes or manager.settings.USER_FIELD_MAP.values(),
-        )
-        with LogExecutionTime(f"Query LDAP User {self}"):
-            return user_reader.search()[0]
+        with manager.get_connection() as connection:
+            user_reader = manager.get_reader(
+                "user",
+                ", ".join(f"{key}: {value}" for key, value in ldap_filter.items()),
+                attributes=attributes,
+                connection=connection,
+            )
+            with Timer(OP_SEARCH_USER, self.domain, "Query LDAP User %s", self):
+                entry = user_reader.search()[0]
+
+        if entry_cache is not None:
+            entry_cache.set(cache_key, serialize_entry(entry, attributes))
+        return entry
+
+    async def aget_ldap_user(self, attributes: Optional[Iterable[str]] = None) -> Entry:
+        """
+        Asynchronous version of get_ldap_user.
+        The search runs in the domain's LDAP executor.
+        :param attributes: List of attributes to get
+        :return: ldap3 Entry of the related LDAP User
+        """
+        manager = await aget_ldap_manager(self.domain)
+        await self._aload_user()
+        return await manager.run_in_executor(self.get_ldap_user, attributes=attributes)
+
+    def get_ldap_dn(self) -> str:
+        """
+        Get the distinguished name of the related LDAP User.
+        The last known DN is used when available, otherwise LDAP is queried.
+        :return: DN of the related LDAP User
+        """
+        if self.distinguished_name:
+            return self.distinguished_name
+        return self.get_ldap_user().entry_dn
 
-    def get_ldap_groups(self, attributes: Optional[Iterable[str]] = None, preload: bool = True) -> Reader:
+    def get_ldap_groups(self, attributes: Optional[Iterable[str]] = None,
+                        preload: bool = True) -> Union[Reader, CachedReader]:
         """
         Get a reader for all groups this user is member of, recursively.
+        Membership is resolved using the GROUP_STRATEGY setting of the domain:
+        "in_chain" searches groups using the LDAP_MATCHING_RULE_IN_CHAIN filter,
+        "token_groups" reads the user's tokenGroups and resolves the SIDs using a cached group table,
+        "graph" expands the user's memberOf using the domain's group graph, falling back to "in_chain"
+        when the graph is missing some groups or attributes.
         See the docs https://docs.microsoft.com/en-us/windows/win32/adsi/search-filter-syntax?redirectedfrom=MSDN
         :param attributes: LDAP Group attributes to get
-        :param preload: Perform search automatically
-        :return: ldap3 Reader for the related LDAP Groups
+        :param preload: Perform search automatically, "token_groups" strategy is always searched
+        :return: ldap3 Reader for the related LDAP Groups, or a read-only CachedReader
         """
         manager = self.get_ldap_manager()
-        user_dn = self.get_ldap_attr("distinguishedName")
-        reader = manager.get_reader(
-            "group",
-            f"(member:1.2.840.113556.1.4.1941:={user_dn})",
-            attributes=attributes or manager.settings.GROUP_ATTRS
-        )
+        attributes = attributes or manager.settings.GROUP_ATTRS
+        strategy = manager.settings.GROUP_STRATEGY
+
+        if strategy == GROUP_STRATEGY_TOKEN_GROUPS:
+            if isinstance(attributes, str):
+                attributes = [attributes]
+            groups = get_group_table(manager).resolve(self.get_token_groups(), attributes)
+            return CachedReader([CachedEntry(group) for group in groups])
+        elif strategy == GROUP_STRATEGY_GRAPH:
+            graph = get_group_graph(manager)
+            if graph.has_attributes(attributes):
+                try:
+                    member_of = self.get_ldap_attr("memberOf", as_list=True)
+                except AttributeError:
+                    # user is not a member of any group, other than the primary group
+                    member_of = []
+                groups = graph.get_groups(member_of)
+                if groups is not None:
+                    return CachedReader([CachedEntry(group) for group in groups])
+        elif strategy != GROUP_STRATEGY_IN_CHAIN:
+            raise ImproperlyConfigured(f"Unknown GROUP_STRATEGY \"{strategy}\" for domain {self.domain}")
+
+        user_dn = self.get_ldap_dn()
+        query = f"(member:1.2.840.113556.1.4.1941:={escape_filter_chars(user_dn)})"
+
+        if not preload:
+            # the reader will be searched later, outside of a pooled connection checkout
+            return manager.get_reader("group", query, attributes=attributes)
+
         # search groups
-        if preload:
-            with LogExecutionTime(f"Query LDAP Group membership for user {self}"):
+        with manager.get_connection() as connection:
+            reader = manager.get_reader("group", query, attributes=attributes, connection=connection)
+            with Timer(OP_SEARCH_GROUPS, self.domain, "Query LDAP Group membership for user %s", self):
                 reader.search()
 
         return reader
 
+    def get_token_groups(self) -> List[str]:
+        """
+        Read the SIDs of all groups this user is member of, recursively, from the constructed tokenGroups attribute.
+        Includes the user's primary group.
+        :return: List of group SIDs
+        """
+        manager = self.get_ldap_manager()
+        user_dn = self.get_ldap_dn()
+
+        # tokenGroups can only be read using a base scope search
+        with manager.get_connection() as connection:
+            with Timer(OP_SEARCH_GROUPS, self.domain, "Read LDAP tokenGroups for user %s", self):
+                connection.search(user_dn, "(objectClass=*)", BASE, attributes=["tokenGroups"])
+            if not connection.entries or "tokenGroups" not in connection.entries[0]:
+                return []
+            return [to_sid(value) for value in connection.entries[0]["tokenGroups"].values]
+
+    async def aget_ldap_groups(self, attributes: Optional[Iterable[str]] = None) -> Union[Reader, CachedReader]:
+        """
+        Asynchronous version of get_ldap_groups.
+        The search runs in the domain's LDAP executor.
+        :param attributes: LDAP Group attributes to get
+        :return: ldap3 Reader for the related LDAP Groups
+        """
+        manager = await aget_ldap_manager(self.domain)
+        await self._aload_user()
+        return await manager.run_in_executor(self.get_ldap_groups, attributes=attributes)
+
+    async def _aload_user(self) -> None:
+        # load the related user in advance, avoiding DB queries from the LDAP executor threads
+        if not self._meta.get_field("user").is_cached(self):
+            await sync_to_async(getattr)(self, "user")
+
     def sync(self) -> None:
         """
         Synchronizes Django User against related LDAP User.
@@ -153,14 +340,82 @@ class LDAPUser(models.Model):
         :return: None
         """
         logger.info(f"Syncing LDAP User {self}")
-        manager = self.get_ldap_manager()
+        ldap_user, group_reader = self._query_ldap()
+        self._update_user(ldap_user, group_reader)
+
+    async def async_sync(self) -> None:
+        """
+        Asynchronous version of sync.
+        LDAP searches run in the domain's LDAP executor, database updates run using sync_to_async.
+        :return: None
+        """
+        logger.info(f"Syncing LDAP User {self}")
+        manager = await aget_ldap_manager(self.domain)
+        await self._aload_user()
+
+        if self._can_pipeline():
+            ldap_user, group_reader = await asyncio.gather(
+                manager.run_in_executor(self._query_user),
+                manager.run_in_executor(self.get_ldap_groups),
+            )
+            if not self._is_same_dn(ldap_user):
+                group_reader = await manager.run_in_executor(self._query_groups, ldap_user)
+        else:
+            ldap_user = await manager.run_in_executor(self._query_user)
+            group_reader = await manager.run_in_executor(self._query_groups, ldap_user)
+
+        await sync_to_async(self._update_user)(ldap_user, group_reader)
 
-        # query user
-        # add distinguishedName to user query to be used in group query and avoid two user queries
-        ldap_user = self.get_ldap_user(attributes=("distinguishedName", *manager.settings.USER_FIELD_MAP.values()))
+    def _query_ldap(self) -> Tuple[Entry, Union[Reader, CachedReader]]:
+        """
+        Search the related LDAP User and its group membership.
+        When the user's DN is already known, the group search runs concurrently with the user search
+        on another pooled connection.
+        :return: Tuple of the LDAP User entry and group Reader
+        """
+        if self._can_pipeline():
+            # load the related user in advance, avoiding DB queries from the LDAP executor threads
+            getattr(self, "user")
+            group_future = self.get_ldap_manager().submit(self.get_ldap_groups)
+            ldap_user = self._query_user()
+            group_reader = group_future.result()
+            if not self._is_same_dn(ldap_user):
+                group_reader = self._query_groups(ldap_user)
+        else:
+            ldap_user = self._query_user()
+            group_reader = self._query_groups(ldap_user)
 
-        # query groups
-        group_reader = self.get_ldap_groups()
+        return ldap_user, group_reader
+
+    def _can_pipeline(self) -> bool:
+        # the "graph" strategy requires memberOf from the user search
+        return bool(self.distinguished_name) \
+            and self.get_ldap_manager().settings.GROUP_STRATEGY != GROUP_STRATEGY_GRAPH
+
+    def _is_same_dn(self, ldap_user: Entry) -> bool:
+        return (self.distinguished_name or "").lower() == ldap_user.entry_dn.lower()
+
+    def _query_user(self) -> Entry:
+        manager = self.get_ldap_manager()
+        # add distinguishedName and memberOf to user query to be used in group query and avoid two user queries
+        attributes = ["distinguishedName", *manager.settings.USER_FIELD_MAP.values()]
+        if manager.settings.GROUP_STRATEGY == GROUP_STRATEGY_GRAPH:
+            attributes.append("memberOf")
+        return self.get_ldap_user(attributes=attributes, use_cache=False)
+
+    def _query_groups(self, ldap_user: Entry) -> Union[Reader, CachedReader]:
+        # user was renamed or moved, the DN is saved by _update_user
+        self.distinguished_name = ldap_user.entry_dn
+        return self.get_ldap_groups()
+
+    def _update_user(self, ldap_user: Entry, group_reader: Union[Reader, CachedReader]) -> None:
+        """
+        Apply the LDAP User fields, flags and group membership to the Django User.
+        :param ldap_user: ldap3 Entry of the related LDAP User
+        :param group_reader: ldap3 Reader for the related LDAP Groups
+        """
+        manager = self.get_ldap_manager()
+        group_index = GroupIndex(group_reader, manager.settings.GROUP_ATTRS)
 
         # calculate new fields
         updated_fields = {
@@ -172,49 +427,73 @@ class LDAPUser(models.Model):
         # check user flags
         for flag, groups in manager.settings.get_flag_map().items():
             if groups:
-                updated_fields[flag] = _match_groups(group_reader, groups, manager.settings.GROUP_ATTRS)
+                updated_fields[flag] = group_index.match(groups)
 
         # check group membership
-        group_membership: Dict[Group, bool] = {}
-        for local_group_name, remote_groups in manager.settings.GROUP_MAP.items():
-            # get group model object
-            local_group, created = Group.objects.get_or_create(name=local_group_name)
-
-            if created:
-                logger.info(f"The group \"{local_group_name}\" from GROUP_MAP setting for domain {self.domain}"
-                            f" was not found and was created automatically.")
-
-            # check if user supposes to me a member
-            group_membership[local_group] = _match_groups(group_reader, remote_groups, manager.settings.GROUP_ATTRS)
-
-        # add to groups
-        self.user.groups.add(*(
-            local_group
-            for local_group, membership_check in group_membership.items()
-            if membership_check
-        ))
-
-        # remove from groups
-        self.user.groups.remove(*(
-            local_group
-            for local_group, membership_check in group_membership.items()
-            if not membership_check
-        ))
+        group_membership = {
+            local_group_name: group_index.match(remote_groups)
+            for local_group_name, remote_groups in manager.settings.GROUP_MAP.items()
+        }
+        if group_membership:
+            self._update_groups(group_membership)
 
         # update changed fields for user
         current_fields = model_to_dict(self.user, fields=updated_fields.keys())
         if current_fields != updated_fields:
-            with LogExecutionTime(f"Perform field updates for user {self}"):
+            with Timer("update_user", self.domain, "Perform field updates for user %s", self):
                 get_user_model().objects.filter(pk=self.user.pk).update(**updated_fields)
+            for field, value in updated_fields.items():
+                setattr(self.user, field, value)
 
         # send signals
         ldap_user_sync.send(self, ldap_user=ldap_user, group_reader=group_reader)
 
         # update sync time
-        if not WAUTH_USE_CACHE:
-            with LogExecutionTime(f"Save LDAP User {self}"):
+        self.distinguished_name = ldap_user.entry_dn
+        if WAUTH_USE_CACHE:
+            cache.set(get_resync_cache_key(self.user_id), timezone.now(), get_resync_cache_timeout())
+            if self.distinguished_name != getattr(self, "_saved_dn", None):
+                with Timer("save_ldap_user", self.domain, "Save LDAP User %s", self):
+                    self.save()
+        else:
+            with Timer("save_ldap_user", self.domain, "Save LDAP User %s", self):
                 self.last_sync = timezone.now()
                 self.save()
+        self._saved_dn = self.distinguished_name
+
+    def _update_groups(self, group_membership: Dict[str, bool]) -> None:
+        """
+        Apply group membership to the Django User, modifying only the groups that changed.
+        :param group_membership: Mapping of local group name to whether the user should be a member
+        """
+        local_groups = get_local_groups(group_membership.keys(), self.domain)
+        membership = self.user.groups.through
+        current = set(membership.objects.filter(
+            user_id=self.user_id,
+            group_id__in=[group.pk for group in local_groups.values()],
+        ).values_list("group_id", flat=True))
+
+        added = [
+            local_groups[name].pk
+            for name, membership_check in group_membership.items()
+            if membership_check and local_groups[name].pk not in current
+        ]
+        removed = [
+            local_groups[name].pk
+            for name, membership_check in group_membership.items()
+            if not membership_check and local_groups[name].pk in current
+        ]
+
+        try:
+            # related manager operations send the m2m_changed signal
+            if added:
+                self.user.groups.add(*added)
+            if removed:
+                self.user.groups.remove(*removed)
+        except IntegrityError:
+            # a cached group was probably deleted by another process
+            _clear_local_groups()
+            raise
 
     def __str__(self):
         if WAUTH_USE_SPN:
@@ -1,18 +1,169 @@
 import json
+import os
+import random
+import sys
+import threading
+from collections import deque
 from functools import wraps
+from time import perf_counter_ns
+from traceback import StackSummary, walk_stack
+from typing import Dict, Deque, Any, Optional, List, Tuple
 
 from debug_toolbar.panels import Panel
-from debug_toolbar.utils import ThreadCollector, tidy_stacktrace, get_stack, render_stacktrace
+from debug_toolbar.utils import tidy_stacktrace, get_stack, render_stacktrace, omit_path
 from debug_toolbar import settings as dt_settings
 from django.utils import timezone
 from django.utils.functional import cached_property
+from ldap3 import Connection
 from ldap3.utils.conv import format_json
 
-from windows_auth.ldap import _ldap_connections
+from windows_auth.conf import WAUTH_PANEL_MAX_OPERATIONS, WAUTH_PANEL_MAX_ENTRIES, WAUTH_PANEL_STACKTRACE_RATE
+from windows_auth.ldap import _ldap_connections, get_origin_thread
+from windows_auth.signals import ldap_connection_created
+from windows_auth.timing import Timing, subscribe, unsubscribe
 from windows_auth.utils import camel_case_split
 
 
-collector = ThreadCollector()
+class RingCollector:
+    """
+    Per-thread collection of the latest items, dropping the oldest items when full.
+    Items collected by LDAP executor threads are collected for the thread that submitted the work.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.collections: Dict[threading.Thread, Deque] = {}
+        self.dropped: Dict[threading.Thread, int] = {}
+        self._lock = threading.Lock()
+
+    def get_collection(self, thread: Optional[threading.Thread] = None) -> Deque:
+        if thread is None:
+            thread = get_origin_thread()
+        collection = self.collections.get(thread)
+        if collection is None:
+            with self._lock:
+                collection = self.collections.setdefault(thread, deque(maxlen=self.max_size))
+        return collection
+
+    def get_dropped(self, thread: Optional[threading.Thread] = None) -> int:
+        return self.dropped.get(thread or get_origin_thread(), 0)
+
+    def clear_collection(self, thread: Optional[threading.Thread] = None) -> None:
+        if thread is None:
+            thread = get_origin_thread()
+        self.collections.pop(thread, None)
+        self.dropped.pop(thread, None)
+
+    def collect(self, item, thread: Optional[threading.Thread] = None) -> None:
+        if thread is None:
+            thread = get_origin_thread()
+        collection = self.get_collection(thread)
+        # executor threads may collect for the same thread concurrently
+        with self._lock:
+            if len(collection) == collection.maxlen:
+                self.dropped[thread] = self.dropped.get(thread, 0) + 1
+            collection.append(item)
+
+
+class TimingCollector:
+    """
+    Per-thread summary of the timers measured during a request, by domain and timer name.
+    Timers measured by LDAP executor threads are summarized for the thread that submitted the work.
+    """
+
+    def __init__(self):
+        # (domain, name) -> [count, total_ns, max_ns]
+        self.summaries: Dict[threading.Thread, Dict[Tuple[Optional[str], str], List[int]]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, timing: Timing) -> None:
+        with self._lock:
+            summary = self.summaries.setdefault(get_origin_thread(), {})
+            stats = summary.setdefault((timing.domain, timing.name), [0, 0, 0])
+            stats[0] += 1
+            stats[1] += timing.duration_ns
+            stats[2] = max(stats[2], timing.duration_ns)
+
+    def get_summary(self, domain: Optional[str], thread: Optional[threading.Thread] = None) -> List[Dict[str, Any]]:
+        summary = self.summaries.get(thread or get_origin_thread(), {})
+        return [
+            {
+                "name": name,
+                "count": count,
+                "total": timezone.timedelta(microseconds=total_ns / 1000),
+                "max": timezone.timedelta(microseconds=max_ns / 1000),
+            }
+            for (timing_domain, name), (count, total_ns, max_ns) in sorted(summary.items(), key=lambda item: item[0][1])
+            if timing_domain == domain
+        ]
+
+    def clear_summary(self, thread: Optional[threading.Thread] = None) -> None:
+        self.summaries.pop(thread or get_origin_thread(), None)
+
+
+collector = RingCollector(WAUTH_PANEL_MAX_OPERATIONS)
+timing_collector = TimingCollector()
+
+
+def capture_stack() -> Optional[StackSummary]:
+    """
+    Capture the current stack for a sample of the operations, the source lines are read only when rendered.
+    """
+    if not dt_settings.get_config()['ENABLE_STACKTRACES'] or random.random() >= WAUTH_PANEL_STACKTRACE_RATE:
+        return None
+
+    # cut the first 7 frames, exactly until the original operation call
+    if dt_settings.get_config()['ENABLE_STACKTRACES_LOCALS']:
+        # frame locals require the full frame records
+        return tidy_stacktrace(reversed(get_stack()[7:]))
+
+    stack = StackSummary.extract(walk_stack(sys._getframe(7)), lookup_lines=False)
+    stack.reverse()
+    return stack
+
+
+class EntryInfo:
+    """
+    Response entry of a collected LDAP Operation, serialized only when rendered
+    """
+
+    def __init__(self, entry: Dict[str, Any]):
+        self.entry = entry
+
+    def __getitem__(self, item):
+        return self.entry[item]
+
+    def get(self, key, default=None):
+        return self.entry.get(key, default)
+
+    def __getattr__(self, item):
+        # template access to the response entry fields
+        if item.startswith("_") or item not in self.entry:
+            raise AttributeError(item)
+        return self.entry[item]
+
+    @cached_property
+    def json(self) -> str:
+        try:
+            if self.entry.get("type") == "searchResEntry":
+                return json.dumps({
+                    "dn": self.entry.get("dn"),
+                    "type": self.entry.get("type"),
+                    "attributes": dict(self.entry.get("attributes")),
+                }, indent=4, default=format_json)
+            else:
+                return json.dumps(self.entry, indent=4, default=format_json)
+        except TypeError:
+            return "Failed to serialize entry"
+
+    @cached_property
+    def template(self) -> str:
+        if self.entry.get("type") == "searchResEntry":
+            return "windows_auth/panel/search_entry.html"
+        elif self.entry.get("type") in ("modifyResponse", "addResponse", "delResponse", "modDNResponse"):
+            return "windows_auth/panel/modify_entry.html"
+        else:
+            return "windows_auth/panel/entry_base.html"
 
 
 class OperationInfo:
@@ -24,16 +175,16 @@ class OperationInfo:
         self.domain = domain
         self.request = request
         self.result = result
-        self.response = response
         self.start_time = start_time
         self.end_time = end_time
 
-        if dt_settings.get_config()['ENABLE_STACKTRACES']:
-            # cut the first 6 lines, exactly until the original operation call
-            self.raw_stacktrace = tidy_stacktrace(reversed(get_stack()[6:]))
-        else:
-            self.raw_stacktrace = []
-            
+        # keep only the first entries of large responses
+        response = [entry for entry in response or () if entry.get("type") not in ("searchResRef", )]
+        self.entry_count = len(response)
+        self.response = response[:WAUTH_PANEL_MAX_ENTRIES]
+
+        self.raw_stacktrace = capture_stack()
+
     @cached_property
     def title(self) -> str:
         req_type = self.request.get("type")
@@ -54,45 +205,23 @@ class OperationInfo:
 
     @cached_property
     def stacktrace(self) -> str:
+        if not self.raw_stacktrace:
+            return ""
+        if isinstance(self.raw_stacktrace, StackSummary):
+            return render_stacktrace([
+                (frame.filename, frame.lineno, frame.name, (frame.line or "").strip(), None)
+                for frame in self.raw_stacktrace
+                if not omit_path(os.path.realpath(frame.filename))
+            ])
         return render_stacktrace(self.raw_stacktrace)
 
     @cached_property
     def time_elapsed(self) -> timezone.timedelta:
-        return self.end_time - self.start_time
+        return timezone.timedelta(microseconds=(self.end_time - self.start_time) / 1000)
 
     @cached_property
-    def entries(self) -> list:
-        result = []
-        for entry in self.response:
-            if entry.get("type") not in ("searchResRef", ):
-                # entry json serialization
-                try:
-                    if entry.get("type") == "searchResEntry":
-                        entry["json"] = json.dumps({
-                            "dn": entry.get("dn"),
-                            "type": entry.get("type"),
-                            "attributes": dict(entry.get("attributes"))
-                        }, indent=4, default=format_json)
-                    else:
-                        entry["json"] = json.dumps(entry, indent=4, default=format_json)
-                except TypeError:
-                    entry["json"] = "Failed to serialize entry"
-
-                # template
-                if entry.get("type") == "searchResEntry":
-                    entry["template"] = "windows_auth/panel/search_entry.html"
-                elif entry.get("type") in ("modifyResponse", "addResponse", "delResponse", "modDNResponse"):
-                    entry["template"] = "windows_auth/panel/modify_entry.html"
-                else:
-                    entry["template"] = "windows_auth/panel/entry_base.html"
-
-                result.append(entry)
-
-        return result
-
-    @cached_property
-    def entry_count(self) -> int:
-        return len(self.entries)
+    def entries(self) -> List[EntryInfo]:
+        return [EntryInfo(entry) for entry in self.response]
 
     @cached_property
     def result_description(self) -> str:
@@ -190,9 +319,10 @@ def get_response_decorator(func, domain: str):
 
     @wraps(func)
     def wrapper(message_id, timeout=None, get_request=False):
-        start_time = timezone.now()
+        start_time = perf_counter_ns()
         # always ask for request too
         response, result, request = func(message_id, timeout=timeout, get_request=True)
+        end_time = perf_counter_ns()
 
         collector.collect(OperationInfo(
             domain,
@@ -200,7 +330,7 @@ def get_response_decorator(func, domain: str):
             result,
             request,
             start_time=start_time,
-            end_time=timezone.now(),
+            end_time=end_time,
         ))
 
         # mimic the original logic about get_request
@@ -213,6 +343,31 @@ def get_response_decorator(func, domain: str):
     return wrapper
 
 
+def instrument_connection(connection: Connection, domain: str) -> None:
+    """
+    Wrap LDAP connection strategy's get_response to collect operation info.
+    """
+    strategy = connection.strategy
+    if not hasattr(strategy.get_response, "original"):
+        strategy.get_response = get_response_decorator(strategy.get_response, domain)
+
+
+def uninstrument_connection(connection: Connection) -> None:
+    strategy = connection.strategy
+    if hasattr(strategy.get_response, "original"):
+        strategy.get_response = strategy.get_response.original
+
+
+def _on_connection_created(sender, domain: str, connection: Connection, **kwargs) -> None:
+    # connections created lazily by the pool, or replacing stale connections during the request
+    instrument_connection(connection, domain)
+
+
+# number of requests with instrumentation enabled, connections are instrumented until the last one is done
+_instrumented_requests = 0
+_instrumented_requests_lock = threading.Lock()
+
+
 class LDAPPanel(Panel):
     title = "LDAP Connection Tracing"
     nav_title = "LDAP"
@@ -220,29 +375,67 @@ class LDAPPanel(Panel):
     has_content = True
 
     def enable_instrumentation(self):
-        # wrap LDAP connection strategy's get_response to collect operation info
-        for domain, manager in _ldap_connections.items():
-            strategy = manager.connection.strategy
-            strategy.get_response = get_response_decorator(strategy.get_response, domain)
+        global _instrumented_requests
+        with _instrumented_requests_lock:
+            _instrumented_requests += 1
+            ldap_connection_created.connect(_on_connection_created, dispatch_uid="wauth_ldap_panel")
+            for domain, manager in list(_ldap_connections.items()):
+                for connection in manager.get_connections():
+                    instrument_connection(connection, domain)
+        subscribe(timing_collector)
 
     def disable_instrumentation(self):
-        # unwrap the connection
-        for domain, manager in _ldap_connections.items():
-            strategy = manager.connection.strategy
-            if hasattr(strategy.get_response, "original"):
-                strategy.get_response = strategy.get_response.original
+        global _instrumented_requests
+        with _instrumented_requests_lock:
+            _instrumented_requests -= 1
+            if _instrumented_requests > 0:
+                return
+            unsubscribe(timing_collector)
+            ldap_connection_created.disconnect(dispatch_uid="wauth_ldap_panel")
+            for manager in list(_ldap_connections.values()):
+                for connection in manager.get_connections():
+                    uninstrument_connection(connection)
 
     def generate_stats(self, request, response):
+        operations = list(collector.get_collection())
         self.record_stats({
+            "max_operations": collector.max_size,
+            "dropped_operations": collector.get_dropped(),
             "domains": {
                 domain: {
                     "manager": manager,
                     "usage": manager.get_usage(),
-                    "operations": collector.get_collection(),
+                    "operations": [operation for operation in operations if operation.domain == domain],
+                    "summary": self._get_summary(domain, operations),
+                    "timings": timing_collector.get_summary(domain),
                 }
                 for domain, manager in _ldap_connections.items()
             }
         })
+        timing_collector.clear_summary()
         # reserve LDAP operations from unsuccessful requests or non GET requests
         if request.method == "GET" and response.status_code < 300:
             collector.clear_collection()
+
+    @staticmethod
+    def _get_summary(domain: str, operations: List[OperationInfo]) -> Dict[str, Any]:
+        """
+        Timing summary of a domain's collected operations
+        """
+        operations = [operation for operation in operations if operation.domain == domain]
+        elapsed = [operation.end_time - operation.start_time for operation in operations]
+        return {
+            "count": len(operations),
+            "total": timezone.timedelta(microseconds=sum(elapsed) / 1000),
+            "max": timezone.timedelta(microseconds=max(elapsed, default=0) / 1000),
+            "entries": sum(operation.entry_count for operation in operations),
+        }
+
+    @property
+    def nav_subtitle(self):
+        stats = self.get_stats()
+        if not stats:
+            return ""
+        count = sum(info["summary"]["count"] for info in stats["domains"].values())
+        total = sum((info["summary"]["total"] for info in stats["domains"].values()), timezone.timedelta())
+        return f"{count} operations in {total.total_seconds() * 1000:.2f}ms"
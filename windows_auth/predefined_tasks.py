@@ -55,6 +55,19 @@ def clean_old_history_task(**options):
                   **_get_options(options, "folder", "username", "password"))
 
 
+def rollup_ldap_usage_task(**options):
+    """
+    Roll up and prune LDAP usage metrics every hour (from windows_auth.ldap_metrics).
+    """
+    interval = options.get("interval") or timezone.timedelta(hours=1)
+    task_def = create_task_definition("rollupldapusage",
+                                      description=options.get("desc") or "Roll up and prune LDAP usage metrics",
+                                      **_get_options(options, "priority", "timeout"))
+    add_schedule_trigger(task_def, interval)
+    register_task(task_def, options.get("name") or "Roll up LDAP usage",
+                  **_get_options(options, "folder", "username", "password"))
+
+
 def process_tasks_task(**options):
     """
     Worker for background tasks processing (from django-background-tasks)
@@ -0,0 +1,252 @@
+import math
+import os
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Optional, Dict, Iterator, Tuple
+
+from django.core.cache import cache
+from ldap3.core.exceptions import LDAPException
+
+from windows_auth.conf import WAUTH_SYNC_LOCK_TIMEOUT
+
+# time (seconds) between attempts of a blocking acquire waiting for a concurrency slot
+RATE_LIMIT_POLL_INTERVAL = 0.01
+
+
+class LDAPSyncRateLimitError(LDAPException):
+    """
+    No sync permit became available for the domain before the timeout.
+    """
+
+
+class TokenBucket:
+    """
+    In-process token bucket, refilled at a constant rate up to its capacity.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """
+        :param rate: Tokens added per second
+        :param capacity: Maximum tokens, the allowed burst, defaults to one second of tokens (at least 1)
+        """
+        self.rate = rate
+        # a capacity below a single token would never allow taking one
+        self.capacity = max(capacity if capacity is not None else rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = Lock()
+
+    def take(self) -> float:
+        """
+        Take a token.
+        :return: 0 when a token was taken, otherwise the time (seconds) until a token is available
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def give_back(self) -> None:
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + 1)
+
+
+class SyncRateLimiter:
+    """
+    Limit the rate and concurrency of user syncs against the LDAP server of a domain.
+
+    The limits are applied in-process, and when shared across all processes using the Django cache.
+    Shared rate limits count syncs in fixed time windows, as the cache has no atomic token bucket.
+    """
+
+    def __init__(self, domain: str, rate: Optional[float] = None, burst: Optional[int] = None,
+                 max_concurrent: Optional[int] = None, shared: bool = False):
+        """
+        :param domain: Domain of the limited syncs
+        :param rate: Maximum syncs per second, None for no limit
+        :param burst: Maximum syncs at once after an idle period, defaults to one second of syncs
+        :param max_concurrent: Maximum syncs running at the same time, None for no limit
+        :param shared: Apply the limits across processes using the Django cache
+        """
+        self.domain = domain
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.shared = shared
+        self._bucket = TokenBucket(rate, burst) if rate else None
+        self._running = 0
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.rate) or self.max_concurrent is not None
+
+    @property
+    def running(self) -> int:
+        """
+        Number of syncs running in this process.
+        """
+        return self._running
+
+    @property
+    def concurrency_cache_key(self) -> str:
+        return f"wauth_sync_running_{self.domain}"
+
+    def _window(self) -> Tuple[str, int, float]:
+        # shared rate window: at least one second, and long enough for a single sync
+        seconds = max(1.0, 1.0 / self.rate)
+        window = math.floor(time.time() / seconds)
+        return f"wauth_sync_rate_{self.domain}_{window}", max(1, int(self.rate * seconds)), seconds
+
+    @staticmethod
+    def _cache_incr(key: str, timeout: float) -> int:
+        cache.add(key, 0, math.ceil(timeout))
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # expired between add and incr
+            cache.set(key, 1, math.ceil(timeout))
+            return 1
+
+    @staticmethod
+    def _cache_decr(key: str) -> None:
+        try:
+            if cache.decr(key) < 0:
+                cache.set(key, 0)
+        except ValueError:
+            pass
+
+    def _acquire_slot(self) -> bool:
+        if self.max_concurrent is None:
+            return True
+
+        with self._lock:
+            if self._running >= self.max_concurrent:
+                return False
+            self._running += 1
+
+        if self.shared:
+            # expires when processes die while syncing, the running syncs are done by then
+            if self._cache_incr(self.concurrency_cache_key, WAUTH_SYNC_LOCK_TIMEOUT) > self.max_concurrent:
+                self._cache_decr(self.concurrency_cache_key)
+                self._release_slot(shared=False)
+                return False
+        return True
+
+    def _release_slot(self, shared: bool = True) -> None:
+        if self.max_concurrent is None:
+            return
+
+        with self._lock:
+            self._running = max(self._running - 1, 0)
+        if shared and self.shared:
+            self._cache_decr(self.concurrency_cache_key)
+
+    def _take_token(self) -> float:
+        if not self.rate:
+            return 0.0
+
+        wait = self._bucket.take()
+        if wait or not self.shared:
+            return wait
+
+        key, limit, seconds = self._window()
+        if self._cache_incr(key, seconds * 2) > limit:
+            self._bucket.give_back()
+            return seconds - time.time() % seconds
+        return 0.0
+
+    def try_acquire(self) -> float:
+        """
+        Acquire a sync permit without waiting.
+        :return: 0 when acquired, otherwise the time (seconds) to wait before trying again
+        """
+        if not self._acquire_slot():
+            return RATE_LIMIT_POLL_INTERVAL
+
+        wait = self._take_token()
+        if wait:
+            self._release_slot()
+        return wait
+
+    def acquire(self, timeout: Optional[float] = 0) -> bool:
+        """
+        Acquire a sync permit, must be released using release() after the sync.
+        :param timeout: Time (seconds) to wait for a permit, 0 to return immediately, None to wait forever
+        :return: True when acquired
+        """
+        if not self.enabled:
+            return True
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return True
+
+            remaining = deadline - time.monotonic() if deadline is not None else wait
+            if remaining <= 0:
+                return False
+            time.sleep(min(wait, remaining))
+
+    def release(self) -> None:
+        if self.enabled:
+            self._release_slot()
+
+    @contextmanager
+    def limit(self, timeout: Optional[float] = None) -> Iterator[None]:
+        """
+        Hold a sync permit for the duration of the block, waiting for it up to the timeout.
+        :param timeout: Time (seconds) to wait for a permit, None to wait forever
+        :raises LDAPSyncRateLimitError: No permit became available before the timeout
+        """
+        if not self.acquire(timeout):
+            raise LDAPSyncRateLimitError(f"Timed out waiting for a sync permit of domain {self.domain}")
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _after_fork(self) -> None:
+        self._lock = Lock()
+        self._running = 0
+        if self._bucket is not None:
+            self._bucket._lock = Lock()
+
+
+_sync_limiters: Dict[str, SyncRateLimiter] = {}
+_sync_limiters_lock = Lock()
+
+
+def get_sync_limiter(domain: str, rate: Optional[float] = None, burst: Optional[int] = None,
+                     max_concurrent: Optional[int] = None, shared: bool = False) -> SyncRateLimiter:
+    """
+    Get or create the sync rate limiter of a domain, replaced when its limits changed.
+    :param domain: Domain NetBIOS name
+    :param rate: Maximum syncs per second, None for no limit
+    :param burst: Maximum syncs at once after an idle period
+    :param max_concurrent: Maximum syncs running at the same time, None for no limit
+    :param shared: Apply the limits across processes using the Django cache
+    """
+    with _sync_limiters_lock:
+        limiter = _sync_limiters.get(domain)
+        if limiter is None or (limiter.rate, limiter.burst, limiter.max_concurrent, limiter.shared) != \
+                (rate, burst, max_concurrent, shared):
+            limiter = _sync_limiters[domain] = SyncRateLimiter(domain, rate, burst, max_concurrent, shared)
+        return limiter
+
+
+def _reset_locks_after_fork():
+    global _sync_limiters_lock
+    _sync_limiters_lock = Lock()
+    for limiter in _sync_limiters.values():
+        limiter._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks_after_fork)
@@ -0,0 +1,101 @@
+import json
+import os
+import time
+from typing import Optional
+
+from ldap3 import Connection, BASE
+from ldap3.protocol.rfc4512 import DsaInfo, SchemaInfo
+
+from windows_auth import logger
+
+# version of the cache file format
+SCHEMA_CACHE_VERSION = 1
+
+
+class CachedSchema:
+    """
+    Server info and schema loaded from the schema cache file.
+    """
+
+    def __init__(self, info: Optional[DsaInfo], schema: SchemaInfo, schema_version: Optional[str], saved_at: float):
+        self.info = info
+        self.schema = schema
+        self.schema_version = schema_version
+        self.saved_at = saved_at
+
+    def is_stale(self, timeout: Optional[float]) -> bool:
+        return timeout is not None and time.time() - self.saved_at > timeout
+
+
+def get_schema_cache_path(directory: str, domain: str) -> str:
+    return os.path.join(directory, f"wauth_schema_{domain}.json")
+
+
+def read_schema_version(connection: Connection, schema: SchemaInfo) -> Optional[str]:
+    """
+    Read the version of the server's schema, using the modifyTimestamp of the subschema entry.
+    :param connection: Bound connection to the server
+    :param schema: Current schema of the server
+    :return: Schema version, None when it is not available
+    """
+    schema_entry = schema.schema_entry[0] if isinstance(schema.schema_entry, (list, tuple)) else schema.schema_entry
+    if not schema_entry:
+        return None
+
+    connection.search(schema_entry, "(objectClass=subschema)", BASE, attributes=["modifyTimestamp"])
+    for response in connection.response or ():
+        values = response.get("raw_attributes", {}).get("modifyTimestamp")
+        if values:
+            value = values[0]
+            return value.decode() if isinstance(value, bytes) else str(value)
+    return None
+
+
+def load_schema_cache(path: str, server: str) -> Optional[CachedSchema]:
+    """
+    Load the server info and schema from a cache file.
+    :param path: Cache file path
+    :param server: Server the schema is cached for, the cache is ignored when saved for another server
+    :return: Cached schema, None when missing or invalid
+    """
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        if data.get("version") != SCHEMA_CACHE_VERSION or data.get("server") != server:
+            return None
+
+        schema = SchemaInfo.from_json(data["schema"])
+        info = DsaInfo.from_json(data["info"], schema) if data.get("info") else None
+        return CachedSchema(info, schema, data.get("schema_version"), data["saved_at"])
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Failed to load LDAP schema cache {path}: {e}")
+        return None
+
+
+def save_schema_cache(path: str, server: str, info: Optional[DsaInfo], schema: SchemaInfo,
+                      schema_version: Optional[str]) -> None:
+    """
+    Save the server info and schema to a cache file.
+    The file is replaced atomically, as it may be read by other processes.
+    """
+    data = {
+        "version": SCHEMA_CACHE_VERSION,
+        "server": server,
+        "schema_version": schema_version,
+        "saved_at": time.time(),
+        "info": info.to_json(indent=None) if info else None,
+        "schema": schema.to_json(indent=None),
+    }
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.warning(f"Failed to save LDAP schema cache {path}: {e}")
@@ -29,11 +29,33 @@ class LDAPSettings:
     COLLECT_METRICS: bool = False
     SERVER_OPTIONS: Dict[str, Any] = field(default_factory=dict)
     CONNECTION_OPTIONS: Dict[str, Any] = field(default_factory=dict)
+    CONNECTION_FACTORY: Optional[str] = None
     PRELOAD_DEFINITIONS: Optional[Iterable[Union[str, Tuple[str, Iterable[str]]]]] = (
         ("user", ("sAMAccountName",)),
         "group"
     )
 
+    # schema cache settings
+    SCHEMA_CACHE_DIR: Optional[str] = None
+    SCHEMA_CACHE_TIMEOUT: Optional[float] = 86400
+
+    # connection pool settings
+    POOL_MIN_SIZE: int = 1
+    POOL_MAX_SIZE: int = 10
+    POOL_TIMEOUT: Optional[float] = 10
+    POOL_HEALTH_CHECK_INTERVAL: Optional[float] = 60
+
+    # circuit breaker settings
+    CIRCUIT_FAILURE_THRESHOLD: Optional[int] = 5
+    CIRCUIT_OPEN_INTERVAL: float = 30
+
+    # sync rate limit settings
+    SYNC_RATE: Optional[float] = None
+    SYNC_BURST: Optional[int] = None
+    SYNC_MAX_CONCURRENT: Optional[int] = None
+    SYNC_LIMIT_SHARED: bool = False
+    SYNC_LIMIT_TIMEOUT: Optional[float] = 10
+
     # user sync settings
     USER_FIELD_MAP: Dict[str, str] = field(default_factory=lambda: {
         "username": "sAMAccountName",
@@ -48,6 +70,11 @@ class LDAPSettings:
 
     # groups / permissions sync settings
     GROUP_ATTRS: Union[str, Iterable[str]] = "cn"
+    GROUP_STRATEGY: str = "in_chain"
+    GROUP_TABLE_TIMEOUT: Optional[float] = 3600
+    GROUP_GRAPH_REFRESH_INTERVAL: Optional[float] = 300
+    GROUP_GRAPH_RELOAD_INTERVAL: Optional[float] = 86400
+    GROUP_GRAPH_SNAPSHOT: Optional[str] = None
     SUPERUSER_GROUPS: Optional[Union[str, Iterable[str]]] = "Domain Admins"
     STAFF_GROUPS: Optional[Union[str, Iterable[str]]] = "Administrators"
     ACTIVE_GROUPS: Optional[Union[str, Iterable[str]]] = None
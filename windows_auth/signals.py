@@ -1,3 +1,6 @@
 from django.dispatch import Signal
 
 ldap_user_sync = Signal()
+
+# sent with domain and connection arguments, for every LDAP connection created by an LDAP Manager
+ldap_connection_created = Signal()
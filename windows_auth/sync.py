@@ -0,0 +1,290 @@
+import os
+import time
+from queue import Queue, Full
+from threading import Lock, Thread
+from typing import Optional, Set, List, Dict, TYPE_CHECKING
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from windows_auth import logger
+from windows_auth.conf import WAUTH_RESYNC_DELTA, WAUTH_USE_CACHE, WAUTH_RESYNC_BACKGROUND, \
+    WAUTH_RESYNC_MAX_STALENESS, WAUTH_RESYNC_WORKERS, WAUTH_RESYNC_QUEUE_SIZE, WAUTH_SYNC_LOCK_TIMEOUT, \
+    WAUTH_SYNC_FAILURE_TIMEOUT
+
+if TYPE_CHECKING:
+    from windows_auth.models import LDAPUser
+
+# user sync states
+SYNC_FRESH = "fresh"
+SYNC_STALE = "stale"
+SYNC_EXPIRED = "expired"
+
+
+def to_seconds(value) -> Optional[int]:
+    """
+    Convert a duration setting value to seconds.
+    :param value: timedelta, or any value that can be casted to int
+    :return: Number of seconds, None when the setting is disabled
+    """
+    if value is None or value is False:
+        return None
+    elif isinstance(value, timezone.timedelta):
+        return int(value.total_seconds())
+    else:
+        return int(value)
+
+
+def get_resync_cache_key(user_id: int) -> str:
+    return f"wauth_resync_user_{user_id}"
+
+
+def get_resync_cache_timeout() -> Optional[int]:
+    """
+    Time (seconds) to keep the last sync time in cache.
+    When re-syncing in background, it is kept until the maximum staleness is reached.
+    """
+    resync_delta = to_seconds(WAUTH_RESYNC_DELTA) or 0
+    if not WAUTH_RESYNC_BACKGROUND:
+        return resync_delta
+
+    max_staleness = to_seconds(WAUTH_RESYNC_MAX_STALENESS)
+    if max_staleness is None:
+        return None
+    return max(resync_delta, max_staleness)
+
+
+def get_last_sync(ldap_user: "LDAPUser") -> Optional[timezone.datetime]:
+    """
+    Get the last time the user was synchronized, using cache when WAUTH_USE_CACHE is configured.
+    """
+    if WAUTH_USE_CACHE:
+        last_sync = cache.get(get_resync_cache_key(ldap_user.user_id))
+        if last_sync is True:
+            # marker from before sync time was saved, treat as synced until the key expires
+            return timezone.now()
+        return last_sync
+    else:
+        return ldap_user.last_sync
+
+
+def get_sync_state(ldap_user: "LDAPUser") -> str:
+    """
+    Check whether user needs to be re-synced.
+    :return: SYNC_FRESH when synced within WAUTH_RESYNC_DELTA,
+             SYNC_STALE when synced within WAUTH_RESYNC_MAX_STALENESS,
+             otherwise SYNC_EXPIRED.
+    """
+    last_sync = get_last_sync(ldap_user)
+    if not last_sync:
+        return SYNC_EXPIRED
+
+    age = (timezone.now() - last_sync).total_seconds()
+    if age < (to_seconds(WAUTH_RESYNC_DELTA) or 0):
+        return SYNC_FRESH
+
+    max_staleness = to_seconds(WAUTH_RESYNC_MAX_STALENESS)
+    if max_staleness is None or age < max_staleness:
+        return SYNC_STALE
+    else:
+        return SYNC_EXPIRED
+
+
+class _SyncFlight:
+    """
+    In-process coordination of syncs for a single user.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.completed_at: float = float("-inf")
+        # syncs currently using the flight, removed from the registry when the last one is done
+        self.refs = 0
+
+
+_sync_flights: Dict[int, _SyncFlight] = {}
+_sync_flights_lock = Lock()
+
+
+def _get_sync_flight(user_id: int) -> _SyncFlight:
+    """
+    Get the user's sync flight, must be released using _release_sync_flight().
+    """
+    with _sync_flights_lock:
+        flight = _sync_flights.get(user_id)
+        if flight is None:
+            flight = _sync_flights[user_id] = _SyncFlight()
+        flight.refs += 1
+        return flight
+
+
+def _release_sync_flight(user_id: int, flight: _SyncFlight) -> None:
+    with _sync_flights_lock:
+        flight.refs -= 1
+        if flight.refs <= 0 and _sync_flights.get(user_id) is flight:
+            del _sync_flights[user_id]
+
+
+def get_sync_lease_cache_key(user_id: int) -> str:
+    return f"{get_resync_cache_key(user_id)}_lease"
+
+
+class SyncSkippedError(Exception):
+    """
+    The user was not synced, as a recent sync of the user failed.
+    """
+
+
+def get_sync_failure_cache_key(user_id: int) -> str:
+    return f"{get_resync_cache_key(user_id)}_failed"
+
+
+def set_sync_failed(ldap_user: "LDAPUser") -> None:
+    """
+    Remember the user's sync failed, for WAUTH_SYNC_FAILURE_TIMEOUT seconds.
+    """
+    if WAUTH_SYNC_FAILURE_TIMEOUT:
+        cache.set(get_sync_failure_cache_key(ldap_user.user_id), True, WAUTH_SYNC_FAILURE_TIMEOUT)
+
+
+def is_sync_failed(ldap_user: "LDAPUser") -> bool:
+    """
+    Check whether the user's sync failed within WAUTH_SYNC_FAILURE_TIMEOUT seconds.
+    """
+    return bool(WAUTH_SYNC_FAILURE_TIMEOUT) and bool(cache.get(get_sync_failure_cache_key(ldap_user.user_id)))
+
+
+def sync_once(ldap_user: "LDAPUser", wait: bool = True) -> bool:
+    """
+    Sync user, unless the same user is already being synced.
+
+    Concurrent syncs in the same process wait for the running sync to complete instead of searching LDAP again.
+    Across processes, a lease in the cache makes sure only one process syncs the user, while others proceed
+    with the user's current state.
+
+    :param ldap_user: LDAP User to sync
+    :param wait: Wait for a running sync in this process, otherwise proceed immediately
+    :return: True when the user was synced by this call, False when another sync was relied on
+    """
+    requested_at = time.monotonic()
+    flight = _get_sync_flight(ldap_user.user_id)
+    try:
+        return _sync_in_flight(ldap_user, flight, requested_at, wait)
+    finally:
+        _release_sync_flight(ldap_user.user_id, flight)
+
+
+def _sync_in_flight(ldap_user: "LDAPUser", flight: _SyncFlight, requested_at: float, wait: bool) -> bool:
+    if not flight.lock.acquire(timeout=WAUTH_SYNC_LOCK_TIMEOUT if wait else 0):
+        logger.debug(f"User {ldap_user} is already being synced, proceeding with current state")
+        return False
+
+    try:
+        if flight.completed_at > requested_at:
+            # synced by another thread while waiting
+            return False
+
+        lease_key = get_sync_lease_cache_key(ldap_user.user_id)
+        lease = f"{os.getpid()}-{uuid4().hex}"
+        if not cache.add(lease_key, lease, WAUTH_SYNC_LOCK_TIMEOUT):
+            logger.debug(f"User {ldap_user} is being synced by another process, proceeding with current state")
+            return False
+
+        try:
+            # users that already exist are served with their current state when over the domain's sync limits
+            limiter = ldap_user.get_ldap_manager().sync_limiter
+            if not limiter.acquire():
+                logger.debug(f"Sync limit of domain {ldap_user.domain} reached, "
+                             f"proceeding with current state of user {ldap_user}")
+                return False
+
+            try:
+                ldap_user.sync()
+            finally:
+                limiter.release()
+            flight.completed_at = time.monotonic()
+            return True
+        finally:
+            # release the lease only if it was not expired and taken by another process
+            if cache.get(lease_key) == lease:
+                cache.delete(lease_key)
+    finally:
+        flight.lock.release()
+
+
+class SyncWorkerPool:
+    """
+    Background worker threads for re-syncing users outside of the request / response cycle.
+    Users are queued in a bounded queue, and a user already waiting for sync is not queued again.
+    """
+
+    def __init__(self, workers: int = 2, queue_size: int = 100):
+        self.workers = max(workers, 1)
+        self.queue = Queue(maxsize=queue_size)
+        self._pending: Set[int] = set()
+        self._threads: List[Thread] = []
+        self._lock = Lock()
+
+    def submit(self, ldap_user: "LDAPUser") -> bool:
+        """
+        Queue user for background sync.
+        :param ldap_user: LDAP User to sync
+        :return: True when user is queued or is already waiting for sync, False when the queue is full.
+        """
+        with self._lock:
+            if ldap_user.pk in self._pending:
+                return True
+
+            try:
+                self.queue.put_nowait(ldap_user)
+            except Full:
+                return False
+
+            self._pending.add(ldap_user.pk)
+            self._start_workers()
+        return True
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _start_workers(self):
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = Thread(target=self._work, name=f"wauth-sync-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            ldap_user = self.queue.get()
+            try:
+                close_old_connections()
+                sync_once(ldap_user, wait=False)
+            except Exception:
+                logger.exception(f"Failed to synchronize user {ldap_user} against LDAP in background")
+                # avoid queueing the user again on every request while LDAP is failing
+                set_sync_failed(ldap_user)
+            finally:
+                with self._lock:
+                    self._pending.discard(ldap_user.pk)
+                close_old_connections()
+                self.queue.task_done()
+
+
+_sync_pool: Optional[SyncWorkerPool] = None
+_sync_pool_lock = Lock()
+
+
+def get_sync_pool() -> SyncWorkerPool:
+    """
+    Get or create the process background sync worker pool.
+    """
+    global _sync_pool
+    if _sync_pool is None:
+        with _sync_pool_lock:
+            if _sync_pool is None:
+                _sync_pool = SyncWorkerPool(workers=WAUTH_RESYNC_WORKERS, queue_size=WAUTH_RESYNC_QUEUE_SIZE)
+    return _sync_pool
@@ -0,0 +1,655 @@
+import base64
+import random
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from threading import Lock, local
+from typing import Dict, Optional, Iterable, List, Set, Any, Union, TextIO, Iterator
+
+from django.core.cache import caches, DEFAULT_CACHE_ALIAS
+from django.db import connections, DEFAULT_DB_ALIAS
+from ldap3 import Connection, Server, MOCK_SYNC, OFFLINE_AD_2012_R2
+from ldap3.core.exceptions import LDAPDefinitionError, LDAPSessionTerminatedByServerError
+from ldap3.core.results import RESULT_SUCCESS
+from ldap3.operation.bind import bind_request_to_dict
+from ldap3.operation.search import MATCH_EXTENSIBLE, filter_to_string
+from ldap3.strategy.mockSync import MockSyncStrategy
+from ldap3.utils.conv import to_unicode, unescape_filter_chars, escape_filter_chars
+from ldap3.utils.dn import safe_dn
+
+from windows_auth.latency import LATENCY_OPERATIONS
+from windows_auth.timing import Timing, subscribe, unsubscribe
+
+# Active Directory matching rules
+MATCHING_RULE_BIT_AND = "1.2.840.113556.1.4.803"
+MATCHING_RULE_BIT_OR = "1.2.840.113556.1.4.804"
+MATCHING_RULE_IN_CHAIN = "1.2.840.113556.1.4.1941"
+
+# operation names of the LDAP message types, counted by the emulator
+OPERATIONS = {
+    "bindRequest": "bind",
+    "searchRequest": "search",
+    "addRequest": "add",
+    "modifyRequest": "modify",
+    "delRequest": "delete",
+    "modDNRequest": "modify_dn",
+    "compareRequest": "compare",
+    "extendedReq": "extended",
+}
+
+# cache backend methods counted as cache calls
+CACHE_METHODS = ("get", "set", "add", "delete", "touch", "incr", "decr", "has_key", "get_many", "set_many",
+                 "delete_many", "get_or_set", "clear")
+
+
+def sid_to_bytes(sid: str) -> bytes:
+    """
+    Convert a SID string to its binary representation, as stored in Active Directory
+    """
+    revision, authority, *sub_authorities = (int(part) for part in sid.split("-")[1:])
+    return (bytes([revision, len(sub_authorities)]) + authority.to_bytes(6, "big")
+            + b"".join(sub_authority.to_bytes(4, "little") for sub_authority in sub_authorities))
+
+
+def _to_text(value) -> str:
+    return to_unicode(value) if isinstance(value, (bytes, bytearray)) else str(value)
+
+
+def _filter_to_string(filter_object) -> str:
+    """
+    Convert a search request filter to its string representation.
+    The ldap3 conversion does not support extensible matches, which are used by Active Directory matching rules.
+    """
+    filter_type = filter_object.getName()
+    if filter_type in ("and", "or"):
+        return "(" + ("&" if filter_type == "and" else "|") + "".join(
+            _filter_to_string(component) for component in filter_object[filter_type]) + ")"
+    if filter_type == "notFilter":
+        return "(!" + _filter_to_string(filter_object["notFilter"]["innerNotFilter"]) + ")"
+    if filter_type == "extensibleMatch":
+        assertion = filter_object["extensibleMatch"]
+        filter_string = "("
+        if assertion["type"].hasValue():
+            filter_string += str(assertion["type"])
+        if assertion["dnAttributes"].hasValue() and assertion["dnAttributes"]:
+            filter_string += ":dn"
+        if assertion["matchingRule"].hasValue():
+            filter_string += ":" + str(assertion["matchingRule"])
+        return filter_string + ":=" + escape_filter_chars(_to_text(bytes(assertion["matchValue"]))) + ")"
+    return filter_to_string(filter_object)
+
+
+class ADEmulatorStrategy(MockSyncStrategy):
+    """
+    ldap3 mock strategy emulating Active Directory behaviors over the emulator's directory.
+    """
+
+    def __init__(self, ldap_connection: Connection, emulator: "ADEmulator"):
+        self.emulator = emulator
+        super().__init__(ldap_connection)
+
+    def send(self, message_type, request, controls=None):
+        self.emulator._before_operation(message_type, self)
+        return super().send(message_type, request, controls)
+
+    def mock_bind(self, request_message, controls):
+        # credentials are not checked, bind failures are injected by the emulator
+        request = bind_request_to_dict(request_message)
+        self.bound = request["name"] or "<anonymous>"
+        return {
+            "resultCode": RESULT_SUCCESS,
+            "matchedDN": "",
+            "diagnosticMessage": "",
+            "referral": None,
+            "serverSaslCreds": None,
+        }
+
+    def mock_add(self, request_message, controls):
+        self.emulator._changed()
+        return super().mock_add(request_message, controls)
+
+    def mock_modify(self, request_message, controls):
+        self.emulator._changed()
+        return super().mock_modify(request_message, controls)
+
+    def mock_delete(self, request_message, controls):
+        self.emulator._changed()
+        return super().mock_delete(request_message, controls)
+
+    def mock_modify_dn(self, request_message, controls):
+        self.emulator._changed()
+        return super().mock_modify_dn(request_message, controls)
+
+    def mock_search(self, request_message, controls):
+        self._search_filter = request_message["filter"]
+        return super().mock_search(request_message, controls)
+
+    def _execute_search(self, request):
+        request["filter"] = _filter_to_string(self._search_filter)
+        self.emulator.update_backlinks()
+        responses, result = super()._execute_search(request)
+
+        # tokenGroups is a constructed attribute, only returned by a base scope search
+        attributes = {_to_text(name).lower() for name in request["attributes"]}
+        if request["scope"] == 0 and "tokengroups" in attributes:
+            for response in responses:
+                token_groups = self.emulator.get_token_groups(response["object"])
+                if token_groups:
+                    response["attributes"].append({"type": "tokenGroups", "vals": token_groups})
+
+        return responses, result
+
+    def evaluate_filter_node(self, node, candidates):
+        if node.tag != MATCH_EXTENSIBLE:
+            return super().evaluate_filter_node(node, candidates)
+
+        node.matched = set()
+        node.unmatched = set()
+        rule = node.assertion["matchingRule"]
+        attribute = node.assertion["attr"]
+        value = _to_text(unescape_filter_chars(_to_text(node.assertion["value"])))
+
+        if rule == MATCHING_RULE_IN_CHAIN and attribute and attribute.lower() == "member":
+            # groups the DN is a member of, recursively
+            ancestors = self.emulator.get_ancestors(value)
+            for candidate in candidates:
+                (node.matched if candidate.lower() in ancestors else node.unmatched).add(candidate)
+        elif rule == MATCHING_RULE_IN_CHAIN and attribute and attribute.lower() == "memberof":
+            # entries that are members of the group, recursively
+            for candidate in candidates:
+                ancestors = self.emulator.get_ancestors(candidate)
+                (node.matched if value.lower() in ancestors else node.unmatched).add(candidate)
+        elif rule in (MATCHING_RULE_BIT_AND, MATCHING_RULE_BIT_OR) and attribute:
+            mask = int(value)
+            for candidate in candidates:
+                values = self.connection.server.dit[candidate].get(attribute, [])
+                matched = any(
+                    (int(_to_text(v)) & mask) == mask if rule == MATCHING_RULE_BIT_AND else int(_to_text(v)) & mask
+                    for v in values
+                )
+                (node.matched if matched else node.unmatched).add(candidate)
+        else:
+            self.connection.last_error = f"Extensible match {rule} on {attribute} is not supported by the AD emulator"
+            raise LDAPDefinitionError(self.connection.last_error)
+
+
+class ADEmulator:
+    """
+    In-memory Active Directory emulator for tests and benchmarks, built on the ldap3 mock strategy.
+
+    On top of the mock strategy, the emulator supports the LDAP_MATCHING_RULE_IN_CHAIN and bitwise matching rules,
+    the constructed tokenGroups attribute, and maintains memberOf as a back link of the group member attribute.
+    Binds always succeed. Latency and failures can be injected to every LDAP operation.
+    """
+
+    def __init__(self, search_base: str = "DC=test,DC=local", domain_sid: str = "S-1-5-21-1000-2000-3000",
+                 latency: float = 0, jitter: float = 0, failure_rate: float = 0, seed: Optional[int] = None):
+        """
+        :param search_base: Base DN of the directory
+        :param domain_sid: SID of the domain, object SIDs are allocated from it
+        :param latency: Time (seconds) added to every operation
+        :param jitter: Maximum random time (seconds) added to the latency
+        :param failure_rate: Probability of an operation to fail, terminating its connection
+        :param seed: Random seed for the jitter and failures
+        """
+        self.search_base = search_base
+        self.domain_sid = domain_sid
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.operations = Counter()
+
+        self._random = random.Random(seed)
+        self._lock = Lock()
+        self._fail_next = 0
+        self._next_rid = 1100
+        # direct parent groups of each entry, by lowercase DN, rebuilt when the directory changes
+        self._parents: Dict[str, Set[str]] = {}
+        self._changed_since_update = True
+
+        self.server = Server("emulator", get_info=OFFLINE_AD_2012_R2)
+        self._admin = self.connect(self.server)
+        self.add_entry(self.search_base, {"objectClass": ["top", "domain", "domainDNS"]})
+        self.operations.clear()
+
+    @property
+    def dit(self):
+        return self.server.dit
+
+    def connect(self, server: Optional[Server] = None, user: Optional[str] = None, password: Optional[str] = None,
+                **options) -> Connection:
+        """
+        Create a bound connection to the emulated directory.
+        :param server: ldap3 Server to connect, attached to the emulated directory
+        :param user: Bind user
+        :param password: Bind password
+        :param options: Extra ldap3 Connection parameters
+        """
+        server = server or self.server
+        if server is not self.server:
+            server.dit = self.server.dit
+            server.dit_lock = self.server.dit_lock
+            if server.schema is None:
+                server.attach_dsa_info(self.server.info)
+                server.attach_schema_info(self.server.schema)
+
+        # the emulator binds using a simple bind, using its own strategy
+        for option in ("client_strategy", "auto_bind", "authentication"):
+            options.pop(option, None)
+        connection = Connection(server, user=user, password=password, client_strategy=MOCK_SYNC, **options)
+        strategy = ADEmulatorStrategy(connection, self)
+        connection.strategy = strategy
+        connection.send = strategy.send
+        connection.open = strategy.open
+        connection.get_response = strategy.get_response
+        connection.post_send_single_response = strategy.post_send_single_response
+        connection.post_send_search = strategy.post_send_search
+
+        connection.bind()
+        return connection
+
+    def add_entry(self, dn: str, attributes: Dict[str, Any]) -> str:
+        self._admin.strategy.add_entry(dn, attributes)
+        self._changed()
+        return dn
+
+    def remove_entry(self, dn: str) -> None:
+        self._admin.strategy.remove_entry(dn)
+        self._changed()
+
+    def allocate_sid(self) -> str:
+        with self._lock:
+            self._next_rid += 1
+            return f"{self.domain_sid}-{self._next_rid}"
+
+    def add_group(self, name: str, members: Iterable[str] = (), dn: Optional[str] = None, rid: Optional[int] = None,
+                  **attributes) -> str:
+        """
+        Add a group to the directory.
+        :param name: Group name (cn and sAMAccountName)
+        :param members: DNs of the group members, users or groups
+        :param dn: Group DN, defaults to the group name under the search base
+        :param rid: Relative ID of the group SID, allocated when not provided
+        :param attributes: Extra LDAP attributes
+        :return: Group DN
+        """
+        members = list(members)
+        return self.add_entry(dn or f"CN={name},{self.search_base}", {
+            "objectClass": ["top", "group"],
+            "objectCategory": "group",
+            "cn": name,
+            "sAMAccountName": name,
+            "objectSid": sid_to_bytes(f"{self.domain_sid}-{rid}" if rid else self.allocate_sid()),
+            "whenChanged": datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S.0Z"),
+            **({"member": members} if members else {}),
+            **attributes,
+        })
+
+    def add_user(self, username: str, groups: Iterable[str] = (), dn: Optional[str] = None, rid: Optional[int] = None,
+                 primary_group_rid: int = 513, **attributes) -> str:
+        """
+        Add a user to the directory.
+        :param username: User logon name (cn and sAMAccountName)
+        :param groups: DNs of the groups the user is a direct member of
+        :param dn: User DN, defaults to the username under the search base
+        :param rid: Relative ID of the user SID, allocated when not provided
+        :param primary_group_rid: Relative ID of the user's primary group, included in tokenGroups
+        :param attributes: Extra LDAP attributes
+        :return: User DN
+        """
+        dn = self.add_entry(dn or f"CN={username},{self.search_base}", {
+            "objectClass": ["top", "person", "organizationalPerson", "user"],
+            "objectCategory": "person",
+            "cn": username,
+            "sAMAccountName": username,
+            "objectSid": sid_to_bytes(f"{self.domain_sid}-{rid}" if rid else self.allocate_sid()),
+            "primaryGroupID": str(primary_group_rid),
+            "userAccountControl": "512",
+            **attributes,
+        })
+        for group in groups:
+            self.add_member(group, dn)
+        return dn
+
+    def add_member(self, group_dn: str, member_dn: str) -> None:
+        with self.server.dit_lock:
+            group = self.dit[safe_dn(group_dn)]
+            group["member"] = [*group.get("member", []), member_dn.encode("utf-8")]
+        self._changed()
+
+    def remove_member(self, group_dn: str, member_dn: str) -> None:
+        with self.server.dit_lock:
+            group = self.dit[safe_dn(group_dn)]
+            group["member"] = [value for value in group.get("member", [])
+                               if _to_text(value).lower() != member_dn.lower()]
+        self._changed()
+
+    def load_ldif(self, source: Union[str, TextIO]) -> List[str]:
+        """
+        Add the entries of an LDIF file to the directory.
+        :param source: LDIF file path or file object
+        :return: DNs of the added entries
+        """
+        if isinstance(source, str):
+            with open(source, "r", encoding="utf-8") as f:
+                return self.load_ldif(f)
+
+        dns = []
+        for dn, attributes in _parse_ldif(source):
+            dns.append(self.add_entry(dn, attributes))
+        return dns
+
+    def fail_next(self, count: int = 1) -> None:
+        """
+        Fail the next operations, terminating their connections.
+        """
+        with self._lock:
+            self._fail_next += count
+
+    def reset_operations(self) -> None:
+        self.operations.clear()
+
+    def update_backlinks(self) -> None:
+        """
+        Rebuild memberOf of all entries from the member attribute of the groups, when the directory changed.
+        """
+        if not self._changed_since_update:
+            return
+
+        with self.server.dit_lock:
+            self._changed_since_update = False
+            parents = {}
+            for dn, entry in self.dit.items():
+                for member in entry.get("member", []):
+                    parents.setdefault(_to_text(member).lower(), set()).add(dn)
+
+            for dn, entry in self.dit.items():
+                member_of = parents.get(dn.lower())
+                if member_of:
+                    entry["memberOf"] = [group.encode("utf-8") for group in sorted(member_of)]
+                elif "memberOf" in entry:
+                    del entry["memberOf"]
+
+            self._parents = {dn: {group.lower() for group in groups} for dn, groups in parents.items()}
+
+    def get_ancestors(self, dn: str) -> Set[str]:
+        """
+        Get the lowercase DNs of all groups an entry is a member of, recursively.
+        """
+        self.update_backlinks()
+        parents = self._parents
+        ancestors = set()
+        stack = list(parents.get(dn.lower(), ()))
+        while stack:
+            group = stack.pop()
+            if group not in ancestors:
+                ancestors.add(group)
+                stack.extend(parents.get(group, ()))
+        return ancestors
+
+    def get_token_groups(self, dn: str) -> List[bytes]:
+        """
+        Get the SIDs of all groups an entry is a member of, recursively, including its primary group.
+        """
+        entry = self.dit.get(dn)
+        if entry is None:
+            return []
+
+        sids = []
+        for group in sorted(self.get_ancestors(dn)):
+            group_entry = self.dit.get(group)
+            if group_entry is not None and group_entry.get("objectSid"):
+                sids.append(group_entry["objectSid"][0])
+
+        primary_group = entry.get("primaryGroupID")
+        if primary_group:
+            sids.append(sid_to_bytes(f"{self.domain_sid}-{_to_text(primary_group[0])}"))
+        return sids
+
+    def _changed(self) -> None:
+        self._changed_since_update = True
+
+    def _before_operation(self, message_type: str, strategy: ADEmulatorStrategy) -> None:
+        operation = OPERATIONS.get(message_type)
+        if operation is None:
+            # unbind and abandon are never delayed or failed
+            return
+
+        with self._lock:
+            self.operations[operation] += 1
+            if self._fail_next:
+                self._fail_next -= 1
+                fail = True
+            else:
+                fail = bool(self.failure_rate) and self._random.random() < self.failure_rate
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+
+        if delay:
+            time.sleep(delay)
+        if fail:
+            strategy.close()
+            raise LDAPSessionTerminatedByServerError(f"Emulated {operation} failure")
+
+
+def _parse_ldif(source: TextIO) -> Iterable[tuple]:
+    # minimal LDIF content parser, supporting folded lines and base64 values
+    lines = []
+    for line in source:
+        line = line.rstrip("\r\n")
+        if line.startswith(" ") and lines:
+            lines[-1] += line[1:]
+        else:
+            lines.append(line)
+
+    dn, attributes = None, {}
+    for line in [*lines, ""]:
+        if not line:
+            if dn is not None:
+                yield dn, attributes
+            dn, attributes = None, {}
+            continue
+        if line.startswith("#") or line.startswith("version:"):
+            continue
+
+        name, _, value = line.partition(":")
+        if value.startswith(":"):
+            value = base64.b64decode(value[1:].strip())
+            if name.lower() != "objectsid":
+                value = value.decode("utf-8")
+        else:
+            value = value.strip()
+
+        if name.lower() == "dn":
+            dn = value
+        else:
+            attributes.setdefault(name, []).append(value)
+
+
+_emulators: Dict[str, ADEmulator] = {}
+_emulators_lock = Lock()
+
+
+def get_emulator(domain: str, search_base: Optional[str] = None) -> ADEmulator:
+    """
+    Get or create the emulated directory of a domain.
+    :param domain: Domain NetBIOS name
+    :param search_base: Base DN of a created directory
+    """
+    with _emulators_lock:
+        emulator = _emulators.get(domain)
+        if emulator is None:
+            emulator = _emulators[domain] = ADEmulator(search_base=search_base or f"DC={domain.lower()},DC=local")
+        return emulator
+
+
+def set_emulator(domain: str, emulator: Optional[ADEmulator]) -> None:
+    """
+    Set the emulated directory of a domain, None to remove it.
+    """
+    with _emulators_lock:
+        if emulator is None:
+            _emulators.pop(domain, None)
+        else:
+            _emulators[domain] = emulator
+
+
+def emulator_connection(manager, server: Server) -> Connection:
+    """
+    Connection factory connecting the LDAP Managers to the emulated directory of their domain,
+    used by setting CONNECTION_FACTORY LDAP setting to "windows_auth.testing.emulator_connection".
+    """
+    emulator = get_emulator(manager.domain, manager.settings.SEARCH_BASE)
+    return emulator.connect(
+        server,
+        user=manager.settings.USERNAME,
+        password=manager.settings.PASSWORD,
+        read_only=manager.settings.READ_ONLY,
+        collect_usage=manager.settings.COLLECT_METRICS,
+        **manager.settings.CONNECTION_OPTIONS,
+    )
+
+
+class CallCounter:
+    """
+    Count the DB queries, cache calls and LDAP operations performed while counting.
+
+    Django database connections and caches are per thread, so every thread to be counted enters count().
+    LDAP operations are the bind and search timers of the LDAP Managers.
+    """
+
+    def __init__(self, using: str = DEFAULT_DB_ALIAS, cache_alias: str = DEFAULT_CACHE_ALIAS):
+        """
+        :param using: Database alias to count queries of
+        :param cache_alias: Cache alias to count calls of
+        """
+        self.using = using
+        self.cache_alias = cache_alias
+        self.db_queries = 0
+        self.cache_calls = 0
+        self.ldap_operations = 0
+        self._lock = Lock()
+        self._local = local()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.db_queries = self.cache_calls = self.ldap_operations = 0
+
+    @contextmanager
+    def count(self) -> Iterator["CallCounter"]:
+        """
+        Count the calls of the current thread.
+        """
+        cache = caches[self.cache_alias]
+        patched = [name for name in CACHE_METHODS if hasattr(cache, name) and name not in vars(cache)]
+        for name in patched:
+            setattr(cache, name, self._wrap_cache_method(getattr(cache, name)))
+        self._local.active = True
+        self._local.depth = 0
+        subscribe(self._on_timing)
+        try:
+            with connections[self.using].execute_wrapper(self._count_query):
+                yield self
+        finally:
+            self._local.active = False
+            for name in patched:
+                delattr(cache, name)
+
+    def close(self) -> None:
+        """
+        Stop receiving the LDAP operation timings.
+        """
+        unsubscribe(self._on_timing)
+
+    def __enter__(self) -> "CallCounter":
+        self._context = self.count()
+        return self._context.__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self._context.__exit__(exc_type, exc_val, exc_tb)
+        self.close()
+
+    def _count_query(self, execute, sql, params, many, context):
+        with self._lock:
+            self.db_queries += 1
+        return execute(sql, params, many, context)
+
+    def _wrap_cache_method(self, method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            # backend methods calling each other are a single call
+            if not self._local.depth:
+                with self._lock:
+                    self.cache_calls += 1
+            self._local.depth += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._local.depth -= 1
+        return wrapper
+
+    def _on_timing(self, timing: Timing) -> None:
+        if timing.name in LATENCY_OPERATIONS and getattr(self._local, "active", False):
+            with self._lock:
+                self.ldap_operations += 1
+
+
+def check_budget(counter: CallCounter, db: Optional[float] = None, cache: Optional[float] = None,
+                 ldap: Optional[float] = None, per: int = 1) -> None:
+    """
+    Raise AssertionError when the counted calls exceed the budget.
+    :param counter: Call counter
+    :param db: Maximum DB queries, None for no limit
+    :param cache: Maximum cache calls, None for no limit
+    :param ldap: Maximum LDAP operations, None for no limit
+    :param per: Number of units (e.g. requests) the budget is given for
+    """
+    exceeded = [
+        f"{name} {count / per:g} > {budget:g}"
+        for name, count, budget in (("DB queries", counter.db_queries, db),
+                                    ("cache calls", counter.cache_calls, cache),
+                                    ("LDAP operations", counter.ldap_operations, ldap))
+        if budget is not None and count / per > budget
+    ]
+    if exceeded:
+        raise AssertionError(f"Call budget exceeded{' per request' if per != 1 else ''}: {', '.join(exceeded)}")
+
+
+@contextmanager
+def assert_max_calls(db: Optional[int] = None, cache: Optional[int] = None, ldap: Optional[int] = None,
+                     using: str = DEFAULT_DB_ALIAS, cache_alias: str = DEFAULT_CACHE_ALIAS) -> Iterator[CallCounter]:
+    """
+    Assert the code block does not exceed a budget of DB queries, cache calls and LDAP operations.
+    Unlike assertNumQueries, any number of calls up to the budget passes.
+    """
+    with CallCounter(using, cache_alias) as counter:
+        yield counter
+    check_budget(counter, db, cache, ldap)
+
+
+def assert_request_budget(client, path: str, db: Optional[float] = None, cache: Optional[float] = None,
+                          ldap: Optional[float] = None, warmup: int = 1, requests: int = 3, **extra) -> CallCounter:
+    """
+    Assert steady-state requests do not exceed a budget of DB queries, cache calls and LDAP operations per request.
+    The first requests create and sync the user and its session, and are not counted.
+    :param client: Django test client
+    :param path: Requested path
+    :param db: Maximum DB queries per request
+    :param cache: Maximum cache calls per request
+    :param ldap: Maximum LDAP operations per request
+    :param warmup: Number of requests before counting
+    :param requests: Number of counted requests
+    :param extra: Extra request environ, e.g. REMOTE_USER
+    :return: Counter of the counted requests
+    """
+    for _ in range(warmup):
+        client.get(path, **extra)
+
+    with CallCounter() as counter:
+        for _ in range(requests):
+            response = client.get(path, **extra)
+            if response.status_code >= 400:
+                raise AssertionError(f"Request to {path} failed with status code {response.status_code}")
+    check_budget(counter, db, cache, ldap, per=requests)
+    return counter
@@ -0,0 +1,98 @@
+from logging import Logger, DEBUG
+from threading import Lock
+from time import perf_counter_ns
+from typing import Callable, NamedTuple, Optional, Tuple, Any
+
+from windows_auth import logger as default_logger
+
+
+class Timing(NamedTuple):
+    """
+    Duration of a named timer, delivered to the timing subscribers.
+    """
+    name: str
+    domain: Optional[str]
+    duration_ns: int
+    error: bool
+
+    @property
+    def seconds(self) -> float:
+        return self.duration_ns / 1e9
+
+
+TimingSubscriber = Callable[[Timing], None]
+
+# replaced as a whole on change, so timers iterate it without locking
+_subscribers: Tuple[TimingSubscriber, ...] = ()
+_subscribers_lock = Lock()
+
+
+def subscribe(subscriber: TimingSubscriber) -> None:
+    """
+    Receive the timings of all timers.
+    Subscribers are called from the timed thread, and should return quickly.
+    """
+    global _subscribers
+    with _subscribers_lock:
+        if subscriber not in _subscribers:
+            _subscribers = (*_subscribers, subscriber)
+
+
+def unsubscribe(subscriber: TimingSubscriber) -> None:
+    global _subscribers
+    with _subscribers_lock:
+        _subscribers = tuple(s for s in _subscribers if s != subscriber)
+
+
+class Timer:
+    """
+    Time a code block using a monotonic nanosecond clock, notifying the timing subscribers and logging the duration.
+
+    The clock is not read when there are no subscribers and the log level is disabled.
+    The log message is a %-style format string, formatted only when it is logged,
+    e.g. Timer("search_user", domain, "Query LDAP User %s", user).
+    """
+
+    __slots__ = ("name", "domain", "msg", "args", "logger", "level", "_start")
+
+    def __init__(self, name: str, domain: Optional[str] = None, msg: Optional[str] = None, *args: Any,
+                 logger: Logger = default_logger, level: int = DEBUG):
+        """
+        :param name: Timer name, used by subscribers to identify the timed operation
+        :param domain: Domain of the timed operation
+        :param msg: Log message format, the duration is appended to the message
+        :param args: Log message arguments
+        :param logger: Logger to be used
+        :param level: The log level to use
+        """
+        self.name = name
+        self.domain = domain
+        self.msg = msg
+        self.args = args
+        self.logger = logger
+        self.level = level
+        self._start: Optional[int] = None
+
+    def __enter__(self) -> "Timer":
+        if _subscribers or (self.msg is not None and self.logger.isEnabledFor(self.level)):
+            self._start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if self._start is None:
+            return
+
+        duration_ns = perf_counter_ns() - self._start
+        self._start = None
+
+        if self.msg is not None and self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, self.msg + ": %.3f ms", *self.args, duration_ns / 1e6)
+
+        subscribers = _subscribers
+        if subscribers:
+            timing = Timing(self.name, self.domain, duration_ns, exc_type is not None)
+            for subscriber in subscribers:
+                try:
+                    subscriber(timing)
+                except Exception:
+                    default_logger.exception(f"Timing subscriber {subscriber} failed")
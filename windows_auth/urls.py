@@ -0,0 +1,9 @@
+from django.urls import path
+
+from windows_auth import views
+
+app_name = "windows_auth"
+
+urlpatterns = [
+    path("metrics/", views.ldap_metrics, name="ldap_metrics"),
+]
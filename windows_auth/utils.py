@@ -1,6 +1,7 @@
 from functools import wraps
 from logging import Logger, DEBUG
 from re import finditer
+from time import perf_counter_ns
 from typing import Union, Callable, Optional, Tuple, Iterable, Any, Dict
 
 from django.utils import timezone
@@ -19,6 +20,7 @@ class LogExecutionTime:
         Log execution time of a code block.
         msg may be a static string, or a method that receives the same arguments provided to the underlying function,
         that returns in a string (eg. log_execution_time(lambda self: f"Executing method for {self}").
+        Prefer windows_auth.timing.Timer, which formats the message only when logged.
         :param msg: Message to add with the execution time
         :param logger: Logger to be used
         :param level: The log level to use
@@ -30,18 +32,20 @@ class LogExecutionTime:
         self.start_time = None
         self.context = context
 
-    def _get_message(self) -> str:
+    def _get_message(self, elapsed: timezone.timedelta) -> str:
         if callable(self.msg):
             args, kwargs = self.context or ([], {})
-            return f"{self.msg(*args, **kwargs)}: {timezone.now() - self.start_time}"
+            return f"{self.msg(*args, **kwargs)}: {elapsed}"
         else:
-            return f"{self.msg}: {timezone.now() - self.start_time}"
+            return f"{self.msg}: {elapsed}"
 
     def __enter__(self):
-        self.start_time = timezone.now()
+        self.start_time = perf_counter_ns() if self.logger.isEnabledFor(self.level) else None
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.logger.log(self.level, self._get_message())
+        if self.start_time is not None:
+            elapsed = timezone.timedelta(microseconds=(perf_counter_ns() - self.start_time) / 1000)
+            self.logger.log(self.level, self._get_message(elapsed))
 
 
 def log_execution_time(msg: Union[Callable, str], logger: Logger = default_logger, level: int = DEBUG):
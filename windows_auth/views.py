@@ -0,0 +1,34 @@
+from ipaddress import ip_address, ip_network
+
+from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
+from django.views.decorators.cache import never_cache
+
+from windows_auth.conf import WAUTH_METRICS_ALLOWED_IPS
+from windows_auth.latency import get_latency_registry, collect_latency, render_latency
+
+
+def is_metrics_client_allowed(request: HttpRequest) -> bool:
+    """
+    Check whether the client address is allowed by the WAUTH_METRICS_ALLOWED_IPS setting.
+    """
+    if WAUTH_METRICS_ALLOWED_IPS is None:
+        return True
+
+    try:
+        address = ip_address(request.META.get("REMOTE_ADDR", ""))
+    except ValueError:
+        return False
+    return any(address in ip_network(allowed, strict=False) for allowed in WAUTH_METRICS_ALLOWED_IPS)
+
+
+@never_cache
+def ldap_metrics(request: HttpRequest) -> HttpResponse:
+    """
+    Expose the LDAP latency histograms of all the project's processes in the Prometheus text format.
+    """
+    if not is_metrics_client_allowed(request):
+        return HttpResponseForbidden()
+
+    # make sure the latest observations of this process are included
+    get_latency_registry().publish()
+    return HttpResponse(render_latency(collect_latency()), content_type="text/plain; version=0.0.4; charset=utf-8")